@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+待办事项内存占用基准测试
+比较每个待办事项在两种内存表示下占用的字节数:
+- 之前: 每项一个完整的pydantic Todo模型(datetime对象、字符串优先级)
+- 之后: 每项一个 __slots__ 紧凑记录 TodoRecord(整数优先级和微秒时间戳)
+
+运行方式:
+python bench_memory.py --count 100000
+"""
+
+import argparse
+import gc
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from main import Todo, TodoRecord, PRIORITY_CODES, datetime_to_micros
+
+PRIORITIES = ("low", "medium", "high")
+
+
+def make_fields(index: int, base: datetime) -> dict:
+    """生成第 index 个待办事项的字段"""
+    created_at = base + timedelta(seconds=index)
+    return {
+        "id": str(uuid.uuid4()),
+        "title": f"待办事项 {index}",
+        "description": f"第 {index} 个待办事项的描述" if index % 2 else None,
+        "priority": PRIORITIES[index % 3],
+        "completed": index % 4 == 0,
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+
+def build_models(count: int) -> dict:
+    """之前的表示: id -> pydantic Todo"""
+    base = datetime.now()
+    todos = {}
+    for index in range(count):
+        todo = Todo(**make_fields(index, base))
+        todos[todo.id] = todo
+    return todos
+
+
+def build_records(count: int) -> dict:
+    """之后的表示: id -> TodoRecord"""
+    base = datetime.now()
+    todos = {}
+    for index in range(count):
+        fields = make_fields(index, base)
+        todos[fields["id"]] = TodoRecord(
+            id=fields["id"],
+            title=fields["title"],
+            description=fields["description"],
+            priority=PRIORITY_CODES[fields["priority"]],
+            completed=fields["completed"],
+            created_at=datetime_to_micros(fields["created_at"]),
+            updated_at=datetime_to_micros(fields["updated_at"]),
+        )
+    return todos
+
+
+def measure(builder, count: int) -> float:
+    """返回构建 count 个待办事项后每项增加的字节数"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    todos = builder(count)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    assert len(todos) == count
+    del todos
+    return allocated / count
+
+
+def main():
+    """运行基准测试并打印结果"""
+    parser = argparse.ArgumentParser(description="比较待办事项两种内存表示的占用")
+    parser.add_argument("--count", type=int, default=100000, help="待办事项数量")
+    args = parser.parse_args()
+
+    print(f"待办事项数量: {args.count}")
+    models = measure(build_models, args.count)
+    records = measure(build_records, args.count)
+
+    print(f"{'表示方式':<24}{'字节/项':>12}")
+    print(f"{'pydantic Todo (之前)':<24}{models:>12.1f}")
+    print(f"{'TodoRecord (之后)':<24}{records:>12.1f}")
+    print(f"节省: {(1 - records / models) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+单工作进程与多工作进程的吞吐量对比
+用 `python main.py serve` 分别以不同的工作进程数启动服务(共享SQLite后端, 每次使用新的数据库),
+用 loadtest.py 的负载生成器压测相同的时长, 输出每种配置的吞吐量、各端点延迟和相对单进程的加速比.
+
+负载生成器本身运行在一个进程中, 在核数较少的机器上它可能先成为瓶颈;
+这时可以在另一台机器上运行 `loadtest.py --url` 压测 `main.py serve`.
+
+运行方式:
+python bench_serve.py --workers 1,4 --clients 64 --duration 15 --output serve.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+from loadtest import run_load_test
+
+# 多进程时读请求占多数, 写入在SQLite中串行化
+DEFAULT_MIX = "create=1,get=6,list=2,search=1,update=1,stats=1"
+HERE = Path(__file__).resolve().parent
+
+
+def free_port() -> int:
+    """找一个空闲的本地端口"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, port: int, db_file: str) -> subprocess.Popen:
+    """以生产模式启动服务, 等待它开始响应"""
+    env = dict(os.environ, TODO_STORAGE_BACKEND="shared", TODO_SQLITE_FILE=db_file)
+    process = subprocess.Popen(
+        [sys.executable, "main.py", "serve", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers)],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务启动失败, 退出码 {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("等待服务启动超时")
+
+
+def stop_server(process: subprocess.Popen, timeout: float = 30) -> int:
+    """发送 SIGTERM 并等待服务排空请求后退出, 返回退出码"""
+    process.send_signal(signal.SIGTERM)
+    try:
+        return process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return process.wait()
+
+
+def bench_workers(workers: int, clients: int, duration: float, mix: str,
+                  todos: int) -> Dict[str, Any]:
+    """启动 workers 个工作进程的服务并压测一次"""
+    temp_dir = tempfile.mkdtemp()
+    port = free_port()
+    process = start_server(workers, port, str(Path(temp_dir) / "todos.db"))
+    try:
+        report = asyncio.run(run_load_test(url=f"http://127.0.0.1:{port}", clients=clients,
+                                           duration=duration, mix=mix, todos=todos))
+    finally:
+        report_exit = stop_server(process)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    report["server_exit_code"] = report_exit
+    return report
+
+
+def compare_workers(worker_counts: List[int], clients: int, duration: float, mix: str,
+                    todos: int) -> Dict[str, Any]:
+    """依次压测各种工作进程数, 汇总吞吐量和加速比"""
+    results = {}
+    for workers in worker_counts:
+        print(f"工作进程数 {workers} ...", file=sys.stderr)
+        results[str(workers)] = bench_workers(workers, clients, duration, mix, todos)
+
+    baseline = results[str(worker_counts[0])]["throughput_rps"]
+    summary = {
+        workers: {
+            "throughput_rps": result["throughput_rps"],
+            "speedup": round(result["throughput_rps"] / baseline, 2) if baseline else None,
+            "errors": result["errors"],
+            "p99_ms": {name: endpoint["p99_ms"] for name, endpoint in result["endpoints"].items()},
+        }
+        for workers, result in results.items()
+    }
+    return {
+        "meta": {
+            "cpu_count": os.cpu_count(),
+            "clients": clients,
+            "duration": duration,
+            "mix": mix,
+            "todos": todos,
+        },
+        "summary": summary,
+        "results": results,
+    }
+
+
+def main():
+    """运行对比并输出JSON结果"""
+    default_workers = f"1,{os.cpu_count() or 1}" if (os.cpu_count() or 1) > 1 else "1,2"
+    parser = argparse.ArgumentParser(description="单工作进程与多工作进程的吞吐量对比")
+    parser.add_argument("--workers", default=default_workers, help="逗号分隔的工作进程数")
+    parser.add_argument("--clients", type=int, default=64, help="并发虚拟客户端数量")
+    parser.add_argument("--duration", type=float, default=15.0, help="每种配置的压测时长(秒)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="各操作的权重")
+    parser.add_argument("--todos", type=int, default=1000, help="压测前预先创建的待办事项数量")
+    parser.add_argument("--output", help="结果写入的JSON文件, 不指定时打印到标准输出")
+    args = parser.parse_args()
+
+    report = compare_workers([int(workers) for workers in args.workers.split(",")],
+                             args.clients, args.duration, args.mix, args.todos)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+        print(json.dumps(report["summary"], ensure_ascii=False, indent=2))
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
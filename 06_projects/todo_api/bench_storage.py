@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+TodoStorage 操作的规模基准测试
+在不同数据量(默认1千、10万、100万)下测量:
+- create_todo / get_todo / update_todo / delete_todo 以及各种过滤组合的 filter_todos
+  (开启组提交, 只测内存中的操作, 不含落盘; 关闭查询缓存, 否则重复的过滤查询
+  只是在测缓存命中)
+- 各快照格式的 save_todos / load_todos
+输出每种操作的吞吐量(ops/s)、单次延迟(p50/p99微秒)和该数据量下进程的内存峰值,
+结果以JSON保存, 可以和之前保存的基线比较, 吞吐量下降超过阈值时以非零状态退出.
+
+每个数据量在单独的子进程中运行, 内存峰值互不影响.
+
+运行方式:
+python bench_storage.py --output results.json
+python bench_storage.py --sizes 1000,100000 --baseline baseline.json --threshold 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from main import (TodoStorage, TodoRecord, TodoCreate, TodoUpdate, PRIORITY_CODES,
+                  datetime_to_micros)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PRIORITIES = ("low", "medium", "high")
+WORDS = ("报告", "会议", "购物", "学习", "运动")
+SEARCH_TERM = "会议"
+
+# filter_todos 的过滤条件组合, 每个组合都按API的默认分页大小取一页
+FILTER_OPTIONS = {
+    "status": "pending",
+    "priority": "high",
+    "search": SEARCH_TERM,
+}
+PAGE_SIZE = 50
+
+
+def make_records(count: int, seed: int = 0) -> List[TodoRecord]:
+    """生成 count 个待办事项记录"""
+    rng = random.Random(seed)
+    base = datetime_to_micros(datetime(2024, 1, 1))
+    records = []
+    for index in range(count):
+        created_at = base + index * 1_000_000
+        records.append(TodoRecord(
+            id=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            title=f"{WORDS[index % len(WORDS)]} 待办 {index}",
+            description=f"第 {index} 个待办事项的描述" if index % 2 else None,
+            priority=PRIORITY_CODES[PRIORITIES[index % 3]],
+            completed=index % 4 == 0,
+            created_at=created_at,
+            updated_at=created_at,
+        ))
+    return records
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """最近秩法计算百分位数, 输入必须已排序"""
+    rank = max(1, round(fraction * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def time_each(func: Callable[[Any], Any], args: List[Any]) -> Dict[str, float]:
+    """对每个参数调用一次 func, 返回吞吐量和单次延迟(微秒)"""
+    latencies = []
+    start = time.perf_counter()
+    for arg in args:
+        op_start = time.perf_counter_ns()
+        func(arg)
+        latencies.append((time.perf_counter_ns() - op_start) / 1000)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "ops": len(args),
+        "ops_per_sec": round(len(args) / elapsed, 1),
+        "mean_us": round(sum(latencies) / len(latencies), 2),
+        "p50_us": round(percentile(latencies, 0.50), 2),
+        "p99_us": round(percentile(latencies, 0.99), 2),
+    }
+
+
+def time_once(func: Callable[[], Any]) -> Dict[str, float]:
+    """调用一次 func(用于加载和保存), 返回耗时"""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    return {
+        "ops": 1,
+        "ops_per_sec": round(1 / elapsed, 3),
+        "seconds": round(elapsed, 4),
+    }
+
+
+def peak_rss_mb() -> Optional[float]:
+    """当前进程的内存峰值(MB), 不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是KB, macOS 上是字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def filter_combinations() -> List[Dict[str, str]]:
+    """过滤条件的所有组合(包括不过滤)"""
+    names = list(FILTER_OPTIONS)
+    return [
+        {name: FILTER_OPTIONS[name] for name in chosen}
+        for length in range(len(names) + 1)
+        for chosen in itertools.combinations(names, length)
+    ]
+
+
+def bench_size(size: int, ops: int, formats: List[str], seed: int = 0) -> Dict[str, Any]:
+    """在 size 个待办事项上运行所有基准测试"""
+    rng = random.Random(seed)
+    results: Dict[str, Any] = {}
+    temp_dir = tempfile.mkdtemp()
+    try:
+        records = make_records(size, seed)
+        storage = None
+        # 加载时会打印信息, 基准测试中不需要
+        with contextlib.redirect_stdout(io.StringIO()):
+            for snapshot_format in formats:
+                data_file = str(Path(temp_dir) / f"todos-{snapshot_format}.json")
+                writer = TodoStorage(data_file, snapshot_format=snapshot_format)
+                writer.todos = {record.id: record for record in records}
+                writer._rebuild_indexes()
+                results[f"save_todos[{snapshot_format}]"] = time_once(writer.save_todos)
+                del writer
+                results[f"load_todos[{snapshot_format}]"] = time_once(
+                    lambda: TodoStorage(data_file, snapshot_format=snapshot_format))
+            storage = TodoStorage(data_file, snapshot_format=formats[-1], query_cache_size=0)
+        del records
+        # 修改只在内存中生效, 不触发落盘
+        storage.group_commit = True
+
+        ids = list(storage.todos)
+        creates = [TodoCreate(title=f"{WORDS[index % len(WORDS)]} 新建 {index}",
+                              priority=PRIORITIES[index % 3]) for index in range(ops)]
+        created: List[str] = []
+        results["create_todo"] = time_each(
+            lambda todo_create: created.append(storage.create_todo(todo_create).id), creates)
+        ids.extend(created)
+
+        results["get_todo"] = time_each(storage.get_todo, rng.choices(ids, k=ops))
+        updates = [(todo_id, TodoUpdate(completed=rng.random() < 0.5,
+                                        priority=rng.choice(PRIORITIES)))
+                   for todo_id in rng.choices(ids, k=ops)]
+        results["update_todo"] = time_each(lambda update: storage.update_todo(*update), updates)
+
+        for filters in filter_combinations():
+            name = "+".join(filters) or "none"
+            results[f"filter_todos[{name}]"] = time_each(
+                lambda _: storage.filter_todos(limit=PAGE_SIZE, **filters), range(ops))
+
+        # 删除刚才新建的待办事项, 数据量回到 size
+        results["delete_todo"] = time_each(storage.delete_todo, created)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def run_benchmarks(sizes: List[int], ops: int, formats: List[str],
+                   seed: int = 0) -> Dict[str, Any]:
+    """每个数据量在新的子进程中运行, 返回完整的结果"""
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for size in sizes:
+        print(f"数据量 {size} ...", file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[str(size)] = executor.submit(bench_size, size, ops, formats, seed).result()
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ops": ops,
+            "formats": formats,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float) -> List[Dict[str, Any]]:
+    """找出吞吐量比基线下降超过 threshold(比例) 的操作"""
+    regressions = []
+    for size, operations in current["results"].items():
+        for name, result in operations.items():
+            base = baseline.get("results", {}).get(size, {}).get(name)
+            if not isinstance(result, dict) or not isinstance(base, dict):
+                continue
+            change = result["ops_per_sec"] / base["ops_per_sec"] - 1
+            if change < -threshold:
+                regressions.append({
+                    "size": size,
+                    "operation": name,
+                    "baseline_ops_per_sec": base["ops_per_sec"],
+                    "ops_per_sec": result["ops_per_sec"],
+                    "change": round(change, 3),
+                })
+    return regressions
+
+
+def print_table(report: Dict[str, Any]):
+    """把结果打印为表格"""
+    for size, operations in report["results"].items():
+        print(f"\n数据量: {size}  内存峰值: {operations['peak_rss_mb']} MB")
+        print(f"{'操作':<36}{'ops/s':>14}{'p50(us)':>12}{'p99(us)':>12}")
+        for name, result in operations.items():
+            if not isinstance(result, dict):
+                continue
+            p50 = result.get("p50_us", result.get("seconds", 0) * 1e6)
+            p99 = result.get("p99_us", p50)
+            print(f"{name:<36}{result['ops_per_sec']:>14.1f}{p50:>12.1f}{p99:>12.1f}")
+
+
+def main():
+    """运行基准测试, 保存结果并与基线比较"""
+    parser = argparse.ArgumentParser(description="TodoStorage 操作的规模基准测试")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="逗号分隔的数据量")
+    parser.add_argument("--ops", type=int, default=1000, help="每种操作执行的次数")
+    parser.add_argument("--formats", default="json,binary", help="测试保存/加载的快照格式")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", help="结果写入的JSON文件")
+    parser.add_argument("--baseline", help="作为基线的结果文件")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="吞吐量比基线下降超过这个比例视为退化, 默认0.2")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        sizes=[int(size) for size in args.sizes.split(",")],
+        ops=args.ops,
+        formats=args.formats.split(","),
+        seed=args.seed
+    )
+    print_table(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n",
+                                     encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n吞吐量下降超过 {args.threshold:.0%} 的操作:")
+            for item in regressions:
+                print(f"  [{item['size']}] {item['operation']}: "
+                      f"{item['baseline_ops_per_sec']:.1f} -> {item['ops_per_sec']:.1f} ops/s "
+                      f"({item['change']:+.1%})")
+            sys.exit(1)
+        print(f"\n与基线相比没有超过 {args.threshold:.0%} 的退化")
+
+
+if __name__ == "__main__":
+    main()
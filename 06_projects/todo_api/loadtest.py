@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+待办事项API负载测试工具
+多个虚拟客户端并发地按给定比例发送创建/获取/列表/搜索/更新/删除/统计请求,
+最后以JSON输出总吞吐量以及每个端点的吞吐量和p50/p95/p99延迟.
+
+默认在进程内通过ASGI传输直接驱动 main.app(使用临时数据文件), 也可以用 --url
+压测一个已经启动的服务.
+
+运行方式:
+python loadtest.py --clients 20 --duration 10
+python loadtest.py --url http://127.0.0.1:8000 --mix get=8,list=1,create=1
+TODO_PERSISTENCE=journal python loadtest.py --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+PRIORITIES = ("low", "medium", "high")
+SEARCH_WORDS = ("报告", "会议", "购物", "学习", "运动")
+
+# 默认的请求比例: 以读为主
+DEFAULT_MIX = "create=1,get=5,list=2,search=1,update=1,delete=1,stats=1"
+OPERATIONS = ("create", "get", "list", "search", "update", "delete", "stats")
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """解析 "get=5,list=2" 形式的请求比例"""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"未知的操作: {name}, 可选: {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("请求比例中至少要有一个正的权重")
+    return mix
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """最近秩法计算百分位数, 输入必须已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(fraction * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def todo_payload(index: int) -> Dict[str, Any]:
+    """第 index 个生成的待办事项"""
+    return {
+        "title": f"{SEARCH_WORDS[index % len(SEARCH_WORDS)]} 待办 {index}",
+        "description": f"负载测试生成的第 {index} 个待办事项",
+        "priority": PRIORITIES[index % len(PRIORITIES)],
+    }
+
+
+class LoadTest:
+    """一次负载测试: 共享的待办事项ID池和按操作记录的延迟"""
+
+    def __init__(self, http: httpx.AsyncClient, mix: Dict[str, float], seed: int = 0):
+        self.http = http
+        self.operations = [name for name, weight in mix.items() if weight > 0]
+        self.weights = [mix[name] for name in self.operations]
+        self.seed = seed
+        self.ids: List[str] = []
+        self.created = 0
+        self.latencies: Dict[str, List[float]] = {name: [] for name in self.operations}
+        self.errors: Dict[str, int] = {name: 0 for name in self.operations}
+
+    async def populate(self, count: int):
+        """通过批量创建端点预先写入 count 个待办事项"""
+        while self.created < count:
+            size = min(1000, count - self.created)
+            items = [todo_payload(self.created + offset) for offset in range(size)]
+            response = await self.http.post("/todos/batch", json={"items": items})
+            response.raise_for_status()
+            self.ids.extend(item["id"] for item in response.json()["results"])
+            self.created += size
+
+    def request_for(self, operation: str, rng: random.Random):
+        """返回 (方法, 路径, JSON请求体); 没有可用ID时改为创建"""
+        if operation in ("get", "update", "delete") and not self.ids:
+            operation = "create"
+        if operation == "create":
+            self.created += 1
+            return operation, "POST", "/todos", todo_payload(self.created)
+        if operation == "get":
+            return operation, "GET", f"/todos/{rng.choice(self.ids)}", None
+        if operation == "list":
+            return operation, "GET", "/todos?limit=50", None
+        if operation == "search":
+            return operation, "GET", f"/todos?search={rng.choice(SEARCH_WORDS)}&limit=50", None
+        if operation == "update":
+            return (operation, "PUT", f"/todos/{rng.choice(self.ids)}",
+                    {"completed": rng.random() < 0.5, "priority": rng.choice(PRIORITIES)})
+        if operation == "delete":
+            # 从池中取出, 避免其他客户端再访问已删除的ID
+            index = rng.randrange(len(self.ids))
+            self.ids[index], self.ids[-1] = self.ids[-1], self.ids[index]
+            return operation, "DELETE", f"/todos/{self.ids.pop()}", None
+        return operation, "GET", "/stats", None
+
+    async def client(self, index: int, deadline: float, max_requests: Optional[int]):
+        """一个虚拟客户端: 按比例随机选择操作, 发完一个请求再发下一个"""
+        rng = random.Random(self.seed * 1000003 + index)
+        sent = 0
+        while time.perf_counter() < deadline and (max_requests is None or sent < max_requests):
+            choice = rng.choices(self.operations, self.weights)[0]
+            operation, method, path, body = self.request_for(choice, rng)
+            start = time.perf_counter()
+            try:
+                response = await self.http.request(method, path, json=body)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                response, failed = None, True
+            self.latencies.setdefault(operation, []).append(time.perf_counter() - start)
+            if failed:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+            elif operation == "create":
+                self.ids.append(response.json()["id"])
+            sent += 1
+
+    async def run(self, clients: int, duration: float,
+                  requests_per_client: Optional[int] = None) -> Dict[str, Any]:
+        """并发运行 clients 个虚拟客户端, 返回结果报告"""
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            self.client(index, start + duration, requests_per_client) for index in range(clients)
+        ))
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        """汇总吞吐量和延迟百分位(毫秒)"""
+        endpoints = {}
+        for operation, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies.sort()
+            endpoints[operation] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(operation, 0),
+                "throughput_rps": round(len(latencies) / elapsed, 1),
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+                "max_ms": round(latencies[-1] * 1000, 3),
+            }
+        total = sum(endpoint["requests"] for endpoint in endpoints.values())
+        return {
+            "duration_seconds": round(elapsed, 3),
+            "requests": total,
+            "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+            "throughput_rps": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+async def run_load_test(url: Optional[str] = None, clients: int = 10, duration: float = 10.0,
+                        requests_per_client: Optional[int] = None, mix: str = DEFAULT_MIX,
+                        todos: int = 1000, seed: int = 0) -> Dict[str, Any]:
+    """运行一次负载测试并返回报告
+
+    url 为None时在进程内压测 main.app, 存储替换为临时目录中的 TodoStorage
+    (持久化模式和快照格式仍由 TODO_PERSISTENCE / TODO_SNAPSHOT_FORMAT 决定).
+    """
+    temp_dir = None
+    if url is None:
+        import main
+        temp_dir = tempfile.mkdtemp()
+        original_storage = main.storage
+        main.storage = main.AsyncTodoStorage(main.TodoStorage(
+            str(Path(temp_dir) / "todos.json"),
+            persistence=os.environ.get("TODO_PERSISTENCE", "snapshot"),
+            snapshot_format=os.environ.get("TODO_SNAPSHOT_FORMAT", "json")
+        ))
+        transport = httpx.ASGITransport(app=main.app)
+        base_url = "http://loadtest"
+    else:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=clients))
+        base_url = url
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=30.0) as http:
+            load_test = LoadTest(http, parse_mix(mix), seed)
+            await load_test.populate(todos)
+            report = await load_test.run(clients, duration, requests_per_client)
+    finally:
+        if temp_dir is not None:
+            main.storage = original_storage
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report["config"] = {
+        "target": url or "in-process",
+        "clients": clients,
+        "duration": duration,
+        "requests_per_client": requests_per_client,
+        "mix": parse_mix(mix),
+        "todos": todos,
+        "seed": seed,
+    }
+    return report
+
+
+def main():
+    """解析命令行参数, 运行负载测试并输出JSON结果"""
+    parser = argparse.ArgumentParser(description="待办事项API负载测试")
+    parser.add_argument("--url", help="被测服务地址, 不指定时在进程内直接驱动 main.app")
+    parser.add_argument("--clients", type=int, default=10, help="并发虚拟客户端数量")
+    parser.add_argument("--duration", type=float, default=10.0, help="压测时长(秒)")
+    parser.add_argument("--requests", type=int, default=None,
+                        help="每个客户端最多发送的请求数, 先到时长或请求数即停止")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="各操作的权重, 如 get=5,list=2,create=1")
+    parser.add_argument("--todos", type=int, default=1000, help="压测前预先创建的待办事项数量")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", help="结果写入的JSON文件, 不指定时打印到标准输出")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(
+        url=args.url, clients=args.clients, duration=args.duration,
+        requests_per_client=args.requests, mix=args.mix, todos=args.todos, seed=args.seed
+    ))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,34 @@
 基于FastAPI的RESTful API示例，演示现代Python Web开发
 """
 
-from fastapi import FastAPI, HTTPException, Query, Path
+from fastapi import FastAPI, HTTPException, Query, Path, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from pydantic import BaseModel, Field, validator
+from typing import (List, Optional, Dict, Any, AsyncIterator, Callable, Iterator, Set,
+                    Tuple)
+from datetime import datetime, timedelta
+import asyncio
+import base64
+import bisect
+import contextvars
+import heapq
+import itertools
 import json
+import math
 import uuid
 import os
-from pathlib import Path
+import re
+import signal
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path as FilePath
 
 
 # 数据模型定义
@@ -38,6 +57,13 @@ class TodoUpdate(BaseModel):
     priority: Optional[str] = Field(None, regex="^(low|medium|high)$")
     completed: Optional[bool] = None
 
+    @validator("title", "priority", "completed", pre=True)
+    def reject_null(cls, value):
+        """这些字段可以省略但不能显式设为null(description 设为null表示清空)"""
+        if value is None:
+            raise ValueError("不能为null")
+        return value
+
 
 class Todo(TodoBase):
     """完整的待办事项模型"""
@@ -51,125 +77,2868 @@ class Todo(TodoBase):
         }
 
 
-class TodoResponse(BaseModel):
-    """API响应模型"""
-    success: bool
-    message: str
-    data: Optional[Any] = None
+class TodoResponse(BaseModel):
+    """API响应模型"""
+    success: bool
+    message: str
+    data: Optional[Any] = None
+
+
+# 批量操作模型
+MAX_BATCH_SIZE = 1000
+
+
+class TodoBatchCreate(BaseModel):
+    """批量创建请求"""
+    items: List[TodoCreate] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE)
+
+
+class TodoBatchUpdateItem(TodoUpdate):
+    """批量更新中的单项: 待办事项ID加上要修改的字段"""
+    id: str = Field(..., description="待办事项ID")
+
+
+class TodoBatchUpdate(BaseModel):
+    """批量更新请求"""
+    items: List[TodoBatchUpdateItem] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE)
+
+
+class TodoBatchIds(BaseModel):
+    """批量获取/删除请求"""
+    ids: List[str] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE)
+
+
+class BatchItemResult(BaseModel):
+    """批量操作中单项的结果"""
+    id: Optional[str] = None
+    status: int
+    data: Optional[Todo] = None
+    error: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    """批量操作响应"""
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]
+
+    @classmethod
+    def from_results(cls, results: List[BatchItemResult]) -> "BatchResponse":
+        succeeded = sum(1 for result in results if result.status < 400)
+        return cls(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
+
+# 变更流: 每次修改的写入代数就是全局序号, 客户端用上次得到的 next_since 增量同步
+class TodoChange(BaseModel):
+    """一条修改: put 带有修改后的待办事项, delete 只有id"""
+    seq: int
+    op: str
+    id: str
+    todo: Optional[Todo] = None
+
+
+class ChangeFeed(BaseModel):
+    """变更流的一页"""
+    store_id: str
+    sequence: int
+    next_since: int
+    has_more: bool
+    changes: List[TodoChange]
+
+
+# 一条修改: (写入代数, id, 修改后的待办事项; 删除时为None)
+Change = Tuple[int, str, Optional[Todo]]
+
+
+def check_change_since(since: Optional[int], generation: int, tombstone_floor: int):
+    """检查能否从 since 开始增量同步, 不能时抛出 ValueError
+
+    since 超过当前写入代数说明存储已重启或换了数据; 小于被清理的墓碑的最大代数
+    说明期间的删除记录已经丢失. 两种情况客户端都需要重新全量同步.
+    """
+    if since is None:
+        return
+    if since > generation:
+        raise ValueError(f"序号 {since} 超过当前写入代数 {generation}")
+    if since < tombstone_floor:
+        raise ValueError(f"序号 {since} 之后的删除记录已超过保留期被清理")
+
+
+def page_changes(changes: List[Tuple[int, str]], limit: int) -> Tuple[List[Tuple[int, str]], bool]:
+    """取前 limit 条修改, 返回 (本页, 是否还有更多)
+
+    下一页从本页最后一条的代数之后开始, 因此同一代数的修改不能拆到两页,
+    本页可能因此超过 limit 条.
+    """
+    if len(changes) <= limit:
+        return changes, False
+    end = limit
+    while end < len(changes) and changes[end][0] == changes[end - 1][0]:
+        end += 1
+    return changes[:end], end < len(changes)
+
+
+# 列表的排序字段. 按时间排序时排序键为 (时间, id); 按优先级排序时为
+# (优先级, 创建时间, id), 同一优先级内按创建时间排列. id 保证顺序稳定
+SORT_FIELDS = ("created_at", "updated_at", "priority")
+
+# 分页游标: 记录上一页最后一条的排序键(默认按 (created_at, id) 排序)
+CursorKey = Tuple[Any, ...]
+
+
+def todo_sort_key(todo: Todo, sort: str = "created_at") -> CursorKey:
+    """待办事项在指定排序方式下的排序键"""
+    if sort == "priority":
+        return todo.priority, todo.created_at, todo.id
+    return getattr(todo, sort), todo.id
+
+
+def encode_cursor(todo: Todo, sort: str = "created_at") -> str:
+    """把待办事项的排序键编码为不透明的游标"""
+    return encode_cursor_key(todo_sort_key(todo, sort))
+
+
+def decode_cursor(cursor: str, sort: str = "created_at") -> CursorKey:
+    """解析游标, 格式不正确时抛出 ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if sort == "priority":
+            priority, created_at, todo_id = values
+            if priority not in PRIORITY_CODES:
+                raise ValueError(f"未知的优先级: {priority}")
+            return priority, datetime.fromisoformat(created_at), str(todo_id)
+        timestamp, todo_id = values
+        return datetime.fromisoformat(timestamp), str(todo_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"无效的游标: {cursor}") from e
+
+
+def encode_cursor_key(key: CursorKey) -> str:
+    """把排序键编码为不透明的游标"""
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value
+                      for value in key])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+# 预序列化的JSON: 与FastAPI序列化 Todo 的结果相同(紧凑分隔符, 不转义非ASCII字符)
+def encode_todo_json(todo_dict: Dict[str, Any]) -> bytes:
+    """把待办事项字典编码为JSON字节串"""
+    return json.dumps(todo_dict, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class JSONFragmentsResponse(Response):
+    """由已编码的JSON片段拼接而成的列表响应, 不再逐项序列化"""
+
+    media_type = "application/json"
+
+    def render(self, content: List[bytes]) -> bytes:
+        return b"[" + b",".join(content) + b"]"
+
+
+# 统计信息
+PRIORITIES = ("high", "medium", "low")
+
+
+def build_stats(total: int, completed: int, by_priority: Dict[str, int]) -> Dict[str, Any]:
+    """根据计数构造 /stats 的返回内容"""
+    return {
+        "total": total,
+        "completed": completed,
+        "pending": total - completed,
+        "completion_rate": (completed * 100 / total) if total > 0 else 0,
+        "by_priority": {priority: by_priority.get(priority, 0) for priority in PRIORITIES}
+    }
+
+
+def verify_stats(storage) -> Dict[str, Any]:
+    """调试用: 从头重新统计并与增量维护的计数比较, 返回不一致的项"""
+    counted = storage.get_stats()
+    recomputed = storage.recompute_stats()
+    return {
+        key: {"counter": counted[key], "actual": recomputed[key]}
+        for key in recomputed if counted[key] != recomputed[key]
+    }
+
+
+# 紧凑的内存记录: 优先级存为小整数, 时间存为自纪元起的微秒数,
+# 只在API边界才构造pydantic模型
+PRIORITY_NAMES = ("low", "medium", "high")
+PRIORITY_CODES = {name: code for code, name in enumerate(PRIORITY_NAMES)}
+EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_micros(value: datetime) -> int:
+    """把datetime转换为整数微秒; 带时区的时间先转换为本地时间"""
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def micros_to_datetime(micros: int) -> datetime:
+    """把整数微秒转换回datetime"""
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class TodoRecord:
+    """待办事项在内存中的紧凑表示"""
+
+    __slots__ = ("id", "title", "description", "priority", "completed",
+                 "created_at", "updated_at", "version", "encoded")
+
+    def __init__(self, id: str, title: str, description: Optional[str], priority: int,
+                 completed: bool, created_at: int, updated_at: int, version: int = 0):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.priority = priority
+        self.completed = completed
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.version = version
+        # 缓存的JSON编码, 记录被修改时清空
+        self.encoded: Optional[bytes] = None
+
+    @property
+    def priority_name(self) -> str:
+        return PRIORITY_NAMES[self.priority]
+
+    @classmethod
+    def from_todo(cls, todo: Todo) -> "TodoRecord":
+        """由已校验的待办事项模型构造记录"""
+        return cls(todo.id, todo.title, todo.description, PRIORITY_CODES[todo.priority],
+                   todo.completed, datetime_to_micros(todo.created_at),
+                   datetime_to_micros(todo.updated_at))
+
+    def to_todo(self) -> Todo:
+        """构造API使用的模型; 数据在写入时已经校验过, 这里跳过校验"""
+        return Todo.construct(
+            id=self.id,
+            title=self.title,
+            description=self.description,
+            priority=self.priority_name,
+            completed=self.completed,
+            created_at=micros_to_datetime(self.created_at),
+            updated_at=micros_to_datetime(self.updated_at)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可JSON序列化的字典(快照和日志的格式)"""
+        return {
+            "title": self.title,
+            "description": self.description,
+            "priority": self.priority_name,
+            "completed": self.completed,
+            "id": self.id,
+            "created_at": micros_to_datetime(self.created_at).isoformat(),
+            "updated_at": micros_to_datetime(self.updated_at).isoformat()
+        }
+
+    def to_json(self) -> bytes:
+        """返回JSON编码, 首次使用时编码并缓存"""
+        if self.encoded is None:
+            self.encoded = encode_todo_json(self.to_dict())
+        return self.encoded
+
+    def cursor_key(self, sort: str = "created_at") -> CursorKey:
+        """游标中使用的排序键(时间还原为 datetime)"""
+        if sort == "priority":
+            return self.priority_name, micros_to_datetime(self.created_at), self.id
+        return micros_to_datetime(getattr(self, sort)), self.id
+
+
+# 监控指标(Prometheus文本格式)
+# 直方图的桶在创建时固定, 每次观测只做一次二分查找和几次整数加法. 存储指标会在
+# 多个线程中同时更新(例如多租户时各租户的落盘和加载并行执行), 每个指标有一把锁
+def format_labels(labels: Dict[str, str]) -> str:
+    """格式化标签, 按Prometheus的规则转义"""
+    if not labels:
+        return ""
+
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class Counter:
+    """单调递增的计数器"""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Gauge(Counter):
+    """可以任意设置的数值"""
+
+    TYPE = "gauge"
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self.values[labels] = value
+
+
+class Histogram:
+    """预先分好桶的直方图"""
+
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...],
+                 labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labelnames = labelnames
+        # 标签 -> [各个桶的计数(最后一个是+Inf), 总和]
+        self.values: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = [(labels, list(counts), total)
+                      for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in values:
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield self.name + "_bucket", {**base, "le": str(bound)}, cumulative
+            yield self.name + "_sum", base, total
+            yield self.name + "_count", base, cumulative
+
+
+class MetricsRegistry:
+    """指标的集合, 负责渲染为文本格式"""
+
+    def __init__(self):
+        self.metrics: List[Any] = []
+        # 渲染时调用的函数, 返回临时构造的指标, 用于导出其他组件已有的计数
+        self.collectors: List[Any] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...],
+                  labelnames: Tuple[str, ...] = ()) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        collected = [metric for collector in self.collectors for metric in collector()]
+        for metric in self.metrics + collected:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+metrics = MetricsRegistry()
+STORAGE_SAVE_SECONDS = metrics.histogram(
+    "todo_storage_save_seconds", "写出快照或追加日志的耗时", LATENCY_BUCKETS, ("kind",))
+STORAGE_SAVE_BYTES = metrics.histogram(
+    "todo_storage_save_bytes", "每次写出快照或追加日志的字节数", BYTES_BUCKETS, ("kind",))
+STORAGE_LOAD_SECONDS = metrics.histogram(
+    "todo_storage_load_seconds", "启动时加载数据的耗时",
+    (0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+HTTP_REQUESTS = metrics.counter(
+    "todo_http_requests_total", "按路由和状态码统计的请求数", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "todo_http_request_duration_seconds", "按路由统计的请求耗时", LATENCY_BUCKETS,
+    ("method", "route"))
+LOOP_LAG_SECONDS = metrics.histogram(
+    "todo_event_loop_lag_seconds", "事件循环延迟: 定时探针实际醒来比预期晚的时间",
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOOP_LAG_LAST = metrics.gauge(
+    "todo_event_loop_lag_last_seconds", "最近一次探针测得的事件循环延迟")
+STORE_TODOS = metrics.gauge("todo_store_todos", "存储中的待办事项数量", ("status",))
+STORE_GENERATION = metrics.gauge("todo_store_generation", "存储的代数(每次修改加一)")
+
+
+# 数据存储管理
+# 二进制快照: 文件头(魔数 + 记录数)之后是连续的记录.
+# 每条记录: 定长部分(优先级, 完成状态, 创建/更新时间微秒数, 三个字符串的字节长度)
+# 加上UTF-8编码的 id、标题、描述; 描述长度为 -1 表示没有描述
+SNAPSHOT_MAGIC = b"TODOSNP1"
+SNAPSHOT_HEADER = struct.Struct("<8sI")
+SNAPSHOT_RECORD = struct.Struct("<B?qqHIi")
+
+
+def encode_snapshot(records: List[TodoRecord]) -> bytes:
+    """把记录编码为二进制快照"""
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(records))]
+    for todo in records:
+        todo_id = todo.id.encode("utf-8")
+        title = todo.title.encode("utf-8")
+        description = todo.description.encode("utf-8") if todo.description is not None else b""
+        parts.append(SNAPSHOT_RECORD.pack(
+            todo.priority, todo.completed, todo.created_at, todo.updated_at,
+            len(todo_id), len(title), len(description) if todo.description is not None else -1
+        ))
+        parts.append(todo_id)
+        parts.append(title)
+        parts.append(description)
+    return b"".join(parts)
+
+
+def decode_snapshot(data: bytes) -> Iterator[TodoRecord]:
+    """解码二进制快照
+
+    快照只由本程序写出, 内容在写入前已经校验过, 因此直接构造记录, 不再逐项校验.
+    """
+    magic, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("不是二进制快照文件")
+    offset = SNAPSHOT_HEADER.size
+    unpack_from = SNAPSHOT_RECORD.unpack_from
+    record_size = SNAPSHOT_RECORD.size
+    for _ in range(count):
+        (priority, completed, created_at, updated_at,
+         id_len, title_len, description_len) = unpack_from(data, offset)
+        offset += record_size
+        todo_id = data[offset:offset + id_len].decode("utf-8")
+        offset += id_len
+        title = data[offset:offset + title_len].decode("utf-8")
+        offset += title_len
+        description = None
+        if description_len >= 0:
+            description = data[offset:offset + description_len].decode("utf-8")
+            offset += description_len
+        yield TodoRecord(todo_id, title, description, priority, completed,
+                         created_at, updated_at)
+
+
+class TodoStorage:
+    """待办事项数据存储管理器
+
+    支持两种持久化模式:
+    - snapshot: 每次修改后重写整个JSON文件(默认)
+    - journal: 每次修改只向日志文件追加一条记录, 启动时在快照上重放日志,
+      日志记录数超过阈值后由后台线程把日志合并进新的快照
+
+    快照可以保存为JSON(默认)或二进制格式. 二进制快照写在同名的 .bin 文件中,
+    加载时跳过模型校验; 还没有二进制快照时会读取JSON快照, 下次保存时转换为二进制.
+
+    shards 大于1时快照按id的哈希分成多个分片文件(如 todos.shard-003-of-016.json),
+    每个分片有自己的脏标记, 保存时只重写被修改过的分片; 启动时用线程池并行加载各分片.
+    从单文件快照或分片数不同的快照启动时, 第一次保存会按新的分片数写出全部分片.
+
+    过滤查询的结果缓存在一个大小为 query_cache_size 的LRU中, 以规范化的过滤条件为键,
+    并标记计算时的写入代数; 任何修改都会推进写入代数, 旧的结果自然失效.
+    """
+
+    PERSISTENCE_MODES = ("snapshot", "journal")
+    SNAPSHOT_FORMATS = ("json", "binary")
+    # 读写只访问内存, 可以直接在事件循环中执行
+    BLOCKING_IO = False
+
+    def __init__(self, data_file: str = "todos.json",
+                 persistence: str = "snapshot",
+                 compact_threshold: int = 1000,
+                 fsync_journal: bool = False,
+                 snapshot_format: str = "json",
+                 tombstone_retention: float = 86400.0,
+                 shards: int = 1,
+                 query_cache_size: int = 128):
+        if persistence not in self.PERSISTENCE_MODES:
+            raise ValueError(f"未知的持久化模式: {persistence}")
+        if snapshot_format not in self.SNAPSHOT_FORMATS:
+            raise ValueError(f"未知的快照格式: {snapshot_format}")
+        if shards < 1:
+            raise ValueError(f"分片数必须是正整数: {shards}")
+
+        self.data_file = FilePath(data_file)
+        self.snapshot_format = snapshot_format
+        self.binary_file = self.data_file.with_suffix(".bin")
+        # 当前追加写入的日志, 以及正在(或等待)被合并进快照的封存日志
+        self.journal_file = self.data_file.with_name(self.data_file.name + ".log")
+        self.sealed_journal_file = self.data_file.with_name(self.data_file.name + ".log.1")
+        self.persistence = persistence
+        self.compact_threshold = compact_threshold
+        self.fsync_journal = fsync_journal
+        self.shards = shards
+        # 分片 -> 其中的id集合, 以及自上次保存以来被修改过的分片
+        self._shard_ids: List[Set[str]] = [set() for _ in range(shards)]
+        self._dirty_shards: Set[int] = set()
+        self._dirty_shards_lock = threading.Lock()
+        self.todos: Dict[str, TodoRecord] = {}
+        # 二级索引: 完成状态 -> id集合, 优先级 -> id集合
+        self._completed_index: Dict[bool, Set[str]] = {}
+        self._priority_index: Dict[str, Set[str]] = {}
+        # 三元组倒排索引: 小写标题/描述中的每个三字符片段 -> id集合
+        self._trigram_index: Dict[str, Set[str]] = {}
+        # 有序索引: 每种排序方式一个有序的排序键列表, 写入时用二分插入维护,
+        # 用于排序、时间范围过滤和分页
+        self._orders: Dict[str, List[Tuple]] = {sort: [] for sort in SORT_FIELDS}
+
+        # 写入代数: 每次修改加一; 每条记录保存最后一次修改时的代数作为版本号.
+        # store_id 每次加载时随机生成, 保证重启后的ETag不会与之前的混淆
+        self.store_id = uuid.uuid4().hex[:8]
+        self.generation = 0
+
+        # 变更记录: id -> 最后一次修改时的写入代数, 按代数从小到大排列. 被删除的id作为
+        # 墓碑保留 tombstone_retention 秒, 清理掉的墓碑的最大代数记为 _tombstone_floor
+        self.tombstone_retention = tombstone_retention
+        self._change_log: Dict[str, int] = OrderedDict()
+        self._tombstones: Dict[str, Tuple[int, float]] = OrderedDict()
+        self._tombstone_floor = 0
+
+        # 查询结果缓存: 规范化的过滤条件 -> (写入代数, 结果), 0为关闭
+        self.query_cache_size = query_cache_size
+        self._query_cache: Dict[Tuple, Tuple[int, List[Any]]] = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.query_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+        # 组提交模式: 修改只记录下来, 由 GroupCommitFlusher 在后台调用 flush() 落盘
+        self.group_commit = False
+        self._dirty = False
+        self._pending_records: List[Dict[str, Any]] = []
+
+        self._journal_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._journal_fp = None
+        self._journal_records = 0
+        self._compaction_thread: Optional[threading.Thread] = None
+        # 最近一次启动加载的耗时(秒)
+        self.load_seconds = 0.0
+
+        self.load_todos()
+
+    @property
+    def use_journal(self) -> bool:
+        """是否使用追加日志持久化"""
+        return self.persistence == "journal"
+
+    def load_todos(self):
+        """从文件加载待办事项(日志模式下会在快照之上重放日志)"""
+        start = time.perf_counter()
+        try:
+            self.todos = self._read_snapshot()
+        except Exception as e:
+            print(f"加载数据失败: {e}")
+            self.todos = {}
+
+        if self.use_journal:
+            self._replay_journal()
+
+        # 版本号不落盘: 加载的每条记录依次分配一个写入代数. 如果都记为0, 重启后第一次
+        # 全量同步的所有修改同属一个代数, 变更流无法按 limit 分页
+        for todo in self.todos.values():
+            self.generation += 1
+            todo.version = self.generation
+        self._rebuild_indexes()
+        self.load_seconds = time.perf_counter() - start
+        STORAGE_LOAD_SECONDS.observe(self.load_seconds)
+        print(f"加载了 {len(self.todos)} 个待办事项, 用时 {self.load_seconds * 1000:.1f} ms "
+              f"(快照格式: {self.snapshot_format})")
+
+    def _read_snapshot(self) -> Dict[str, TodoRecord]:
+        """读取磁盘上最近写入的快照(单文件或一组分片, JSON或二进制)
+
+        读到的不是当前格式和分片数的分片时, 把所有分片标记为脏, 第一次保存时全部写出.
+        """
+        todos: Dict[str, TodoRecord] = {}
+        snapshot_files = self._newest_snapshot(
+            self._shard_file_sets() + [[self.binary_file], [self.data_file]])
+        if snapshot_files:
+            self._read_snapshot_files(snapshot_files, todos)
+        if self.shards > 1 and not (snapshot_files and self._is_current_layout(snapshot_files)):
+            self._mark_all_shards_dirty()
+        return todos
+
+    def _newest_snapshot(self, candidates: List[List[FilePath]]) -> List[FilePath]:
+        """从各组快照文件中选出最近写入的一组, 同时写入的优先当前格式和分片数
+
+        切换快照格式或分片数后只会写新的文件, 旧的文件可能留在磁盘上; 再切换回来时
+        必须读取较新的那组, 否则之后的修改会丢失.
+        """
+        def freshness(paths: List[FilePath]) -> Tuple[int, bool]:
+            return max(path.stat().st_mtime_ns for path in paths), self._is_current_layout(paths)
+
+        existing = [[path for path in paths if path.exists()] for paths in candidates]
+        existing = [paths for paths in existing if paths]
+        return max(existing, key=freshness) if existing else []
+
+    def _is_current_snapshot_file(self, path: FilePath) -> bool:
+        """文件是否属于当前格式和分片数下写出的快照"""
+        if self.shards > 1:
+            return self._is_current_shard_file(path)
+        return path == self._snapshot_base()
+
+    def _is_current_layout(self, paths: List[FilePath]) -> bool:
+        return all(self._is_current_snapshot_file(path) for path in paths)
+
+    @staticmethod
+    def _read_snapshot_file(path: FilePath) -> List[TodoRecord]:
+        """读取一个快照文件, 按扩展名区分二进制和JSON格式
+
+        decode_snapshot 是生成器, 必须在这里解码完: 否则并行读取时线程池只读了文件,
+        解码会在调用方的线程中逐个分片进行.
+        """
+        if path.suffix == ".bin":
+            return list(decode_snapshot(path.read_bytes()))
+        with open(path, 'r', encoding='utf-8') as f:
+            return [TodoRecord.from_todo(Todo(**todo_data)) for todo_data in json.load(f)]
+
+    def _read_snapshot_files(self, paths: List[FilePath], todos: Dict[str, TodoRecord]):
+        """读取多个快照文件(多于一个时用线程池并行读取)并合并到 todos"""
+        if len(paths) == 1:
+            results = [self._read_snapshot_file(paths[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1, 8),
+                                    thread_name_prefix="todo-shard-load") as executor:
+                results = list(executor.map(self._read_snapshot_file, paths))
+        for records in results:
+            for todo in records:
+                todos[todo.id] = todo
+
+    # 分片文件
+
+    def shard_of(self, todo_id: str) -> int:
+        """待办事项所在的分片; 使用crc32而不是hash(), 保证重启后分片不变"""
+        return zlib.crc32(todo_id.encode("utf-8")) % self.shards
+
+    def _snapshot_base(self, snapshot_format: Optional[str] = None) -> FilePath:
+        """某种格式的单文件快照路径, 分片文件以它为基础命名"""
+        snapshot_format = snapshot_format or self.snapshot_format
+        return self.binary_file if snapshot_format == "binary" else self.data_file
+
+    def shard_file(self, index: int) -> FilePath:
+        """当前格式下第 index 个分片文件的路径"""
+        base = self._snapshot_base()
+        return base.with_name(f"{base.stem}.shard-{index:03d}-of-{self.shards:03d}{base.suffix}")
+
+    def _shard_file_pattern(self, snapshot_format: Optional[str] = None) -> "re.Pattern":
+        base = self._snapshot_base(snapshot_format)
+        return re.compile(re.escape(base.stem) + r"\.shard-(\d+)-of-(\d+)" + re.escape(base.suffix))
+
+    def _shard_file_sets(self) -> List[List[FilePath]]:
+        """磁盘上已有的分片文件, 按格式和分片数分组"""
+        groups: Dict[Tuple[str, int], List[FilePath]] = {}
+        for snapshot_format in self.SNAPSHOT_FORMATS:
+            base = self._snapshot_base(snapshot_format)
+            pattern = self._shard_file_pattern(snapshot_format)
+            for path in sorted(base.parent.glob(f"{base.stem}.shard-*{base.suffix}")):
+                match = pattern.fullmatch(path.name)
+                if match is not None:
+                    groups.setdefault((snapshot_format, int(match.group(2))), []).append(path)
+        return list(groups.values())
+
+    def _is_current_shard_file(self, path: FilePath) -> bool:
+        match = self._shard_file_pattern().fullmatch(path.name)
+        return match is not None and int(match.group(2)) == self.shards
+
+    def _mark_all_shards_dirty(self):
+        with self._dirty_shards_lock:
+            self._dirty_shards = set(range(self.shards))
+
+    def _write_file_atomic(self, path: FilePath, records: List[TodoRecord]) -> int:
+        """先写临时文件再原子替换, 返回写入的字节数"""
+        tmp_file = path.with_name(path.name + ".tmp")
+        if path.suffix == ".bin":
+            with open(tmp_file, 'wb') as f:
+                f.write(encode_snapshot(records))
+                written = f.tell()
+        else:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump([todo.to_dict() for todo in records], f, ensure_ascii=False, indent=2)
+                written = f.tell()
+        os.replace(tmp_file, path)
+        return written
+
+    def _write_shards(self, shard_records: Dict[int, List[TodoRecord]]) -> int:
+        """写出给定的分片, 返回写入的字节数"""
+        return sum(self._write_file_atomic(self.shard_file(index), records)
+                   for index, records in shard_records.items())
+
+    def _remove_stale_snapshots(self):
+        """写出当前布局的完整快照后, 删除被它取代的文件
+
+        包括其他分片数或格式的分片文件, 以及分片模式下的单文件快照; 否则改回
+        原来的分片数时可能读到过时的文件. 单文件模式下另一种格式的单文件保留,
+        由 _newest_snapshot 按写入时间取舍.
+        """
+        stale = [path for paths in self._shard_file_sets() for path in paths
+                 if not self._is_current_snapshot_file(path)]
+        if self.shards > 1:
+            stale += [self.data_file, self.binary_file]
+        for path in stale:
+            if path.exists():
+                path.unlink()
+
+    def _write_dirty_shards(self):
+        """只重写被修改过的分片, 失败时恢复脏标记"""
+        with self._dirty_shards_lock:
+            dirty, self._dirty_shards = self._dirty_shards, set()
+        if not dirty:
+            return
+        start = time.perf_counter()
+        try:
+            shard_records = {}
+            for index in dirty:
+                ids = list(self._shard_ids[index])
+                shard_records[index] = [todo for todo in map(self.todos.get, ids) if todo is not None]
+            written = self._write_shards(shard_records)
+        except Exception:
+            with self._dirty_shards_lock:
+                self._dirty_shards |= dirty
+            raise
+        if len(dirty) == self.shards:
+            self._remove_stale_snapshots()
+        STORAGE_SAVE_SECONDS.observe(time.perf_counter() - start, "shards")
+        STORAGE_SAVE_BYTES.observe(written, "shards")
+
+    @staticmethod
+    def _read_journal(journal_file: FilePath) -> Iterator[Dict[str, Any]]:
+        """逐条读取日志记录, 遇到写了一半的尾部记录时停止"""
+        if not journal_file.exists():
+            return
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程崩溃时最后一条记录可能不完整, 之后的内容都不可信
+                    break
+
+    def _replay_journal(self):
+        """按顺序重放封存日志和当前日志"""
+        try:
+            for record in self._read_journal(self.sealed_journal_file):
+                self._apply_record(record)
+            self._journal_records = 0
+            for record in self._read_journal(self.journal_file):
+                self._apply_record(record)
+                self._journal_records += 1
+        except Exception as e:
+            print(f"重放日志失败: {e}")
+
+        # 上次合并没有完成, 启动后先把封存日志合并掉
+        if self.sealed_journal_file.exists():
+            self._start_compaction()
+
+    def _apply_record(self, record: Dict[str, Any]):
+        """把一条日志记录应用到内存数据"""
+        if record["op"] == "put":
+            todo = TodoRecord.from_todo(Todo(**record["todo"]))
+            self.todos[todo.id] = todo
+        elif record["op"] == "delete":
+            self.todos.pop(record["id"], None)
+
+    def _write_snapshot(self, records: List[TodoRecord]):
+        """写出完整快照(分片模式下写出全部分片), 避免崩溃时留下半个快照"""
+        start = time.perf_counter()
+        if self.shards > 1:
+            shard_records: Dict[int, List[TodoRecord]] = {index: [] for index in range(self.shards)}
+            for todo in records:
+                shard_records[self.shard_of(todo.id)].append(todo)
+            written = self._write_shards(shard_records)
+        else:
+            written = self._write_file_atomic(self._snapshot_base(), records)
+        self._remove_stale_snapshots()
+        STORAGE_SAVE_SECONDS.observe(time.perf_counter() - start, "snapshot")
+        STORAGE_SAVE_BYTES.observe(written, "snapshot")
+
+    def save_todos(self):
+        """保存待办事项到文件
+
+        日志模式下会写出完整快照并清空所有日志.
+        """
+        try:
+            self._save_snapshot()
+        except Exception as e:
+            print(f"保存数据失败: {e}")
+
+    def _save_snapshot(self):
+        """写出完整快照(分片的快照模式下只写被修改过的分片), 失败时抛出异常"""
+        with self._snapshot_lock:
+            if self.shards > 1 and not self.use_journal:
+                self._write_dirty_shards()
+                return
+
+            # 组提交模式下可能在后台线程中执行, 先复制一份值列表再序列化
+            records = list(self.todos.values())
+            if not self.use_journal:
+                self._write_snapshot(records)
+                return
+
+            with self._journal_lock:
+                self._write_snapshot(records)
+                self._close_journal()
+                for journal_file in (self.journal_file, self.sealed_journal_file):
+                    if journal_file.exists():
+                        journal_file.unlink()
+                self._journal_records = 0
+
+    def _commit_change(self, op: str, todo_id: str, todo: Optional[TodoRecord] = None):
+        """记录一次已应用到内存的修改: 推进写入代数和版本号, 然后持久化"""
+        self.generation += 1
+        if todo is not None:
+            todo.version = self.generation
+            todo.encoded = None
+        self._record_change(op, todo_id)
+        self._persist(op, todo_id, todo)
+
+    def _record_change(self, op: str, todo_id: str):
+        """把修改记入变更记录, 删除时留下墓碑"""
+        self._change_log.pop(todo_id, None)
+        self._change_log[todo_id] = self.generation
+        if op == "delete":
+            self._tombstones[todo_id] = (self.generation, time.time())
+            self._prune_tombstones()
+        else:
+            self._tombstones.pop(todo_id, None)
+
+    def _prune_tombstones(self):
+        """清理超过保留期的墓碑"""
+        cutoff = time.time() - self.tombstone_retention
+        while self._tombstones:
+            todo_id, (seq, deleted_at) = next(iter(self._tombstones.items()))
+            if deleted_at >= cutoff:
+                break
+            del self._tombstones[todo_id]
+            del self._change_log[todo_id]
+            self._tombstone_floor = seq
+
+    def get_changes(self, since: Optional[int], limit: int) -> Tuple[int, List[Change], bool]:
+        """返回写入代数大于 since 的修改: (当前写入代数, 按代数排序的修改, 是否还有更多)
+
+        从变更记录末尾向前遍历, 开销只与修改的条数有关. since 为None时返回全部现存的
+        待办事项; 无法从 since 增量同步时抛出 ValueError.
+        """
+        self._prune_tombstones()
+        check_change_since(since, self.generation, self._tombstone_floor)
+        changes = []
+        for todo_id, seq in reversed(self._change_log.items()):
+            if since is not None and seq <= since:
+                break
+            if since is None and todo_id not in self.todos:
+                continue
+            changes.append((seq, todo_id))
+        changes.reverse()
+        page, has_more = page_changes(changes, limit)
+        return self.generation, [
+            (seq, todo_id, self.todos[todo_id].to_todo() if todo_id in self.todos else None)
+            for seq, todo_id in page
+        ], has_more
+
+    def get_todo_version(self, todo_id: str) -> Optional[int]:
+        """待办事项的版本号(最后一次修改时的写入代数), 不存在时返回None"""
+        todo = self.todos.get(todo_id)
+        return todo.version if todo is not None else None
+
+    def _persist(self, op: str, todo_id: str, todo: Optional[TodoRecord] = None):
+        """持久化一次修改: 快照模式重写整个文件, 日志模式只追加一条记录
+
+        组提交模式下只记录待写入的修改, 由 flush() 统一落盘.
+        """
+        if not self.use_journal:
+            if self.shards > 1:
+                with self._dirty_shards_lock:
+                    self._dirty_shards.add(self.shard_of(todo_id))
+            if self.group_commit:
+                self._dirty = True
+            else:
+                self.save_todos()
+            return
+
+        if op == "put":
+            record = {"op": "put", "todo": todo.to_dict()}
+        else:
+            record = {"op": "delete", "id": todo_id}
+
+        if self.group_commit:
+            with self._journal_lock:
+                self._pending_records.append(record)
+            return
+
+        try:
+            self._append_journal([record])
+        except Exception as e:
+            print(f"写入日志失败: {e}")
+        self._maybe_compact()
+
+    @property
+    def has_pending_changes(self) -> bool:
+        """组提交模式下是否有尚未落盘的修改"""
+        return self._dirty or bool(self._pending_records)
+
+    @contextmanager
+    def _batch(self):
+        """批量操作期间推迟持久化, 结束时只落盘一次
+
+        组提交模式下修改本来就会被推迟, 交给刷新器统一落盘.
+        """
+        if self.group_commit:
+            yield
+            return
+
+        self.group_commit = True
+        try:
+            yield
+        finally:
+            self.group_commit = False
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"保存数据失败: {e}")
+
+    def flush(self):
+        """把组提交模式下积累的修改写入磁盘, 失败时抛出异常并保留待写入的修改
+
+        快照模式下合并为一次完整快照, 日志模式下合并为一次追加写入.
+        """
+        if not self.use_journal:
+            if self._dirty:
+                self._dirty = False
+                try:
+                    self._save_snapshot()
+                except Exception:
+                    self._dirty = True
+                    raise
+            return
+
+        with self._journal_lock:
+            records, self._pending_records = self._pending_records, []
+        if not records:
+            return
+        try:
+            self._append_journal(records)
+        except Exception:
+            with self._journal_lock:
+                self._pending_records[:0] = records
+            raise
+        self._maybe_compact()
+
+    def _append_journal(self, records: List[Dict[str, Any]]):
+        """向日志文件追加一批记录, 只做一次 flush/fsync"""
+        start = time.perf_counter()
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._journal_lock:
+            if self._journal_fp is None:
+                self._journal_fp = open(self.journal_file, 'a', encoding='utf-8')
+            self._journal_fp.write(data)
+            self._journal_fp.flush()
+            if self.fsync_journal:
+                os.fsync(self._journal_fp.fileno())
+            self._journal_records += len(records)
+        STORAGE_SAVE_SECONDS.observe(time.perf_counter() - start, "journal")
+        STORAGE_SAVE_BYTES.observe(len(data.encode("utf-8")), "journal")
+
+    def _close_journal(self):
+        """关闭日志文件句柄(调用方需持有日志锁)"""
+        if self._journal_fp is not None:
+            self._journal_fp.close()
+            self._journal_fp = None
+
+    def _maybe_compact(self):
+        """日志足够长时封存当前日志并在后台合并"""
+        if self._journal_records < self.compact_threshold:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+
+        with self._journal_lock:
+            # 上一个封存日志还没合并完时不能再次封存, 先把它合并掉
+            if not self.sealed_journal_file.exists():
+                self._close_journal()
+                os.replace(self.journal_file, self.sealed_journal_file)
+                self._journal_records = 0
+        self._start_compaction()
+
+    def _start_compaction(self):
+        """启动后台合并线程"""
+        self._compaction_thread = threading.Thread(
+            target=self.compact_journal, name="todo-journal-compaction", daemon=True
+        )
+        self._compaction_thread.start()
+
+    def compact_journal(self):
+        """把封存日志合并进快照
+
+        只读取磁盘上的旧快照和封存日志, 不访问内存数据, 因此可以在后台线程中
+        与请求处理并发执行. 日志记录都是幂等的, 合并中途崩溃后重放也是安全的.
+        """
+        try:
+            with self._snapshot_lock:
+                if not self.sealed_journal_file.exists():
+                    return
+
+                records = self._read_snapshot()
+                for record in self._read_journal(self.sealed_journal_file):
+                    if record["op"] == "put":
+                        todo = TodoRecord.from_todo(Todo(**record["todo"]))
+                        records[todo.id] = todo
+                    elif record["op"] == "delete":
+                        records.pop(record["id"], None)
+
+                self._write_snapshot(list(records.values()))
+                self.sealed_journal_file.unlink()
+        except Exception as e:
+            print(f"合并日志失败: {e}")
+
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """等待正在进行的后台合并结束"""
+        if self._compaction_thread is not None:
+            self._compaction_thread.join(timeout)
+
+    def close(self):
+        """等待后台合并结束并关闭日志文件"""
+        self.wait_for_compaction()
+        with self._journal_lock:
+            self._close_journal()
+
+    def _rebuild_indexes(self):
+        """根据内存数据重建二级索引"""
+        self._completed_index = {True: set(), False: set()}
+        self._priority_index = {"low": set(), "medium": set(), "high": set()}
+        self._trigram_index = {}
+        self._shard_ids = [set() for _ in range(self.shards)]
+        for todo in self.todos.values():
+            self._index_sets(todo)
+        self._orders = {
+            sort: sorted(self._sort_key(todo, sort) for todo in self.todos.values())
+            for sort in SORT_FIELDS
+        }
+        self._change_log = OrderedDict(
+            (todo.id, todo.version)
+            for todo in sorted(self.todos.values(), key=lambda todo: todo.version)
+        )
+
+    @staticmethod
+    def _sort_key(todo: TodoRecord, sort: str) -> Tuple:
+        """有序索引中的排序键, 时间为微秒数、优先级为整数编码"""
+        if sort == "priority":
+            return todo.priority, todo.created_at, todo.id
+        return getattr(todo, sort), todo.id
+
+    @staticmethod
+    def _index_key(key: CursorKey, sort: str) -> Tuple:
+        """把游标中的排序键转换为有序索引中的形式"""
+        if sort == "priority":
+            priority, created_at, todo_id = key
+            return PRIORITY_CODES[priority], datetime_to_micros(created_at), todo_id
+        return datetime_to_micros(key[0]), key[1]
+
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        """返回文本中所有长度为3的片段"""
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    @classmethod
+    def _todo_trigrams(cls, todo: TodoRecord) -> Set[str]:
+        """返回待办事项小写标题和描述的三元组"""
+        trigrams = cls._trigrams(todo.title.lower())
+        if todo.description:
+            trigrams |= cls._trigrams(todo.description.lower())
+        return trigrams
+
+    def _index_todo(self, todo: TodoRecord):
+        """把待办事项加入二级索引和有序索引"""
+        self._index_sets(todo)
+        for sort, order in self._orders.items():
+            bisect.insort(order, self._sort_key(todo, sort))
+
+    def _index_sets(self, todo: TodoRecord):
+        """把待办事项加入各个id集合索引"""
+        self._completed_index[todo.completed].add(todo.id)
+        self._priority_index.setdefault(todo.priority_name, set()).add(todo.id)
+        for trigram in self._todo_trigrams(todo):
+            self._trigram_index.setdefault(trigram, set()).add(todo.id)
+        if self.shards > 1:
+            self._shard_ids[self.shard_of(todo.id)].add(todo.id)
+
+    def _unindex_todo(self, todo: TodoRecord):
+        """把待办事项从二级索引中移除"""
+        self._completed_index[todo.completed].discard(todo.id)
+        self._priority_index.get(todo.priority_name, set()).discard(todo.id)
+        for trigram in self._todo_trigrams(todo):
+            posting = self._trigram_index.get(trigram)
+            if posting is not None:
+                posting.discard(todo.id)
+                if not posting:
+                    del self._trigram_index[trigram]
+        for sort, order in self._orders.items():
+            del order[bisect.bisect_left(order, self._sort_key(todo, sort))]
+
+    def create_todo(self, todo_create: TodoCreate) -> Todo:
+        """创建新待办事项"""
+        todo_id = str(uuid.uuid4())
+        now = datetime_to_micros(datetime.now())
+        
+        todo = TodoRecord(
+            id=todo_id,
+            title=todo_create.title,
+            description=todo_create.description,
+            priority=PRIORITY_CODES[todo_create.priority],
+            completed=todo_create.completed,
+            created_at=now,
+            updated_at=now
+        )
+        
+        self.todos[todo_id] = todo
+        self._index_todo(todo)
+        self._commit_change("put", todo_id, todo)
+        return todo.to_todo()
+    
+    def get_todo(self, todo_id: str) -> Optional[Todo]:
+        """获取特定待办事项"""
+        todo = self.todos.get(todo_id)
+        return todo.to_todo() if todo is not None else None
+    
+    def get_all_todos(self) -> List[Todo]:
+        """获取所有待办事项"""
+        return [todo.to_todo() for todo in self.todos.values()]
+
+    def get_todos(self, todo_ids: List[str]) -> List[Optional[Todo]]:
+        """按id批量获取待办事项, 不存在的位置为None"""
+        todos = (self.todos.get(todo_id) for todo_id in todo_ids)
+        return [todo.to_todo() if todo is not None else None for todo in todos]
+
+    def get_todo_encoded(self, todo_id: str) -> Optional[bytes]:
+        """获取待办事项的JSON编码(使用缓存)"""
+        todo = self.todos.get(todo_id)
+        return todo.to_json() if todo is not None else None
+
+    def create_todos(self, todo_creates: List[TodoCreate]) -> List[Todo]:
+        """批量创建待办事项, 只持久化一次"""
+        with self._batch():
+            return [self.create_todo(todo_create) for todo_create in todo_creates]
+
+    def update_todos(self, updates: List[Tuple[str, TodoUpdate]]) -> List[Optional[Todo]]:
+        """批量更新待办事项, 只持久化一次, 不存在的位置为None"""
+        with self._batch():
+            return [self.update_todo(todo_id, todo_update) for todo_id, todo_update in updates]
+
+    def delete_todos(self, todo_ids: List[str]) -> List[bool]:
+        """批量删除待办事项, 只持久化一次"""
+        with self._batch():
+            return [self.delete_todo(todo_id) for todo_id in todo_ids]
+
+    def import_todos(self, todos: List[Todo]) -> int:
+        """导入完整的待办事项(保留id和时间), 已存在的id会被覆盖, 只持久化一次"""
+        with self._batch():
+            for todo in map(TodoRecord.from_todo, todos):
+                self._put_record(todo)
+                self._commit_change("put", todo.id, todo)
+        return len(todos)
+
+    def _put_record(self, todo: TodoRecord):
+        """写入(或替换)一条记录并维护索引"""
+        self._remove_record(todo.id)
+        self.todos[todo.id] = todo
+        self._index_todo(todo)
+
+    def _remove_record(self, todo_id: str) -> Optional[TodoRecord]:
+        """移除一条记录并维护索引, 返回被移除的记录"""
+        todo = self.todos.pop(todo_id, None)
+        if todo is not None:
+            self._unindex_todo(todo)
+            # 更新时记录会被重新索引, 但所在分片不变; 只有移除记录时才离开分片
+            if self.shards > 1:
+                self._shard_ids[self.shard_of(todo_id)].discard(todo_id)
+        return todo
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """统计信息, 直接读取二级索引中各集合的大小, O(1)"""
+        return build_stats(
+            total=len(self.todos),
+            completed=len(self._completed_index[True]),
+            by_priority={priority: len(ids) for priority, ids in self._priority_index.items()}
+        )
+
+    def recompute_stats(self) -> Dict[str, Any]:
+        """遍历全部待办事项重新统计"""
+        by_priority: Dict[str, int] = {}
+        for todo in self.todos.values():
+            by_priority[todo.priority_name] = by_priority.get(todo.priority_name, 0) + 1
+        return build_stats(
+            total=len(self.todos),
+            completed=sum(1 for todo in self.todos.values() if todo.completed),
+            by_priority=by_priority
+        )
+
+    def update_todo(self, todo_id: str, todo_update: TodoUpdate) -> Optional[Todo]:
+        """更新待办事项"""
+        if todo_id not in self.todos:
+            return None
+        
+        todo = self.todos[todo_id]
+        update_data = todo_update.dict(exclude_unset=True)
+        if "priority" in update_data:
+            update_data["priority"] = PRIORITY_CODES[update_data["priority"]]
+        
+        self._unindex_todo(todo)
+        for field, value in update_data.items():
+            setattr(todo, field, value)
+        todo.updated_at = datetime_to_micros(datetime.now())
+        self._index_todo(todo)
+        
+        self._commit_change("put", todo_id, todo)
+        return todo.to_todo()
+    
+    def delete_todo(self, todo_id: str) -> bool:
+        """删除待办事项"""
+        if self._remove_record(todo_id) is None:
+            return False
+        
+        self._commit_change("delete", todo_id)
+        return True
+
+    def toggle_todo(self, todo_id: str) -> Optional[Todo]:
+        """切换待办事项完成状态"""
+        todo = self.todos.get(todo_id)
+        if todo is None:
+            return None
+        return self.update_todo(todo_id, TodoUpdate(completed=not todo.completed))
+    
+    def filter_todos(self, status: Optional[str] = None,
+                     priority: Optional[str] = None,
+                     search: Optional[str] = None,
+                     after: Optional[CursorKey] = None,
+                     limit: Optional[int] = None,
+                     sort: str = "created_at",
+                     descending: bool = False,
+                     created_after: Optional[datetime] = None,
+                     updated_since: Optional[datetime] = None) -> List[Todo]:
+        """过滤待办事项, 结果按 sort 指定的排序键排序"""
+        return self._cached_query("models", lambda *args: [
+            todo.to_todo() for todo in self._filter_records(*args)
+        ], status, priority, search, after, limit, sort, descending, created_after, updated_since)
+
+    def filter_todos_encoded(self, status: Optional[str] = None,
+                             priority: Optional[str] = None,
+                             search: Optional[str] = None,
+                             after: Optional[CursorKey] = None,
+                             limit: Optional[int] = None,
+                             sort: str = "created_at",
+                             descending: bool = False,
+                             created_after: Optional[datetime] = None,
+                             updated_since: Optional[datetime] = None
+                             ) -> List[Tuple[CursorKey, bytes]]:
+        """过滤待办事项, 返回 (排序键, 缓存的JSON编码) 列表, 不构造模型"""
+        return self._cached_query("encoded", lambda *args: [
+            (todo.cursor_key(sort), todo.to_json()) for todo in self._filter_records(*args)
+        ], status, priority, search, after, limit, sort, descending, created_after, updated_since)
+
+    # 结果超过这个行数的查询不缓存, 避免一次全量查询占用大量内存
+    QUERY_CACHE_MAX_ROWS = 10000
+
+    def _cached_query(self, kind: str, compute: Callable[..., List[Any]],
+                      status: Optional[str], priority: Optional[str], search: Optional[str],
+                      after: Optional[CursorKey], *rest: Any) -> List[Any]:
+        """查询结果缓存: 写入代数不变时, 同样的过滤条件只需一次字典查找
+
+        带游标的查询(翻页、分块导出)几乎不会重复, 不进入缓存, 以免挤掉常用的查询.
+        """
+        args = (status, priority, search, after, *rest)
+        if self.query_cache_size <= 0 or after is not None:
+            return compute(*args)
+
+        key = (kind, status, priority, search.lower() if search else None, *rest)
+        generation = self.generation
+        with self._query_cache_lock:
+            entry = self._query_cache.get(key)
+            if entry is not None and entry[0] == generation:
+                self._query_cache.move_to_end(key)
+                self.query_cache_stats["hits"] += 1
+                return list(entry[1])
+
+        result = compute(*args)
+        with self._query_cache_lock:
+            self.query_cache_stats["misses"] += 1
+            if len(result) <= self.QUERY_CACHE_MAX_ROWS:
+                self._query_cache[key] = (generation, result)
+                self._query_cache.move_to_end(key)
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+                    self.query_cache_stats["evictions"] += 1
+        return list(result)
+
+    def _filter_records(self, status: Optional[str], priority: Optional[str],
+                        search: Optional[str], after: Optional[CursorKey],
+                        limit: Optional[int], sort: str = "created_at",
+                        descending: bool = False,
+                        created_after: Optional[datetime] = None,
+                        updated_since: Optional[datetime] = None) -> List[TodoRecord]:
+        """按条件查找记录, 结果按 sort 对应的有序索引排序
+
+        状态、优先级和搜索条件分别对应一组候选id集合(二级索引和三元组倒排表),
+        时间范围对应创建/更新时间有序索引中的一段. 候选明显少于有序索引中
+        游标之后的部分时, 从最小的候选出发逐条检查后只对结果排序; 否则沿有序索引
+        从游标位置顺序(或逆序)遍历, 取够 limit 条即停止.
+        搜索词最终都会做一次精确的子串匹配, 少于3个字符时无法使用三元组索引.
+        """
+        search_lower = search.lower() if search else None
+        candidate_sets = self._candidate_sets(status, priority, search_lower)
+        created_after_us = datetime_to_micros(created_after) if created_after else None
+        updated_since_us = datetime_to_micros(updated_since) if updated_since else None
+        matches = self._record_matcher(search_lower, created_after_us, updated_since_us)
+        
+        # 有序索引中待遍历的范围 [low, high): 游标之后(逆序时为之前)的部分
+        order = self._orders[sort]
+        after_key = self._index_key(after, sort) if after is not None else None
+        low, high = 0, len(order)
+        if after_key is not None:
+            if descending:
+                high = bisect.bisect_left(order, after_key)
+            else:
+                low = bisect.bisect_right(order, after_key)
+        
+        # 时间范围: 与排序字段相同时直接收窄遍历范围, 否则作为一个候选来源
+        sources = [(len(ids), ids) for ids in candidate_sets]
+        for field, since, inclusive in (("created_at", created_after_us, False),
+                                        ("updated_at", updated_since_us, True)):
+            if since is None:
+                continue
+            field_order = self._orders[field]
+            first = bisect.bisect_left(field_order, (since if inclusive else since + 1,))
+            if field == sort:
+                low = max(low, first)
+            else:
+                sources.append((len(field_order) - first,
+                                (key[-1] for key in itertools.islice(field_order, first, None))))
+        high = max(low, high)
+        
+        if sources:
+            size, smallest = min(sources, key=lambda source: source[0])
+            if size * 4 < high - low:
+                return self._filter_candidates(smallest, candidate_sets, matches, sort,
+                                               after_key, descending, limit)
+        return self._walk_order(order, range(low, high), candidate_sets, matches,
+                                descending, limit)
+
+    def _candidate_sets(self, status: Optional[str], priority: Optional[str],
+                        search_lower: Optional[str]) -> List[Set[str]]:
+        """状态、优先级和搜索词对应的候选id集合, 结果必须同时属于其中每一个"""
+        candidate_sets = []
+        if status == "completed":
+            candidate_sets.append(self._completed_index[True])
+        elif status == "pending":
+            candidate_sets.append(self._completed_index[False])
+        if priority:
+            candidate_sets.append(self._priority_index.get(priority, set()))
+        if search_lower:
+            for trigram in self._trigrams(search_lower):
+                candidate_sets.append(self._trigram_index.get(trigram, set()))
+        return candidate_sets
+
+    @staticmethod
+    def _record_matcher(search_lower: Optional[str], created_after_us: Optional[int],
+                        updated_since_us: Optional[int]) -> Callable[[TodoRecord], bool]:
+        """索引无法精确判断的条件: 时间范围和搜索词的子串匹配"""
+        def matches(todo: TodoRecord) -> bool:
+            if created_after_us is not None and todo.created_at <= created_after_us:
+                return False
+            if updated_since_us is not None and todo.updated_at < updated_since_us:
+                return False
+            return search_lower is None or search_lower in todo.title.lower() or \
+                bool(todo.description and search_lower in todo.description.lower())
+
+        return matches
+
+    def _filter_candidates(self, todo_ids, candidate_sets: List[Set[str]],
+                           matches: Callable[[TodoRecord], bool], sort: str,
+                           after_key: Optional[Tuple], descending: bool,
+                           limit: Optional[int]) -> List[TodoRecord]:
+        """从最小的候选来源出发逐条检查, 只对结果排序(或用堆取前 limit 条)"""
+        def sort_key(todo: TodoRecord) -> Tuple:
+            return self._sort_key(todo, sort)
+
+        def beyond_cursor(todo: TodoRecord) -> bool:
+            if after_key is None:
+                return True
+            return sort_key(todo) < after_key if descending else sort_key(todo) > after_key
+
+        todos = [
+            todo for todo in (
+                self.todos[todo_id] for todo_id in todo_ids
+                if all(todo_id in candidates for candidates in candidate_sets)
+            )
+            if matches(todo) and beyond_cursor(todo)
+        ]
+        if limit is None:
+            return sorted(todos, key=sort_key, reverse=descending)
+        if descending:
+            return heapq.nlargest(limit, todos, key=sort_key)
+        return heapq.nsmallest(limit, todos, key=sort_key)
+
+    def _walk_order(self, order: List[Tuple], positions: range, candidate_sets: List[Set[str]],
+                    matches: Callable[[TodoRecord], bool], descending: bool,
+                    limit: Optional[int]) -> List[TodoRecord]:
+        """沿有序索引顺序(或逆序)遍历 positions, 取够 limit 条即停止"""
+        todos = []
+        for position in (reversed(positions) if descending else positions):
+            if limit is not None and len(todos) >= limit:
+                break
+            todo_id = order[position][-1]
+            if not all(todo_id in candidates for candidates in candidate_sets):
+                continue
+            todo = self.todos[todo_id]
+            if matches(todo):
+                todos.append(todo)
+        return todos
+
+
+class SQLiteTodoStorage:
+    """基于SQLite(WAL模式)的待办事项存储
+
+    与 TodoStorage 接口相同, 数据不再整体驻留内存, 过滤条件直接转换为
+    走索引的SQL查询, 适合数据量远大于内存的场景.
+
+    写事务以 BEGIN IMMEDIATE 开始, 多个进程可以安全地共享同一个数据库文件.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS todos (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            priority TEXT NOT NULL,
+            completed INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+
+        -- 元数据: 写入代数(每次修改加一, 也作为被修改行的版本号)和存储标识
+        CREATE TABLE IF NOT EXISTS todo_meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+
+        -- 删除记录(墓碑): 被删除的id和删除时的写入代数, 供其他进程同步缓存
+        CREATE TABLE IF NOT EXISTS todo_tombstones (
+            id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            deleted_at REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_todo_tombstones_version ON todo_tombstones (version);
+        CREATE INDEX IF NOT EXISTS idx_todo_tombstones_deleted_at
+            ON todo_tombstones (deleted_at);
+        CREATE INDEX IF NOT EXISTS idx_todos_version ON todos (version);
+        CREATE INDEX IF NOT EXISTS idx_todos_completed_priority
+            ON todos (completed, priority, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_todos_priority ON todos (priority, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_todos_created_at ON todos (created_at, id);
+        -- 按更新时间和优先级排序使用的索引; 优先级按等级而不是名称的字母顺序排列
+        DROP INDEX IF EXISTS idx_todos_updated_at;
+        CREATE INDEX IF NOT EXISTS idx_todos_updated ON todos (updated_at, id);
+        CREATE INDEX IF NOT EXISTS idx_todos_priority_rank ON todos (
+            (CASE priority WHEN 'low' THEN 0 WHEN 'medium' THEN 1 ELSE 2 END), created_at, id
+        );
+
+        -- 按 (完成状态, 优先级) 分组的计数, 由触发器随写入增量维护
+        CREATE TABLE IF NOT EXISTS todo_counts (
+            completed INTEGER NOT NULL,
+            priority TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (completed, priority)
+        );
+        CREATE TRIGGER IF NOT EXISTS todo_counts_insert AFTER INSERT ON todos BEGIN
+            INSERT INTO todo_counts VALUES (NEW.completed, NEW.priority, 1)
+                ON CONFLICT (completed, priority) DO UPDATE SET count = count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS todo_counts_delete AFTER DELETE ON todos BEGIN
+            UPDATE todo_counts SET count = count - 1
+                WHERE completed = OLD.completed AND priority = OLD.priority;
+        END;
+        CREATE TRIGGER IF NOT EXISTS todo_counts_update
+        AFTER UPDATE OF completed, priority ON todos BEGIN
+            UPDATE todo_counts SET count = count - 1
+                WHERE completed = OLD.completed AND priority = OLD.priority;
+            INSERT INTO todo_counts VALUES (NEW.completed, NEW.priority, 1)
+                ON CONFLICT (completed, priority) DO UPDATE SET count = count + 1;
+        END;
+    """
+
+    COLUMNS = ("id", "title", "description", "priority", "completed",
+               "created_at", "updated_at")
+    # 各排序方式对应的排序列, 与有序索引的定义一致
+    PRIORITY_RANK = "(CASE priority WHEN 'low' THEN 0 WHEN 'medium' THEN 1 ELSE 2 END)"
+    SORT_COLUMNS = {
+        "created_at": ("created_at", "id"),
+        "updated_at": ("updated_at", "id"),
+        "priority": (PRIORITY_RANK, "created_at", "id"),
+    }
+    # 每次读写都会访问数据库文件, 需要放到线程池中执行
+    BLOCKING_IO = True
+
+    def __init__(self, db_file: str = "todos.db", tombstone_retention: float = 86400.0):
+        self.db_file = FilePath(db_file)
+        self.tombstone_retention = tombstone_retention
+        self._lock = threading.Lock()
+        self.store_id = ""
+        self.conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # SQLite内置的lower()只处理ASCII, 注册Python版本以保持与内存存储一致的搜索语义
+        self.conn.create_function("py_lower", 1, lambda value: value.lower() if value else value,
+                                  deterministic=True)
+        self.load_todos()
+
+    def load_todos(self):
+        """创建表和索引"""
+        with self._lock:
+            # 旧数据库需要先补上 version 列, 之后才能在其上建索引;
+            # 多个进程可能同时启动, 检查和修改放在同一个写事务中
+            self.conn.execute("BEGIN IMMEDIATE")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(todos)")]
+            if columns and "version" not in columns:
+                self.conn.execute("ALTER TABLE todos ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(todo_tombstones)")]
+            if columns and "deleted_at" not in columns:
+                self.conn.execute(
+                    "ALTER TABLE todo_tombstones ADD COLUMN deleted_at REAL NOT NULL DEFAULT 0")
+            self.conn.commit()
+            self.conn.executescript(self.SCHEMA)
+            # 初始化元数据和计数表同样要在一个写事务中完成
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("INSERT OR IGNORE INTO todo_meta VALUES ('generation', 0)")
+            self.conn.execute("INSERT OR IGNORE INTO todo_meta VALUES ('tombstone_floor', 0)")
+            self.conn.execute("INSERT OR IGNORE INTO todo_meta VALUES ('store_id', ?)",
+                              (uuid.uuid4().hex[:8],))
+            self.store_id = self.conn.execute(
+                "SELECT value FROM todo_meta WHERE key = 'store_id'").fetchone()[0]
+            # 旧数据库中还没有计数表的内容时, 从现有数据初始化一次
+            if self.conn.execute("SELECT COUNT(*) FROM todo_counts").fetchone()[0] == 0:
+                self.conn.execute(
+                    "INSERT INTO todo_counts "
+                    "SELECT completed, priority, COUNT(*) FROM todos GROUP BY completed, priority"
+                )
+            self.conn.commit()
+
+    def save_todos(self):
+        """每次修改都已在事务中提交, 这里只做WAL检查点"""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def flush(self):
+        """每次修改都已单独提交(WAL模式下提交本身很轻量), 没有需要合并的写入"""
+
+    @property
+    def has_pending_changes(self) -> bool:
+        """SQLite后端不积累待写入的修改"""
+        return False
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self.conn.close()
+
+    def _row_to_todo(self, row: tuple) -> Todo:
+        """把查询结果行转换为待办事项"""
+        todo_data = dict(zip(self.COLUMNS, row))
+        todo_data["completed"] = bool(todo_data["completed"])
+        return Todo(**todo_data)
+
+    def _query(self, where: str = "", params: tuple = (),
+               limit: Optional[int] = None, order_by: str = "created_at, id") -> List[Todo]:
+        """执行查询并按 order_by 顺序(默认为 (created_at, id))返回待办事项"""
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM todos {where} ORDER BY {order_by}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (*params, limit)
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._row_to_todo(row) for row in rows]
+
+    @property
+    def generation(self) -> int:
+        """当前写入代数"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT value FROM todo_meta WHERE key = 'generation'").fetchone()[0]
+
+    def get_todo_version(self, todo_id: str) -> Optional[int]:
+        """待办事项的版本号(最后一次修改时的写入代数), 不存在时返回None"""
+        with self._lock:
+            row = self.conn.execute("SELECT version FROM todos WHERE id = ?",
+                                    (todo_id,)).fetchone()
+        return row[0] if row else None
+
+    @contextmanager
+    def _write(self):
+        """写事务: 以 BEGIN IMMEDIATE 开始, 一开始就取得数据库写锁
+
+        其他进程的写入因此不会插在"先检查再修改"之间; 出错时回滚.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def _meta(self, key: str) -> Any:
+        """读取元数据(调用方负责加锁)"""
+        return self.conn.execute("SELECT value FROM todo_meta WHERE key = ?", (key,)).fetchone()[0]
+
+    @property
+    def tombstone_floor(self) -> int:
+        """已被清理的墓碑中最大的写入代数"""
+        with self._lock:
+            return self._meta("tombstone_floor")
+
+    def get_changes(self, since: Optional[int], limit: int) -> Tuple[int, List[Change], bool]:
+        """返回写入代数大于 since 的修改: (当前写入代数, 按代数排序的修改, 是否还有更多)
+
+        先在 todos 和墓碑两张表的 version 索引上找出本页最后一条的代数,
+        再取出这个范围内的行和墓碑. since 为None时返回全部现存的待办事项.
+        """
+        low = since if since is not None else -1
+        with self._lock:
+            # 在一个读事务中完成, 保证几次查询看到同一个数据库快照
+            self.conn.execute("BEGIN")
+            try:
+                generation = self._meta("generation")
+                check_change_since(since, generation, self._meta("tombstone_floor"))
+                tombstone_source = ("UNION ALL SELECT version FROM todo_tombstones "
+                                    "WHERE version > ? AND version <= ?"
+                                    if since is not None else "")
+                bounds = (low, generation, low, generation) if since is not None else \
+                    (low, generation)
+                versions = f"""
+                    SELECT version FROM (
+                        SELECT version FROM todos WHERE version > ? AND version <= ?
+                        {tombstone_source}
+                    ) ORDER BY version LIMIT 1 OFFSET ?
+                """
+                upper = generation
+                has_more = False
+                boundary = self.conn.execute(versions, (*bounds, limit - 1)).fetchone()
+                if boundary is not None:
+                    after = self.conn.execute(
+                        f"""SELECT 1 FROM todos WHERE version > ? AND version <= ?
+                            {tombstone_source} LIMIT 1""",
+                        (boundary[0], generation) * (2 if since is not None else 1)
+                    ).fetchone()
+                    if after is not None:
+                        upper, has_more = boundary[0], True
+
+                rows = self.conn.execute(
+                    f"SELECT version, {', '.join(self.COLUMNS)} FROM todos "
+                    "WHERE version > ? AND version <= ?", (low, upper)
+                ).fetchall()
+                changes: List[Change] = [(row[0], row[1], self._row_to_todo(row[1:]))
+                                         for row in rows]
+                if since is not None:
+                    changes.extend(
+                        (version, todo_id, None) for todo_id, version in self.conn.execute(
+                            "SELECT id, version FROM todo_tombstones "
+                            "WHERE version > ? AND version <= ?", (low, upper))
+                    )
+            finally:
+                self.conn.commit()
+        changes.sort(key=lambda change: (change[0], change[1]))
+        return generation, changes, has_more
+
+    def _prune_tombstones(self):
+        """清理超过保留期的墓碑并记下其中最大的写入代数(调用方负责加锁和事务)"""
+        cutoff = time.time() - self.tombstone_retention
+        floor = self.conn.execute("SELECT MAX(version) FROM todo_tombstones WHERE deleted_at < ?",
+                                  (cutoff,)).fetchone()[0]
+        if floor is not None:
+            self.conn.execute("DELETE FROM todo_tombstones WHERE deleted_at < ?", (cutoff,))
+            self.conn.execute(
+                "UPDATE todo_meta SET value = MAX(value, ?) WHERE key = 'tombstone_floor'", (floor,))
+
+    def changed_rows(self, generation: int) -> Tuple[List[TodoRecord], List[str]]:
+        """返回写入代数大于 generation 的行(紧凑记录)和被删除的id"""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)}, version FROM todos WHERE version > ?",
+                (generation,)
+            ).fetchall()
+            deleted = [row[0] for row in self.conn.execute(
+                "SELECT id FROM todo_tombstones WHERE version > ?", (generation,))]
+        records = [
+            TodoRecord(todo_id, title, description, PRIORITY_CODES[priority], bool(completed),
+                       datetime_to_micros(datetime.fromisoformat(created_at)),
+                       datetime_to_micros(datetime.fromisoformat(updated_at)), version)
+            for todo_id, title, description, priority, completed, created_at, updated_at, version
+            in rows
+        ]
+        return records, deleted
+
+    def _next_generation(self) -> int:
+        """推进写入代数并返回新值(调用方负责加锁和事务)"""
+        return self.conn.execute(
+            "UPDATE todo_meta SET value = value + 1 WHERE key = 'generation' RETURNING value"
+        ).fetchone()[0]
+
+    def _insert_todo(self, todo_create: TodoCreate) -> Todo:
+        """插入一条待办事项(调用方负责加锁和事务)"""
+        now = datetime.now()
+        todo = Todo(
+            id=str(uuid.uuid4()),
+            title=todo_create.title,
+            description=todo_create.description,
+            priority=todo_create.priority,
+            completed=todo_create.completed,
+            created_at=now,
+            updated_at=now
+        )
+        self.conn.execute(
+            f"INSERT INTO todos ({', '.join(self.COLUMNS)}, version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (todo.id, todo.title, todo.description, todo.priority,
+             int(todo.completed), now.isoformat(), now.isoformat(), self._next_generation())
+        )
+        return todo
+
+    def _update_row(self, todo_id: str, todo_update: TodoUpdate) -> bool:
+        """更新一条待办事项(调用方负责加锁和事务), 返回是否存在"""
+        update_data = todo_update.dict(exclude_unset=True)
+        if "completed" in update_data:
+            update_data["completed"] = int(update_data["completed"])
+        update_data["updated_at"] = datetime.now().isoformat()
+        if self.conn.execute("SELECT 1 FROM todos WHERE id = ?", (todo_id,)).fetchone() is None:
+            return False
+        update_data["version"] = self._next_generation()
+
+        assignments = ", ".join(f"{field} = ?" for field in update_data)
+        self.conn.execute(
+            f"UPDATE todos SET {assignments} WHERE id = ?",
+            (*update_data.values(), todo_id)
+        )
+        return True
+
+    def create_todo(self, todo_create: TodoCreate) -> Todo:
+        """创建新待办事项"""
+        with self._write():
+            return self._insert_todo(todo_create)
+
+    def create_todos(self, todo_creates: List[TodoCreate]) -> List[Todo]:
+        """在一个事务中批量创建待办事项"""
+        with self._write():
+            return [self._insert_todo(todo_create) for todo_create in todo_creates]
+
+    def get_todo(self, todo_id: str) -> Optional[Todo]:
+        """获取特定待办事项"""
+        todos = self._query("WHERE id = ?", (todo_id,))
+        return todos[0] if todos else None
+
+    @staticmethod
+    def _encode(todo: Todo) -> bytes:
+        """编码待办事项; 数据不常驻内存, 不做缓存"""
+        todo_dict = todo.dict()
+        todo_dict["created_at"] = todo.created_at.isoformat()
+        todo_dict["updated_at"] = todo.updated_at.isoformat()
+        return encode_todo_json(todo_dict)
+
+    def get_todo_encoded(self, todo_id: str) -> Optional[bytes]:
+        """获取待办事项的JSON编码"""
+        todo = self.get_todo(todo_id)
+        return self._encode(todo) if todo is not None else None
+
+    def filter_todos_encoded(self, **filters: Any) -> List[Tuple[CursorKey, bytes]]:
+        """过滤待办事项, 返回 (排序键, JSON编码) 列表"""
+        sort = filters.get("sort", "created_at")
+        return [(todo_sort_key(todo, sort), self._encode(todo))
+                for todo in self.filter_todos(**filters)]
+
+    def get_todos(self, todo_ids: List[str]) -> List[Optional[Todo]]:
+        """按id批量获取待办事项, 不存在的位置为None"""
+        found: Dict[str, Todo] = {}
+        # 分块查询, 避免超出SQLite的参数个数限制
+        for start in range(0, len(todo_ids), 500):
+            chunk = todo_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            for todo in self._query(f"WHERE id IN ({placeholders})", tuple(chunk)):
+                found[todo.id] = todo
+        return [found.get(todo_id) for todo_id in todo_ids]
+
+    def get_all_todos(self) -> List[Todo]:
+        """获取所有待办事项"""
+        return self._query()
+
+    def _stats_from_counts(self, table: str, count_expr: str) -> Dict[str, Any]:
+        """按 (完成状态, 优先级) 分组计数并构造统计信息"""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT completed, priority, {count_expr} FROM {table} "
+                "GROUP BY completed, priority"
+            ).fetchall()
+        by_priority: Dict[str, int] = {}
+        for completed, priority, count in rows:
+            by_priority[priority] = by_priority.get(priority, 0) + count
+        return build_stats(
+            total=sum(count for _, _, count in rows),
+            completed=sum(count for completed, _, count in rows if completed),
+            by_priority=by_priority
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """统计信息, 读取触发器维护的计数表"""
+        return self._stats_from_counts("todo_counts", "SUM(count)")
+
+    def recompute_stats(self) -> Dict[str, Any]:
+        """扫描 todos 表重新统计"""
+        return self._stats_from_counts("todos", "COUNT(*)")
+
+    def update_todo(self, todo_id: str, todo_update: TodoUpdate) -> Optional[Todo]:
+        """更新待办事项"""
+        with self._write():
+            found = self._update_row(todo_id, todo_update)
+        return self.get_todo(todo_id) if found else None
+
+    def toggle_todo(self, todo_id: str) -> Optional[Todo]:
+        """在一个写事务中读取并切换完成状态"""
+        with self._write():
+            row = self.conn.execute("SELECT completed FROM todos WHERE id = ?",
+                                    (todo_id,)).fetchone()
+            if row is None:
+                return None
+            self._update_row(todo_id, TodoUpdate(completed=not row[0]))
+        return self.get_todo(todo_id)
+
+    def update_todos(self, updates: List[Tuple[str, TodoUpdate]]) -> List[Optional[Todo]]:
+        """在一个事务中批量更新待办事项, 不存在的位置为None"""
+        with self._write():
+            found = [self._update_row(todo_id, todo_update) for todo_id, todo_update in updates]
+        todos = self.get_todos([todo_id for todo_id, _ in updates])
+        return [todo if ok else None for todo, ok in zip(todos, found)]
+
+    def _delete_row(self, todo_id: str) -> bool:
+        """删除一条待办事项(调用方负责加锁和事务), 返回是否存在"""
+        cursor = self.conn.execute("DELETE FROM todos WHERE id = ?", (todo_id,))
+        if cursor.rowcount == 0:
+            return False
+        self.conn.execute(
+            "INSERT INTO todo_tombstones VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET version = excluded.version, "
+            "deleted_at = excluded.deleted_at",
+            (todo_id, self._next_generation(), time.time())
+        )
+        self._prune_tombstones()
+        return True
+
+    def delete_todo(self, todo_id: str) -> bool:
+        """删除待办事项"""
+        with self._write():
+            return self._delete_row(todo_id)
+
+    def delete_todos(self, todo_ids: List[str]) -> List[bool]:
+        """在一个事务中批量删除待办事项"""
+        with self._write():
+            return [self._delete_row(todo_id) for todo_id in todo_ids]
+
+    def import_todos(self, todos: List[Todo]) -> int:
+        """在一个事务中导入完整的待办事项, 已存在的id会被覆盖
+
+        使用UPSERT而不是REPLACE, 以便计数表的UPDATE触发器正常执行.
+        """
+        columns = (*self.COLUMNS, "version")
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        with self._write():
+            # 整批导入共用一个新的写入代数作为版本号
+            version = self._next_generation()
+            self.conn.executemany(
+                f"INSERT INTO todos ({', '.join(columns)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT (id) DO UPDATE SET {updates}",
+                [(todo.id, todo.title, todo.description, todo.priority, int(todo.completed),
+                  todo.created_at.isoformat(), todo.updated_at.isoformat(), version)
+                 for todo in todos]
+            )
+        return len(todos)
+
+    def filter_todos(self, status: Optional[str] = None,
+                     priority: Optional[str] = None,
+                     search: Optional[str] = None,
+                     after: Optional[CursorKey] = None,
+                     limit: Optional[int] = None,
+                     sort: str = "created_at",
+                     descending: bool = False,
+                     created_after: Optional[datetime] = None,
+                     updated_since: Optional[datetime] = None) -> List[Todo]:
+        """过滤待办事项, 状态和优先级条件、排序、时间范围以及游标分页都由索引完成"""
+        conditions = []
+        params: List[Any] = []
+
+        if status == "completed":
+            conditions.append("completed = 1")
+        elif status == "pending":
+            conditions.append("completed = 0")
+
+        if priority:
+            conditions.append("priority = ?")
+            params.append(priority)
+
+        if search:
+            conditions.append("(instr(py_lower(title), ?) > 0 OR "
+                              "instr(py_lower(description), ?) > 0)")
+            params.extend([search.lower(), search.lower()])
+
+        # 时间以本地时间的ISO字符串保存, 查询参数先转换为同样的形式
+        if created_after is not None:
+            conditions.append("created_at > ?")
+            params.append(micros_to_datetime(datetime_to_micros(created_after)).isoformat())
+
+        if updated_since is not None:
+            conditions.append("updated_at >= ?")
+            params.append(micros_to_datetime(datetime_to_micros(updated_since)).isoformat())
+
+        columns = self.SORT_COLUMNS[sort]
+        if after is not None:
+            values = [value.isoformat() if isinstance(value, datetime) else value
+                      for value in after]
+            if sort == "priority":
+                values[0] = PRIORITY_CODES[values[0]]
+            placeholders = ", ".join("?" for _ in columns)
+            conditions.append(f"({', '.join(columns)}) {'<' if descending else '>'} "
+                              f"({placeholders})")
+            params.extend(values)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = " DESC" if descending else ""
+        order_by = ", ".join(column + direction for column in columns)
+        return self._query(where, tuple(params), limit, order_by)
+
+
+class SharedTodoStorage(TodoStorage):
+    """可由多个工作进程共享的待办事项存储
+
+    数据以SQLite(WAL模式)数据库为准, 写入都在数据库的写事务中完成; 每个进程在内存中
+    保留一份带索引的缓存来响应读取. 数据库中的写入代数就是全局的修改序号:
+    每次读取前先比较缓存的代数和数据库中的代数, 落后时只拉取版本号更大的行和墓碑.
+    """
+
+    # 读取前要查询数据库中的写入代数, 需要放到线程池中执行
+    BLOCKING_IO = True
+
+    def __init__(self, db_file: str = "todos.db", tombstone_retention: float = 86400.0):
+        self.database = SQLiteTodoStorage(db_file, tombstone_retention)
+        self._cache_lock = threading.RLock()
+        self._generation = 0
+        super().__init__(db_file)
+
+    @property
+    def generation(self) -> int:
+        """与数据库同步后的写入代数"""
+        with self._cache_lock:
+            self.sync()
+            return self._generation
+
+    @generation.setter
+    def generation(self, value: int):
+        self._generation = value
+
+    def load_todos(self):
+        """从数据库加载全部数据"""
+        start = time.perf_counter()
+        self.store_id = self.database.store_id
+        with self._cache_lock:
+            self._generation = -1
+            self.sync()
+        self.load_seconds = time.perf_counter() - start
+        STORAGE_LOAD_SECONDS.observe(self.load_seconds)
+        print(f"加载了 {len(self.todos)} 个待办事项, 用时 {self.load_seconds * 1000:.1f} ms "
+              f"(共享数据库: {self.database.db_file})")
+
+    def sync(self):
+        """如果其他进程(或本进程)修改过数据库, 把变化应用到内存缓存"""
+        with self._cache_lock:
+            # 先读代数再拉取变化: 期间的新写入会被重复拉取一次, 应用是幂等的
+            generation = self.database.generation
+            if generation == self._generation:
+                return
+            if self.database.tombstone_floor > self._generation >= 0:
+                # 落后太久, 期间的删除记录已被清理, 只能重新加载全部数据
+                self.todos = {}
+                self._generation = -1
+            records, deleted = self.database.changed_rows(self._generation)
+            if not self.todos:
+                self.todos = {todo.id: todo for todo in records}
+                self._rebuild_indexes()
+            else:
+                # 先删后写: 删除后又以同一id导入的行以最新的行为准
+                for todo_id in deleted:
+                    self._remove_record(todo_id)
+                for todo in records:
+                    self._put_record(todo)
+            self._generation = generation
+
+    def _read(self, method, *args):
+        """同步缓存后在缓存上执行读操作"""
+        with self._cache_lock:
+            self.sync()
+            return method(*args)
+
+    def _write(self, method, *args):
+        """在数据库中执行写操作, 然后同步缓存"""
+        result = method(*args)
+        self.sync()
+        return result
+
+    def get_todo(self, todo_id: str) -> Optional[Todo]:
+        return self._read(super().get_todo, todo_id)
+
+    def get_all_todos(self) -> List[Todo]:
+        return self._read(super().get_all_todos)
+
+    def get_todos(self, todo_ids: List[str]) -> List[Optional[Todo]]:
+        return self._read(super().get_todos, todo_ids)
+
+    def get_todo_encoded(self, todo_id: str) -> Optional[bytes]:
+        return self._read(super().get_todo_encoded, todo_id)
+
+    def get_todo_version(self, todo_id: str) -> Optional[int]:
+        return self._read(super().get_todo_version, todo_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self._read(super().get_stats)
+
+    def recompute_stats(self) -> Dict[str, Any]:
+        return self._read(super().recompute_stats)
+
+    def _filter_records(self, *args) -> List[TodoRecord]:
+        return self._read(super()._filter_records, *args)
+
+    def create_todo(self, todo_create: TodoCreate) -> Todo:
+        return self._write(self.database.create_todo, todo_create)
+
+    def create_todos(self, todo_creates: List[TodoCreate]) -> List[Todo]:
+        return self._write(self.database.create_todos, todo_creates)
+
+    def update_todo(self, todo_id: str, todo_update: TodoUpdate) -> Optional[Todo]:
+        return self._write(self.database.update_todo, todo_id, todo_update)
+
+    def update_todos(self, updates: List[Tuple[str, TodoUpdate]]) -> List[Optional[Todo]]:
+        return self._write(self.database.update_todos, updates)
+
+    def toggle_todo(self, todo_id: str) -> Optional[Todo]:
+        return self._write(self.database.toggle_todo, todo_id)
+
+    def delete_todo(self, todo_id: str) -> bool:
+        return self._write(self.database.delete_todo, todo_id)
+
+    def delete_todos(self, todo_ids: List[str]) -> List[bool]:
+        return self._write(self.database.delete_todos, todo_ids)
+
+    def import_todos(self, todos: List[Todo]) -> int:
+        return self._write(self.database.import_todos, todos)
+
+    def get_changes(self, since: Optional[int], limit: int) -> Tuple[int, List[Change], bool]:
+        return self.database.get_changes(since, limit)
+
+    def flush(self):
+        """每次写入都已在数据库中提交"""
+
+    @property
+    def has_pending_changes(self) -> bool:
+        return False
+
+    def save_todos(self):
+        self.database.save_todos()
+
+    def close(self):
+        self.database.close()
+
+
+class AsyncTodoStorage:
+    """存储的异步门面
+
+    底层存储始终处于推迟持久化模式: 写操作先在持有单写者锁的情况下修改数据,
+    再把落盘放到有界线程池中执行, 锁保证写入和落盘的顺序. 落盘期间事件循环
+    不被阻塞, 内存中的读请求照常处理. 需要文件/数据库I/O的后端(BLOCKING_IO)
+    连读写操作本身也放到线程池中执行.
+
+    启用组提交时由 GroupCommitFlusher 负责落盘, 写操作不再逐个落盘.
+    """
+
+    def __init__(self, storage, max_workers: int = 2,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        self.storage = storage
+        self.storage.group_commit = True
+        # 每次写操作后是否立即落盘; 组提交刷新器接管时关闭
+        self.auto_flush = True
+        # 多租户时各租户的门面共用一个线程池, 关闭门面时不关闭它
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers,
+                                                        thread_name_prefix="todo-storage")
+        self._write_lock: Optional[asyncio.Lock] = None
+        # 长轮询的等待者: 本进程每次写入后触发并换成新的事件
+        self._changed: Optional[asyncio.Event] = None
+        self._changed_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __getattr__(self, name: str) -> Any:
+        """其他属性(store_id、调试用的内部索引等)直接转发给底层存储"""
+        return getattr(self.storage, name)
+
+    async def _call(self, func, *args):
+        """调用底层存储: 需要I/O的后端在线程池中执行, 否则直接调用"""
+        if self.storage.BLOCKING_IO:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, lambda: func(*args))
+        return func(*args)
+
+    def _lock(self) -> asyncio.Lock:
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    async def _write(self, func, *args):
+        """在单写者锁内执行写操作, 需要时随后在线程池中落盘"""
+        async with self._lock():
+            result = await self._call(func, *args)
+            if self.auto_flush:
+                await self._flush_locked()
+        self._notify_change()
+        return result
+
+    # 其他进程(共享后端)的写入不会触发事件, 等待期间按这个间隔检查写入代数
+    CHANGE_POLL_SECONDS = 1.0
+
+    def _notify_change(self):
+        """唤醒等待新修改的长轮询请求"""
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    async def wait_for_change(self, generation: int, timeout: float) -> bool:
+        """等待写入代数超过 generation, 超时返回False"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while await self.get_generation() <= generation:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            if self._changed is None or self._changed_loop is not loop:
+                self._changed = asyncio.Event()
+                self._changed_loop = loop
+            try:
+                await asyncio.wait_for(self._changed.wait(),
+                                       min(remaining, self.CHANGE_POLL_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    async def _flush_locked(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.storage.flush)
+
+    async def flush(self):
+        """把推迟的修改落盘"""
+        async with self._lock():
+            await self._flush_locked()
+
+    def close(self):
+        """关闭线程池和底层存储"""
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+        if self.storage.has_pending_changes:
+            self.storage.flush()
+        self.storage.close()
+
+    # 读操作
+    async def get_todo(self, todo_id: str) -> Optional[Todo]:
+        return await self._call(self.storage.get_todo, todo_id)
+
+    async def get_todos(self, todo_ids: List[str]) -> List[Optional[Todo]]:
+        return await self._call(self.storage.get_todos, todo_ids)
+
+    async def get_todo_version(self, todo_id: str) -> Optional[int]:
+        return await self._call(self.storage.get_todo_version, todo_id)
+
+    async def get_generation(self) -> int:
+        return await self._call(lambda: self.storage.generation)
+
+    async def filter_todos(self, **filters: Any) -> List[Todo]:
+        return await self._call(lambda: self.storage.filter_todos(**filters))
+
+    async def filter_todos_encoded(self, **filters: Any) -> List[Tuple[CursorKey, bytes]]:
+        return await self._call(lambda: self.storage.filter_todos_encoded(**filters))
+
+    async def get_todo_encoded(self, todo_id: str) -> Optional[bytes]:
+        return await self._call(self.storage.get_todo_encoded, todo_id)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return await self._call(self.storage.get_stats)
+
+    async def verify_stats(self) -> Dict[str, Any]:
+        return await self._call(verify_stats, self.storage)
+
+    async def get_changes(self, since: Optional[int], limit: int) -> Tuple[int, List[Change], bool]:
+        return await self._call(self.storage.get_changes, since, limit)
+
+    # 写操作
+    async def create_todo(self, todo_create: TodoCreate) -> Todo:
+        return await self._write(self.storage.create_todo, todo_create)
+
+    async def create_todos(self, todo_creates: List[TodoCreate]) -> List[Todo]:
+        return await self._write(self.storage.create_todos, todo_creates)
+
+    async def update_todo(self, todo_id: str, todo_update: TodoUpdate) -> Optional[Todo]:
+        return await self._write(self.storage.update_todo, todo_id, todo_update)
+
+    async def update_todos(self, updates: List[Tuple[str, TodoUpdate]]) -> List[Optional[Todo]]:
+        return await self._write(self.storage.update_todos, updates)
+
+    async def toggle_todo(self, todo_id: str) -> Optional[Todo]:
+        """在同一次写操作中读取并切换完成状态"""
+        return await self._write(self.storage.toggle_todo, todo_id)
+
+    async def delete_todo(self, todo_id: str) -> bool:
+        return await self._write(self.storage.delete_todo, todo_id)
+
+    async def delete_todos(self, todo_ids: List[str]) -> List[bool]:
+        return await self._write(self.storage.delete_todos, todo_ids)
+
+    async def import_todos(self, todos: List[Todo]) -> int:
+        return await self._write(self.storage.import_todos, todos)
+
+
+class GroupCommitFlusher:
+    """组提交刷新器
+
+    写请求只把存储标记为有待写入的修改并登记一个等待者, 单个后台任务在第一次
+    修改后最多等待 interval_ms 毫秒(或积累 max_pending 个修改)再统一落盘,
+    一次写入覆盖这段时间内的所有修改. 需要持久化确认的请求可以等待
+    覆盖其修改的那次落盘完成.
+    """
+
+    def __init__(self, storage: AsyncTodoStorage, interval_ms: int = 50,
+                 max_pending: int = 100, durable: bool = False):
+        self.storage = storage
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+        self.durable = durable
+        self.flush_count = 0
+        self._pending = 0
+        self._waiters: List[asyncio.Future] = []
+        self._dirty_event: Optional[asyncio.Event] = None
+        self._full_event: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self):
+        """在当前事件循环中启动后台刷新任务"""
+        self.storage.auto_flush = False
+        self._stopping = False
+        self._dirty_event = asyncio.Event()
+        self._full_event = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务, 并把剩余的修改落盘
+
+        不取消后台任务: 取消可能发生在落盘途中, 那次落盘已取出的等待者将永远得不到通知.
+        这里唤醒后台任务, 等它完成正在进行的落盘后自行退出.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._dirty_event.set()
+            self._full_event.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        self.storage.auto_flush = True
+
+    def mark_dirty(self) -> asyncio.Future:
+        """登记一次修改, 返回在覆盖这次修改的落盘完成后结束的Future"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._pending += 1
+        self._dirty_event.set()
+        if self._pending >= self.max_pending:
+            self._full_event.set()
+        return waiter
+
+    async def commit(self, durable: Optional[bool] = None):
+        """登记一次修改, 需要持久化确认时等待落盘完成"""
+        waiter = self.mark_dirty()
+        if self.durable if durable is None else durable:
+            await waiter
+
+    async def _run(self):
+        """后台任务: 有修改后等待一个刷新间隔或积累足够多的修改, 然后落盘"""
+        while not self._stopping:
+            await self._dirty_event.wait()
+            if self._stopping:
+                break
+            try:
+                await asyncio.wait_for(self._full_event.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """立即把当前所有修改落盘, 并通知对应的等待者"""
+        waiters, self._waiters = self._waiters, []
+        self._pending = 0
+        if self._dirty_event is not None:
+            self._dirty_event.clear()
+            self._full_event.clear()
+        if not waiters and not self.storage.has_pending_changes:
+            return
+
+        try:
+            # 文件写入在存储门面的线程池中执行, 不阻塞事件循环
+            await self.storage.flush()
+        except Exception as e:
+            print(f"组提交落盘失败: {e}")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+
+        self.flush_count += 1
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+def create_storage(tenant: Optional[str] = None):
+    """根据环境变量创建存储后端
+
+    - TODO_STORAGE_BACKEND: memory(默认)、sqlite 或 shared(多进程共享的SQLite加内存缓存)
+    - TODO_PERSISTENCE: 内存存储的持久化模式, snapshot(默认) 或 journal
+    - TODO_SNAPSHOT_FORMAT: 内存存储的快照格式, json(默认) 或 binary
+    - TODO_SHARDS: 内存存储的快照分片数, 默认1(单个文件)
+    - TODO_QUERY_CACHE_SIZE: 内存存储缓存的查询结果数, 默认128, 0为关闭
+    - TODO_SQLITE_FILE: sqlite/shared 后端的数据库文件, 默认 todos.db
+    - TODO_TOMBSTONE_RETENTION_SECONDS: 变更流中删除记录的保留时间, 默认 86400 秒
+    - TODO_TENANTS_DIR: 多租户时各租户数据文件所在的目录, 默认 tenants
+
+    指定 tenant 时数据文件为租户目录下的 <tenant>.json 或 <tenant>.db.
+    """
+    backend = os.environ.get("TODO_STORAGE_BACKEND", "memory")
+    retention = float(os.environ.get("TODO_TOMBSTONE_RETENTION_SECONDS", "86400"))
+    tenants_dir = FilePath(os.environ.get("TODO_TENANTS_DIR", "tenants"))
+    if tenant is not None:
+        tenants_dir.mkdir(parents=True, exist_ok=True)
+    if backend == "memory":
+        data_file = str(tenants_dir / f"{tenant}.json") if tenant is not None else "todos.json"
+        return TodoStorage(data_file,
+                           persistence=os.environ.get("TODO_PERSISTENCE", "snapshot"),
+                           snapshot_format=os.environ.get("TODO_SNAPSHOT_FORMAT", "json"),
+                           tombstone_retention=retention,
+                           shards=int(os.environ.get("TODO_SHARDS", "1")),
+                           query_cache_size=int(os.environ.get("TODO_QUERY_CACHE_SIZE", "128")))
+    db_file = (str(tenants_dir / f"{tenant}.db") if tenant is not None
+               else os.environ.get("TODO_SQLITE_FILE", "todos.db"))
+    if backend == "sqlite":
+        return SQLiteTodoStorage(db_file, retention)
+    if backend == "shared":
+        return SharedTodoStorage(db_file, retention)
+    raise ValueError(f"未知的存储后端: {backend}")
+
+
+# 当前请求所属租户的存储, 由 TenantMiddleware 在请求开始时设置
+current_tenant_storage: contextvars.ContextVar = contextvars.ContextVar("current_tenant_storage")
+
+
+class TenantEntry:
+    """常驻内存的一个租户存储"""
+
+    __slots__ = ("storage", "in_use", "size")
+
+    def __init__(self, storage: AsyncTodoStorage, size: int):
+        self.storage = storage
+        # 正在使用这个存储的请求数, 大于0时不会被淘汰
+        self.in_use = 0
+        # 估算的内存占用(字节)
+        self.size = size
+
+
+class TenantStorage:
+    """多租户存储: 每个租户一个独立的存储, 首次访问时加载, 按LRU淘汰
+
+    常驻的租户数超过 max_tenants, 或估算的内存占用超过 memory_budget 字节时,
+    从最久未使用的空闲租户开始淘汰; 淘汰前先把推迟的修改落盘, 落盘失败的租户保留.
+    端点照常通过全局的 storage 访问存储, 属性和方法转发给当前请求所属租户的存储.
+    """
+
+    # 内存占用的粗略估算: 每个待办事项(含各个索引)约2KB, 每个存储本身约16KB;
+    # 100万个待办事项的基准测试中进程内存峰值约2.1GB
+    TODO_BYTES = 2048
+    STORE_BYTES = 16 * 1024
+
+    def __init__(self, factory: Callable[[str], Any], max_tenants: int = 1000,
+                 memory_budget: int = 512 * 1024 * 1024, max_workers: int = 4):
+        self.factory = factory
+        self.max_tenants = max_tenants
+        self.memory_budget = memory_budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="todo-tenant")
+        self._entries: Dict[str, TenantEntry] = OrderedDict()
+        self._resident_bytes = 0
+        # 正在加载或正在淘汰的租户 -> 完成时结束的Future, 同一租户的请求等待它完成
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._auto_flush = True
+        self.metrics = {"loads": 0, "hits": 0, "evictions": 0, "eviction_failures": 0}
+
+    def __getattr__(self, name: str) -> Any:
+        """其他属性和方法转发给当前请求所属租户的存储"""
+        return getattr(self.current(), name)
+
+    def current(self) -> AsyncTodoStorage:
+        try:
+            return current_tenant_storage.get()
+        except LookupError:
+            raise RuntimeError("当前请求没有关联的租户") from None
+
+    @property
+    def resident_bytes(self) -> int:
+        return self._resident_bytes
+
+    def resident_tenants(self) -> List[str]:
+        """常驻内存的租户, 从最久未使用到最近使用"""
+        return list(self._entries)
+
+    def estimate_size(self, storage: AsyncTodoStorage) -> int:
+        """估算一个租户存储的内存占用; 数据在数据库中的后端只计固定开销"""
+        todos = getattr(storage.storage, "todos", None)
+        return self.STORE_BYTES + self.TODO_BYTES * (len(todos) if todos is not None else 0)
+
+    async def acquire(self, tenant: str) -> AsyncTodoStorage:
+        """取得租户的存储(需要时加载), 使用结束后必须调用 release()"""
+        while True:
+            entry = self._entries.get(tenant)
+            if entry is not None:
+                self._entries.move_to_end(tenant)
+                entry.in_use += 1
+                self.metrics["hits"] += 1
+                return entry.storage
+            pending = self._pending.get(tenant)
+            if pending is None:
+                break
+            # 同一租户正在加载或淘汰, 等它完成后重新检查
+            await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        self._pending[tenant] = loop.create_future()
+        try:
+            inner = await loop.run_in_executor(self._executor, self.factory, tenant)
+            storage = AsyncTodoStorage(inner, executor=self._executor)
+            storage.auto_flush = self._auto_flush
+            entry = self._entries[tenant] = TenantEntry(storage, self.estimate_size(storage))
+            entry.in_use = 1
+            self._resident_bytes += entry.size
+            self.metrics["loads"] += 1
+        finally:
+            self._pending.pop(tenant).set_result(None)
+        await self._evict()
+        return storage
+
+    async def release(self, tenant: str):
+        """结束对租户存储的使用, 更新内存估算, 超出限制时淘汰空闲租户"""
+        entry = self._entries.get(tenant)
+        if entry is None:
+            return
+        entry.in_use -= 1
+        size = self.estimate_size(entry.storage)
+        self._resident_bytes += size - entry.size
+        entry.size = size
+        await self._evict()
+
+    def _over_limit(self) -> bool:
+        return (len(self._entries) > self.max_tenants
+                or (self.memory_budget > 0 and self._resident_bytes > self.memory_budget))
+
+    async def _evict(self):
+        """按LRU顺序淘汰空闲的租户, 直到不再超出限制(或没有可淘汰的租户)"""
+        while self._over_limit():
+            tenant = next((tenant for tenant, entry in self._entries.items()
+                           if entry.in_use == 0), None)
+            if tenant is None:
+                return
+            entry = self._entries.pop(tenant)
+            self._resident_bytes -= entry.size
+            self._pending[tenant] = asyncio.get_running_loop().create_future()
+            try:
+                await entry.storage.flush()
+                await asyncio.get_running_loop().run_in_executor(
+                    self._executor, entry.storage.close)
+                self.metrics["evictions"] += 1
+            except Exception as e:
+                # 落盘失败时保留在内存中(放到最近使用的位置), 不丢失修改
+                print(f"淘汰租户 {tenant} 时落盘失败: {e}")
+                self.metrics["eviction_failures"] += 1
+                self._entries[tenant] = entry
+                self._resident_bytes += entry.size
+                return
+            finally:
+                self._pending.pop(tenant).set_result(None)
+
+    # 组提交刷新器和关闭时使用的操作, 作用于所有常驻的租户
+
+    @property
+    def auto_flush(self) -> bool:
+        return self._auto_flush
+
+    @auto_flush.setter
+    def auto_flush(self, value: bool):
+        self._auto_flush = value
+        for entry in self._entries.values():
+            entry.storage.auto_flush = value
+
+    @property
+    def has_pending_changes(self) -> bool:
+        return any(entry.storage.has_pending_changes for entry in self._entries.values())
+
+    async def flush(self):
+        """把所有常驻租户推迟的修改落盘"""
+        for entry in list(self._entries.values()):
+            await entry.storage.flush()
+
+    def close(self):
+        """落盘并关闭所有常驻租户的存储"""
+        for entry in self._entries.values():
+            entry.storage.close()
+        self._entries.clear()
+        self._resident_bytes = 0
+        self._executor.shutdown(wait=True)
+
+
+class AdmissionController:
+    """准入控制: 每个客户端一个令牌桶, 加上全局并发上限
+
+    - rate/burst: 每个客户端每秒补充的令牌数和桶的容量, rate 为0时不限速
+    - max_concurrency: 同时处理的请求数上限, 为0时不限制. 达到上限后新请求排队,
+      最多等待 max_queue_wait 秒, 仍未轮到则拒绝
+    被拒绝的请求返回503和 Retry-After; 拒绝次数和排队时间记录在 metrics 中.
+    """
+
+    # 排队时间直方图的上界(秒)
+    QUEUE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+    # 令牌桶数量超过这个值时清理已经补满的桶
+    MAX_CLIENTS = 10000
+
+    def __init__(self, max_concurrency: int = 0, max_queue_wait: float = 0.1,
+                 rate: float = 0.0, burst: int = 20):
+        self.max_concurrency = max_concurrency
+        self.max_queue_wait = max_queue_wait
+        self.rate = rate
+        self.burst = burst
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        # 客户端 -> [剩余令牌数, 上次补充的时间]
+        self._buckets: Dict[str, List[float]] = {}
+        self.metrics: Dict[str, Any] = {
+            "admitted": 0,
+            "rejected_rate_limited": 0,
+            "rejected_overloaded": 0,
+            "queued": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "queue_wait_buckets": [0] * (len(self.QUEUE_WAIT_BUCKETS) + 1),
+        }
+
+    def take_token(self, client: str) -> float:
+        """从客户端的令牌桶中取一个令牌; 成功返回0, 否则返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_CLIENTS:
+                self._prune_buckets(now)
+            bucket = self._buckets[client] = [float(self.burst), now]
+        else:
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        self.metrics["rejected_rate_limited"] += 1
+        return (1 - bucket[0]) / self.rate
+
+    def _prune_buckets(self, now: float):
+        """删除已经补满的令牌桶, 它们和新建的桶没有区别"""
+        full = [client for client, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.burst]
+        for client in full:
+            del self._buckets[client]
 
+    async def acquire(self) -> bool:
+        """获取一个并发名额, 排队超时返回False"""
+        if self.max_concurrency <= 0 or self.in_flight < self.max_concurrency:
+            self.in_flight += 1
+            self._admit(0.0)
+            return True
 
-# 数据存储管理
-class TodoStorage:
-    """待办事项数据存储管理器"""
-    
-    def __init__(self, data_file: str = "todos.json"):
-        self.data_file = Path(data_file)
-        self.todos: Dict[str, Todo] = {}
-        self.load_todos()
-    
-    def load_todos(self):
-        """从文件加载待办事项"""
-        if self.data_file.exists():
-            try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    for todo_data in data:
-                        todo = Todo(**todo_data)
-                        self.todos[todo.id] = todo
-            except Exception as e:
-                print(f"加载数据失败: {e}")
-                self.todos = {}
-    
-    def save_todos(self):
-        """保存待办事项到文件"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.metrics["queued"] += 1
+        start = time.monotonic()
         try:
-            data = []
-            for todo in self.todos.values():
-                todo_dict = todo.dict()
-                # 确保日期时间正确序列化
-                todo_dict['created_at'] = todo.created_at.isoformat()
-                todo_dict['updated_at'] = todo.updated_at.isoformat()
-                data.append(todo_dict)
-            
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存数据失败: {e}")
-    
-    def create_todo(self, todo_create: TodoCreate) -> Todo:
-        """创建新待办事项"""
-        todo_id = str(uuid.uuid4())
-        now = datetime.now()
-        
-        todo = Todo(
-            id=todo_id,
-            title=todo_create.title,
-            description=todo_create.description,
-            priority=todo_create.priority,
-            completed=todo_create.completed,
-            created_at=now,
-            updated_at=now
-        )
-        
-        self.todos[todo_id] = todo
-        self.save_todos()
-        return todo
-    
-    def get_todo(self, todo_id: str) -> Optional[Todo]:
-        """获取特定待办事项"""
-        return self.todos.get(todo_id)
-    
-    def get_all_todos(self) -> List[Todo]:
-        """获取所有待办事项"""
-        return list(self.todos.values())
-    
-    def update_todo(self, todo_id: str, todo_update: TodoUpdate) -> Optional[Todo]:
-        """更新待办事项"""
-        if todo_id not in self.todos:
-            return None
-        
-        todo = self.todos[todo_id]
-        update_data = todo_update.dict(exclude_unset=True)
-        
-        for field, value in update_data.items():
-            setattr(todo, field, value)
-        
-        todo.updated_at = datetime.now()
-        self.save_todos()
-        return todo
-    
-    def delete_todo(self, todo_id: str) -> bool:
-        """删除待办事项"""
-        if todo_id not in self.todos:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_queue_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # 超时或排队时请求被取消(客户端断开、关闭服务): 已经分配到的名额让给下一个,
+            # 否则退出队列, 以免 release() 把名额转交给不再等待的请求
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.metrics["rejected_overloaded"] += 1
             return False
-        
-        del self.todos[todo_id]
-        self.save_todos()
+        # release() 把名额直接转交给了这个等待者, in_flight 不变
+        self._admit(time.monotonic() - start)
         return True
-    
-    def filter_todos(self, status: Optional[str] = None, 
-                    priority: Optional[str] = None,
-                    search: Optional[str] = None) -> List[Todo]:
-        """过滤待办事项"""
-        todos = self.get_all_todos()
-        
-        if status == "completed":
-            todos = [todo for todo in todos if todo.completed]
-        elif status == "pending":
-            todos = [todo for todo in todos if not todo.completed]
-        
-        if priority:
-            todos = [todo for todo in todos if todo.priority == priority]
-        
-        if search:
-            search_lower = search.lower()
-            todos = [
-                todo for todo in todos 
-                if search_lower in todo.title.lower() or 
-                (todo.description and search_lower in todo.description.lower())
-            ]
-        
-        return todos
+
+    def release(self):
+        """归还并发名额, 有人排队时直接转交给最早的等待者"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _admit(self, waited: float):
+        self.metrics["admitted"] += 1
+        self.metrics["queue_wait_seconds_total"] += waited
+        self.metrics["queue_wait_seconds_max"] = max(self.metrics["queue_wait_seconds_max"], waited)
+        self.metrics["queue_wait_buckets"][bisect.bisect_left(self.QUEUE_WAIT_BUCKETS, waited)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前配置、状态和计数"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue_wait": self.max_queue_wait,
+            "rate": self.rate,
+            "burst": self.burst,
+            "in_flight": self.in_flight,
+            "queue_length": sum(1 for waiter in self._waiters if not waiter.done()),
+            **self.metrics,
+            "queue_wait_buckets": dict(zip(
+                [str(bound) for bound in self.QUEUE_WAIT_BUCKETS] + ["+Inf"],
+                self.metrics["queue_wait_buckets"]
+            )),
+        }
+
+
+class AdmissionMiddleware:
+    """在请求进入路由之前做准入控制, 超过限制时直接返回503
+
+    客户端由 X-Client-Id 请求头区分, 没有时使用客户端地址. unbounded_paths 下的
+    长连接请求(长轮询、SSE)和监控端点只限速, 不占用并发名额.
+    """
+
+    def __init__(self, app, controller: AdmissionController,
+                 unbounded_paths: Tuple[str, ...] = ("/todos/changes", "/admission", "/metrics")):
+        self.app = app
+        self.controller = controller
+        self.unbounded_paths = unbounded_paths
+
+    @staticmethod
+    def client_key(scope: Dict[str, Any]) -> str:
+        for name, value in scope.get("headers", []):
+            if name == b"x-client-id":
+                return value.decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = self.controller.take_token(self.client_key(scope))
+        if retry_after:
+            await self.reject(scope, receive, send, "请求过于频繁", retry_after)
+            return
+
+        if strip_tenant_prefix(scope["path"]).startswith(self.unbounded_paths):
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire():
+            await self.reject(scope, receive, send, "服务繁忙, 请稍后重试",
+                              self.controller.max_queue_wait)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+    @staticmethod
+    async def reject(scope, receive, send, detail: str, retry_after: float):
+        response = JSONResponse({"detail": detail}, status_code=503,
+                                headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        await response(scope, receive, send)
+
+
+TENANT_PATH_PREFIX = "/tenants/"
+TENANT_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def strip_tenant_prefix(path: str) -> str:
+    """去掉路径中的 /tenants/{tenant_id} 前缀"""
+    if not path.startswith(TENANT_PATH_PREFIX):
+        return path
+    return "/" + path[len(TENANT_PATH_PREFIX):].partition("/")[2]
+
+
+class TenantMiddleware:
+    """为每个请求选择租户并取得它的存储
+
+    路径前缀 /tenants/{tenant_id} 优先(前缀会从路径中去掉, 路由照常匹配),
+    其次是 X-Tenant-Id 请求头, 都没有时使用默认租户. 租户id只能包含字母、数字、
+    下划线和连字符. 只在全局存储是 TenantStorage 时生效.
+    """
+
+    def __init__(self, app, get_storage: Callable[[], Any], default_tenant: str = "default"):
+        self.app = app
+        self.get_storage = get_storage
+        self.default_tenant = default_tenant
+
+    def tenant_of(self, scope: Dict[str, Any]) -> str:
+        """取出请求的租户id; 使用路径前缀时改写 scope 中的路径"""
+        path = scope["path"]
+        if path.startswith(TENANT_PATH_PREFIX):
+            tenant = path[len(TENANT_PATH_PREFIX):].partition("/")[0]
+            prefix = TENANT_PATH_PREFIX + tenant
+            scope["path"] = strip_tenant_prefix(path)
+            raw_path = scope.get("raw_path")
+            if raw_path is not None and raw_path.startswith(prefix.encode()):
+                scope["raw_path"] = raw_path[len(prefix):] or b"/"
+            scope["root_path"] = scope.get("root_path", "") + prefix
+            return tenant
+        for name, value in scope.get("headers", []):
+            if name == b"x-tenant-id":
+                return value.decode("latin-1")
+        return self.default_tenant
+
+    async def __call__(self, scope, receive, send):
+        tenants = self.get_storage()
+        if scope["type"] != "http" or not isinstance(tenants, TenantStorage):
+            await self.app(scope, receive, send)
+            return
+
+        tenant = self.tenant_of(scope)
+        if not TENANT_ID_PATTERN.fullmatch(tenant):
+            response = JSONResponse({"detail": "无效的租户标识"}, status_code=400)
+            await response(scope, receive, send)
+            return
+
+        tenant_storage = await tenants.acquire(tenant)
+        token = current_tenant_storage.set(tenant_storage)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_tenant_storage.reset(token)
+            await tenants.release(tenant)
+
+
+class MetricsMiddleware:
+    """记录每个请求的状态码和耗时
+
+    路由标签使用路由模板(如 /todos/{todo_id}) 而不是实际路径, 避免标签数量无限增长;
+    没有匹配到路由的请求记为 unmatched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Optional[Dict[Any, str]] = None
+
+    def route_label(self, scope: Dict[str, Any]) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None or "app" not in scope:
+            return "unmatched"
+        if self._route_paths is None:
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path for route in scope["app"].routes
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            method = scope["method"]
+            route = self.route_label(scope)
+            HTTP_REQUESTS.inc(method, route, str(status))
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method, route)
+
+
+class EventLoopLagProbe:
+    """每隔 interval 秒睡眠一次, 记录实际醒来比预期晚了多少
+
+    延迟持续偏高说明有同步代码阻塞了事件循环.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG_SECONDS.observe(lag)
+            LOOP_LAG_LAST.set(lag)
 
 
 # 创建FastAPI应用实例
@@ -181,17 +2950,197 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
-# 添加CORS中间件
+# 准入控制, 由环境变量配置(默认不限制):
+# - TODO_MAX_CONCURRENCY: 并发请求上限
+# - TODO_MAX_QUEUE_WAIT_MS: 达到并发上限时最多排队的毫秒数, 默认100
+# - TODO_RATE_LIMIT / TODO_RATE_BURST: 每个客户端每秒的请求数和突发容量
+admission = AdmissionController(
+    max_concurrency=int(os.environ.get("TODO_MAX_CONCURRENCY", "0")),
+    max_queue_wait=float(os.environ.get("TODO_MAX_QUEUE_WAIT_MS", "100")) / 1000,
+    rate=float(os.environ.get("TODO_RATE_LIMIT", "0")),
+    burst=int(os.environ.get("TODO_RATE_BURST", "20"))
+)
+# 多租户时为每个请求选择租户的存储; 在准入控制之内, 被拒绝的请求不会加载租户
+app.add_middleware(TenantMiddleware, get_storage=lambda: storage)
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
+# 请求指标在准入控制之外, 被拒绝的503请求也会被统计
+app.add_middleware(MetricsMiddleware)
+
+
+@metrics.register_collector
+def collect_admission_metrics() -> List[Any]:
+    """把准入控制已有的计数导出为指标"""
+    in_flight = Gauge("todo_admission_in_flight", "正在处理的请求数")
+    in_flight.set(admission.in_flight)
+    queue_length = Gauge("todo_admission_queue_length", "正在排队的请求数")
+    queue_length.set(sum(1 for waiter in admission._waiters if not waiter.done()))
+    admitted = Counter("todo_admission_admitted_total", "通过准入控制的请求数")
+    admitted.inc(amount=admission.metrics["admitted"])
+    rejected = Counter("todo_admission_rejected_total", "被准入控制拒绝的请求数", ("reason",))
+    rejected.inc("rate_limited", amount=admission.metrics["rejected_rate_limited"])
+    rejected.inc("overloaded", amount=admission.metrics["rejected_overloaded"])
+    queue_wait = Histogram("todo_admission_queue_wait_seconds", "获得并发名额前的排队时间",
+                           AdmissionController.QUEUE_WAIT_BUCKETS)
+    queue_wait.values[()] = [list(admission.metrics["queue_wait_buckets"]),
+                             admission.metrics["queue_wait_seconds_total"]]
+    return [in_flight, queue_length, admitted, rejected, queue_wait]
+
+
+@metrics.register_collector
+def collect_tenant_metrics() -> List[Any]:
+    """多租户时导出常驻租户数、估算的内存占用和加载/淘汰次数"""
+    if not isinstance(storage, TenantStorage):
+        return []
+    resident = Gauge("todo_tenants_resident", "常驻内存的租户数")
+    resident.set(len(storage.resident_tenants()))
+    resident_bytes = Gauge("todo_tenants_resident_bytes", "常驻租户估算的内存占用")
+    resident_bytes.set(storage.resident_bytes)
+    events = Counter("todo_tenant_events_total", "租户存储的命中、加载和淘汰次数", ("event",))
+    for event, count in storage.metrics.items():
+        events.inc(event, amount=count)
+    return [resident, resident_bytes, events]
+
+
+@metrics.register_collector
+def collect_query_cache_metrics() -> List[Any]:
+    """导出查询结果缓存的命中、未命中和淘汰次数(只有内存存储有查询缓存)"""
+    try:
+        stats = storage.query_cache_stats
+        size = len(storage._query_cache)
+    except (AttributeError, RuntimeError):
+        return []
+    events = Counter("todo_query_cache_events_total", "查询结果缓存的命中、未命中和淘汰次数",
+                     ("event",))
+    for event, count in stats.items():
+        events.inc(event, amount=count)
+    entries = Gauge("todo_query_cache_entries", "查询结果缓存中的条目数")
+    entries.set(size)
+    return [events, entries]
+
+
+# 添加CORS中间件(在准入控制之外, 503响应也带有CORS头)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 跨域的浏览器客户端需要读取分页游标和ETag
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-# 初始化数据存储
-storage = TodoStorage()
+
+def create_app_storage():
+    """创建端点使用的存储门面
+
+    TODO_MULTI_TENANT=1 时每个租户一个存储, 按需加载:
+    - TODO_MAX_TENANTS: 最多常驻内存的租户数, 默认1000
+    - TODO_TENANT_MEMORY_MB: 常驻租户估算内存占用的上限, 默认512
+    """
+    if os.environ.get("TODO_MULTI_TENANT") == "1":
+        return TenantStorage(
+            create_storage,
+            max_tenants=int(os.environ.get("TODO_MAX_TENANTS", "1000")),
+            memory_budget=int(os.environ.get("TODO_TENANT_MEMORY_MB", "512")) * 1024 * 1024
+        )
+    return AsyncTodoStorage(create_storage())
+
+
+# 初始化数据存储, 后端由环境变量选择(见 create_storage);
+# 端点通过异步门面访问存储, 持久化在线程池中执行
+storage = create_app_storage()
+
+# 组提交刷新器, 通过环境变量 TODO_GROUP_COMMIT=1 启用
+flusher: Optional[GroupCommitFlusher] = None
+
+# 事件循环延迟探针, TODO_LOOP_LAG_INTERVAL_MS 设置探测间隔(默认500毫秒, 0为关闭)
+loop_lag_probe: Optional[EventLoopLagProbe] = None
+
+
+@app.on_event("startup")
+async def start_loop_lag_probe():
+    """启动事件循环延迟探针"""
+    global loop_lag_probe
+    interval_ms = int(os.environ.get("TODO_LOOP_LAG_INTERVAL_MS", "500"))
+    if interval_ms <= 0:
+        return
+    loop_lag_probe = EventLoopLagProbe(interval_ms / 1000)
+    loop_lag_probe.start()
+
+
+@app.on_event("shutdown")
+async def stop_loop_lag_probe():
+    """停止事件循环延迟探针"""
+    global loop_lag_probe
+    if loop_lag_probe is not None:
+        await loop_lag_probe.stop()
+        loop_lag_probe = None
+
+
+@app.on_event("startup")
+async def start_flusher():
+    """启动组提交后台刷新任务
+
+    - TODO_FLUSH_INTERVAL_MS: 最长刷新间隔, 默认50毫秒
+    - TODO_FLUSH_MAX_PENDING: 积累多少个修改后立即刷新, 默认100
+    - TODO_DURABLE_ACK: 设为1时写请求默认等待落盘完成再返回
+    """
+    global flusher
+    if os.environ.get("TODO_GROUP_COMMIT") != "1":
+        return
+    flusher = GroupCommitFlusher(
+        storage,
+        interval_ms=int(os.environ.get("TODO_FLUSH_INTERVAL_MS", "50")),
+        max_pending=int(os.environ.get("TODO_FLUSH_MAX_PENDING", "100")),
+        durable=os.environ.get("TODO_DURABLE_ACK") == "1"
+    )
+    flusher.start()
+
+
+@app.on_event("shutdown")
+async def stop_flusher():
+    """停止组提交并把剩余修改落盘"""
+    global flusher
+    if flusher is not None:
+        await flusher.stop()
+        flusher = None
+    await storage.flush()
+
+
+async def commit_change(durable: Optional[bool] = None):
+    """写操作完成后调用: 组提交模式下登记修改, 需要时等待落盘"""
+    if flusher is None:
+        return
+    try:
+        await flusher.commit(durable)
+    except Exception:
+        raise HTTPException(status_code=500, detail="数据持久化失败")
+
+
+DURABLE_QUERY = Query(None, description="组提交模式下是否等待修改落盘后再返回")
+
+
+def make_etag(*parts: Any) -> str:
+    """由存储标识和代数/版本号构造弱ETag"""
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def check_not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """设置ETag响应头; If-None-Match 命中时返回304响应, 调用方应直接返回它"""
+    response.headers["ETag"] = etag
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    
+    def opaque(tag: str) -> str:
+        # 弱比较: 忽略 W/ 前缀
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+    
+    if header.strip() == "*" or opaque(etag) in {opaque(tag) for tag in header.split(",")}:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
 
 
 # API端点定义
@@ -211,50 +3160,317 @@ async def root():
     )
 
 
+@app.get("/admission", response_model=Dict[str, Any])
+async def get_admission_metrics():
+    """准入控制的配置、当前并发数和拒绝/排队计数"""
+    return admission.snapshot()
+
+
+@app.get("/metrics", response_class=Response)
+async def get_metrics():
+    """Prometheus文本格式的监控指标"""
+    stats = await storage.get_stats()
+    STORE_TODOS.set(stats["completed"], "completed")
+    STORE_TODOS.set(stats["pending"], "pending")
+    STORE_GENERATION.set(await storage.get_generation())
+    return Response(content=metrics.render(),
+                    media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/todos", response_model=List[Todo])
 async def get_todos(
+    request: Request,
+    response: Response,
     status: Optional[str] = Query(None, regex="^(completed|pending)$", description="按状态过滤"),
     priority: Optional[str] = Query(None, regex="^(low|medium|high)$", description="按优先级过滤"),
-    search: Optional[str] = Query(None, min_length=1, description="搜索关键词")
+    search: Optional[str] = Query(None, min_length=1, description="搜索关键词"),
+    created_after: Optional[datetime] = Query(None, description="只返回在此时间之后创建的"),
+    updated_since: Optional[datetime] = Query(None, description="只返回在此时间及之后更新的"),
+    sort: str = Query("created_at", regex="^(created_at|updated_at|priority)$",
+                      description="排序字段"),
+    order: str = Query("asc", regex="^(asc|desc)$", description="排序方向"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标, 取自上一页的 X-Next-Cursor 响应头")
 ):
-    """获取待办事项列表"""
-    todos = storage.filter_todos(status=status, priority=priority, search=search)
-    return todos
+    """获取待办事项列表
+
+    结果按 sort 和 order 排序(按优先级排序时同一优先级内按创建时间排列).
+    指定 limit 时分页返回, 还有下一页时通过 X-Next-Cursor 响应头返回游标,
+    翻页时需要保持相同的过滤和排序参数.
+    ETag由存储的写入代数决定, 没有任何修改时直接返回304, 不做过滤和序列化.
+    """
+    not_modified = check_not_modified(request, response,
+                                      make_etag(storage.store_id, await storage.get_generation()))
+    if not_modified is not None:
+        return not_modified
+    
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, sort)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="无效的分页游标")
+    
+    # 直接拼接缓存的JSON编码, 跳过逐项的模型校验和序列化
+    encoded = await storage.filter_todos_encoded(status=status, priority=priority,
+                                                 search=search, after=after,
+                                                 limit=limit + 1 if limit else None,
+                                                 sort=sort, descending=order == "desc",
+                                                 created_after=created_after,
+                                                 updated_since=updated_since)
+    if limit and len(encoded) > limit:
+        encoded = encoded[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor_key(encoded[-1][0])
+    return JSONFragmentsResponse([fragment for _, fragment in encoded],
+                                 headers=dict(response.headers))
 
 
 @app.post("/todos", response_model=Todo, status_code=201)
-async def create_todo(todo: TodoCreate):
+async def create_todo(todo: TodoCreate, durable: Optional[bool] = DURABLE_QUERY):
     """创建新的待办事项"""
-    return storage.create_todo(todo)
+    created = await storage.create_todo(todo)
+    await commit_change(durable)
+    return created
+
+
+# 导出/导入时每次从存储读取或写入的条数
+NDJSON_CHUNK_SIZE = 500
+MAX_IMPORT_ERRORS = 100
+# 导入时单行的最大字节数, 远大于字段长度上限允许的一条待办事项
+MAX_IMPORT_LINE_BYTES = 64 * 1024
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """把流式请求体切分为 (行号, 行); 只缓冲未结束的一行, 超过长度上限时返回413"""
+    def check_length(line: bytes, line_number: int):
+        if len(line) > MAX_IMPORT_LINE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"第 {line_number} 行超过 {MAX_IMPORT_LINE_BYTES} 字节"
+            )
+
+    line_number = 0
+    buffer = b""
+    async for chunk in chunks:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            line_number += 1
+            check_length(line, line_number)
+            yield line_number, line
+        check_length(buffer, line_number + 1)
+    yield line_number + 1, buffer
+
+
+# 变更流每页的最大条数, 以及SSE连接上没有新修改时发送心跳的间隔
+CHANGE_FEED_LIMIT = 1000
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+def change_to_model(change: Change) -> TodoChange:
+    seq, todo_id, todo = change
+    return TodoChange(seq=seq, op="put" if todo is not None else "delete", id=todo_id, todo=todo)
+
+
+@app.get("/todos/changes", response_model=ChangeFeed)
+async def get_changes(
+    since: Optional[int] = Query(None, ge=0,
+                                 description="上次同步得到的 next_since; 省略时返回全部待办事项"),
+    store_id: Optional[str] = Query(None, description="上次同步时的 store_id"),
+    limit: int = Query(CHANGE_FEED_LIMIT, ge=1, le=CHANGE_FEED_LIMIT, description="每页数量"),
+    wait: float = Query(0, ge=0, le=60, description="没有新修改时最多等待的秒数(长轮询)")
+):
+    """增量同步: 返回写入代数大于 since 的修改
+
+    删除以墓碑的形式返回, 墓碑超过保留期后被清理. store_id 改变(存储重启)或
+    since 之后的墓碑已被清理时返回410, 客户端需要重新全量同步.
+    """
+    if store_id is not None and store_id != storage.store_id:
+        raise HTTPException(status_code=410, detail="存储已重启, 请重新全量同步")
+    if wait and since is not None:
+        await storage.wait_for_change(since, wait)
+    try:
+        sequence, changes, has_more = await storage.get_changes(since, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=410, detail=f"{e}, 请重新全量同步")
+    return ChangeFeed(
+        store_id=storage.store_id,
+        sequence=sequence,
+        next_since=changes[-1][0] if has_more else sequence,
+        has_more=has_more,
+        changes=[change_to_model(change) for change in changes]
+    )
+
+
+@app.get("/todos/changes/stream")
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0, description="从这个序号之后开始推送")
+):
+    """以服务器发送事件(SSE)推送修改
+
+    每条修改是一个事件, 事件id为写入代数; 断线重连时浏览器会带上 Last-Event-ID,
+    从其后继续推送. 无法增量同步时发送 expired 事件并结束.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(change_events(request, since), media_type="text/event-stream")
+
+
+async def change_events(request: Request, since: Optional[int]):
+    """生成SSE事件, 直到客户端断开"""
+    position = since
+    while not await request.is_disconnected():
+        try:
+            sequence, changes, has_more = await storage.get_changes(position, CHANGE_FEED_LIMIT)
+        except ValueError as e:
+            yield f"event: expired\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
+            return
+        for change in changes:
+            yield f"id: {change[0]}\ndata: {change_to_model(change).json(ensure_ascii=False)}\n\n"
+        position = changes[-1][0] if has_more else sequence
+        if not has_more and not await storage.wait_for_change(position, SSE_KEEPALIVE_SECONDS):
+            yield ": keep-alive\n\n"
+
+
+@app.get("/todos/export")
+async def export_todos():
+    """以NDJSON格式流式导出全部待办事项
+
+    按 (created_at, id) 顺序分块读取存储, 每次只在内存中保留一块数据.
+    """
+    async def generate():
+        after = None
+        while True:
+            encoded = await storage.filter_todos_encoded(after=after, limit=NDJSON_CHUNK_SIZE)
+            if not encoded:
+                break
+            yield b"".join(fragment + b"\n" for _, fragment in encoded)
+            after = encoded[-1][0]
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/todos/import", response_model=Dict[str, Any])
+async def import_todos(request: Request, durable: Optional[bool] = DURABLE_QUERY):
+    """从NDJSON请求体导入待办事项
+
+    边接收边按行解析校验, 每积累一块就写入存储; 无效的行会被跳过并在结果中报告.
+    单行超过 MAX_IMPORT_LINE_BYTES 时返回413, 之前已写入的块会保留.
+    """
+    imported = 0
+    failed = 0
+    errors: List[Dict[str, Any]] = []
+    pending: List[Todo] = []
+    
+    async for line_number, line in iter_ndjson_lines(request.stream()):
+        if not line.strip():
+            continue
+        try:
+            pending.append(Todo.parse_raw(line))
+        except ValueError as e:
+            failed += 1
+            if len(errors) < MAX_IMPORT_ERRORS:
+                errors.append({"line": line_number, "error": str(e)})
+        if len(pending) >= NDJSON_CHUNK_SIZE:
+            imported += await storage.import_todos(pending)
+            pending = []
+    if pending:
+        imported += await storage.import_todos(pending)
+    
+    if imported:
+        await commit_change(durable)
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+
+@app.post("/todos/batch", response_model=BatchResponse, status_code=201)
+async def create_todos_batch(batch: TodoBatchCreate, durable: Optional[bool] = DURABLE_QUERY):
+    """批量创建待办事项, 整批校验通过后一次写入"""
+    todos = await storage.create_todos(batch.items)
+    await commit_change(durable)
+    return BatchResponse.from_results([
+        BatchItemResult(id=todo.id, status=201, data=todo) for todo in todos
+    ])
+
+
+@app.patch("/todos/batch", response_model=BatchResponse)
+async def update_todos_batch(batch: TodoBatchUpdate, durable: Optional[bool] = DURABLE_QUERY):
+    """批量更新待办事项, 不存在的项在结果中标记为404"""
+    updates = [
+        (item.id, TodoUpdate(**item.dict(exclude_unset=True, exclude={"id"})))
+        for item in batch.items
+    ]
+    todos = await storage.update_todos(updates)
+    await commit_change(durable)
+    return BatchResponse.from_results([
+        BatchItemResult(id=todo_id, status=200, data=todo) if todo is not None
+        else BatchItemResult(id=todo_id, status=404, error="待办事项不存在")
+        for (todo_id, _), todo in zip(updates, todos)
+    ])
+
+
+@app.post("/todos/batch/delete", response_model=BatchResponse)
+async def delete_todos_batch(batch: TodoBatchIds, durable: Optional[bool] = DURABLE_QUERY):
+    """批量删除待办事项, 不存在的项在结果中标记为404"""
+    deleted = await storage.delete_todos(batch.ids)
+    await commit_change(durable)
+    return BatchResponse.from_results([
+        BatchItemResult(id=todo_id, status=200) if ok
+        else BatchItemResult(id=todo_id, status=404, error="待办事项不存在")
+        for todo_id, ok in zip(batch.ids, deleted)
+    ])
+
+
+@app.post("/todos/batch/get", response_model=BatchResponse)
+async def get_todos_batch(batch: TodoBatchIds):
+    """按id批量获取待办事项"""
+    todos = await storage.get_todos(batch.ids)
+    return BatchResponse.from_results([
+        BatchItemResult(id=todo_id, status=200, data=todo) if todo is not None
+        else BatchItemResult(id=todo_id, status=404, error="待办事项不存在")
+        for todo_id, todo in zip(batch.ids, todos)
+    ])
 
 
 @app.get("/todos/{todo_id}", response_model=Todo)
-async def get_todo(todo_id: str = Path(..., description="待办事项ID")):
-    """获取特定待办事项"""
-    todo = storage.get_todo(todo_id)
-    if todo is None:
+async def get_todo(request: Request, response: Response,
+                   todo_id: str = Path(..., description="待办事项ID")):
+    """获取特定待办事项, ETag由该待办事项的版本号决定"""
+    version = await storage.get_todo_version(todo_id)
+    if version is not None:
+        not_modified = check_not_modified(request, response,
+                                          make_etag(storage.store_id, version))
+        if not_modified is not None:
+            return not_modified
+    
+    encoded = await storage.get_todo_encoded(todo_id)
+    if encoded is None:
         raise HTTPException(status_code=404, detail="待办事项不存在")
-    return todo
+    return Response(encoded, media_type="application/json", headers=dict(response.headers))
 
 
 @app.put("/todos/{todo_id}", response_model=Todo)
 async def update_todo(
     todo_id: str = Path(..., description="待办事项ID"),
-    todo_update: TodoUpdate = None
+    todo_update: TodoUpdate = None,
+    durable: Optional[bool] = DURABLE_QUERY
 ):
     """更新待办事项"""
-    todo = storage.update_todo(todo_id, todo_update)
+    todo = await storage.update_todo(todo_id, todo_update)
     if todo is None:
         raise HTTPException(status_code=404, detail="待办事项不存在")
+    await commit_change(durable)
     return todo
 
 
 @app.delete("/todos/{todo_id}", response_model=TodoResponse)
-async def delete_todo(todo_id: str = Path(..., description="待办事项ID")):
+async def delete_todo(todo_id: str = Path(..., description="待办事项ID"),
+                      durable: Optional[bool] = DURABLE_QUERY):
     """删除待办事项"""
-    success = storage.delete_todo(todo_id)
+    success = await storage.delete_todo(todo_id)
     if not success:
         raise HTTPException(status_code=404, detail="待办事项不存在")
+    await commit_change(durable)
     
     return TodoResponse(
         success=True,
@@ -264,43 +3480,38 @@ async def delete_todo(todo_id: str = Path(..., description="待办事项ID")):
 
 
 @app.get("/todos/{todo_id}/toggle", response_model=Todo)
-async def toggle_todo(todo_id: str = Path(..., description="待办事项ID")):
+async def toggle_todo(todo_id: str = Path(..., description="待办事项ID"),
+                      durable: Optional[bool] = DURABLE_QUERY):
     """切换待办事项完成状态"""
-    todo = storage.get_todo(todo_id)
-    if todo is None:
+    updated_todo = await storage.toggle_todo(todo_id)
+    if updated_todo is None:
         raise HTTPException(status_code=404, detail="待办事项不存在")
-    
-    update_data = TodoUpdate(completed=not todo.completed)
-    updated_todo = storage.update_todo(todo_id, update_data)
+    await commit_change(durable)
     return updated_todo
 
 
 @app.get("/stats", response_model=Dict[str, Any])
-async def get_stats():
+async def get_stats(
+    request: Request,
+    response: Response,
+    verify: bool = Query(False, description="调试用: 重新统计并与计数器比较")
+):
     """获取统计信息"""
-    todos = storage.get_all_todos()
-    total = len(todos)
-    completed = sum(1 for todo in todos if todo.completed)
-    pending = total - completed
-    
-    priority_stats = {
-        "high": sum(1 for todo in todos if todo.priority == "high"),
-        "medium": sum(1 for todo in todos if todo.priority == "medium"),
-        "low": sum(1 for todo in todos if todo.priority == "low")
-    }
-    
-    return {
-        "total": total,
-        "completed": completed,
-        "pending": pending,
-        "completion_rate": (completed / total * 100) if total > 0 else 0,
-        "by_priority": priority_stats
-    }
+    if verify:
+        mismatches = await storage.verify_stats()
+        if mismatches:
+            raise HTTPException(status_code=500, detail={"统计计数不一致": mismatches})
+    else:
+        not_modified = check_not_modified(request, response,
+                                          make_etag(storage.store_id, await storage.get_generation()))
+        if not_modified is not None:
+            return not_modified
+    return await storage.get_stats()
 
 
 # 启动函数
-def main():
-    """启动API服务器"""
+def run_dev_server():
+    """开发模式: 单进程, 代码修改后自动重新加载"""
     import uvicorn
     
     print("启动待办事项API服务器...")
@@ -308,7 +3519,7 @@ def main():
     print("API服务: http://localhost:8000")
     
     uvicorn.run(
-        app,
+        "main:app",
         host="0.0.0.0",
         port=8000,
         reload=True,
@@ -316,5 +3527,231 @@ def main():
     )
 
 
+def module_available(name: str) -> bool:
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+
+def default_workers() -> int:
+    """默认的工作进程数: TODO_WORKERS; 未设置时共享后端为CPU核数, 内存后端只能为1"""
+    if "TODO_WORKERS" in os.environ:
+        return int(os.environ["TODO_WORKERS"])
+    if os.environ.get("TODO_STORAGE_BACKEND", "memory") in ("shared", "sqlite"):
+        return os.cpu_count() or 1
+    return 1
+
+
+def serve_config(args) -> Dict[str, Any]:
+    """由命令行参数构造 uvicorn.Config 的参数; 事件循环和HTTP解析器在可用时选择 uvloop/httptools"""
+    loop = args.loop
+    if loop == "auto":
+        loop = "uvloop" if module_available("uvloop") else "asyncio"
+    http = args.http
+    if http == "auto":
+        http = "httptools" if module_available("httptools") else "h11"
+    return {
+        "host": args.host,
+        "port": args.port,
+        "loop": loop,
+        "http": http,
+        "timeout_keep_alive": args.keep_alive,
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "backlog": args.backlog,
+        "access_log": args.access_log,
+        "log_level": args.log_level,
+    }
+
+
+def run_worker(config_kwargs: Dict[str, Any], sock=None):
+    """运行一个工作进程, 服务器退出(已排空请求并落盘)后关闭存储"""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, **config_kwargs))
+
+    def request_exit(signum, frame):
+        server.should_exit = True
+
+    # uvicorn 优雅退出后会恢复原来的信号处理函数并重新发出收到的信号;
+    # 这里的处理函数让进程继续执行到关闭存储, 然后正常退出
+    signal.signal(signal.SIGTERM, request_exit)
+    signal.signal(signal.SIGINT, request_exit)
+    try:
+        server.run(sockets=[sock] if sock is not None else None)
+    finally:
+        storage.close()
+
+
+class PreforkSupervisor:
+    """预派生模式的主进程: fork 出工作进程, 转发停止信号, 重新启动意外退出的工作进程
+
+    工作进程启动后不到 MIN_UPTIME 秒就退出(例如数据库路径错误)视为启动失败,
+    重新启动前按指数退避等待; 连续 MAX_START_FAILURES 次启动失败后停止所有工作进程并放弃.
+    """
+
+    MIN_UPTIME = 1.0
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 30.0
+    MAX_START_FAILURES = 5
+
+    def __init__(self, count: int, run_child: Callable[[], int]):
+        self.count = count
+        self.run_child = run_child
+        # pid -> 启动时间
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+        self.start_failures = 0
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # 工作进程不能回到主进程的代码中, 无论 run_child 如何结束都直接退出
+            code = 1
+            try:
+                code = self.run_child()
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+
+    def stop(self, signum=None, frame=None):
+        """把 SIGTERM 转发给所有工作进程, 之后不再重新启动"""
+        self.stopping = True
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def restart_delay(self, started: float) -> Optional[float]:
+        """意外退出的工作进程重新启动前的等待秒数; 连续启动失败太多次时返回None"""
+        if time.monotonic() - started >= self.MIN_UPTIME:
+            self.start_failures = 0
+            return 0.0
+        self.start_failures += 1
+        if self.start_failures >= self.MAX_START_FAILURES:
+            return None
+        return min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** (self.start_failures - 1))
+
+    def _sleep(self, seconds: float):
+        """等待 seconds 秒, 期间收到停止信号时提前返回"""
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(min(0.1, max(0.0, deadline - time.monotonic())))
+
+    def run(self) -> int:
+        """启动全部工作进程并等待它们退出, 返回主进程的退出码"""
+        for _ in range(self.count):
+            self.spawn()
+        code = 0
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.workers.pop(pid, None)
+            if self.stopping or started is None:
+                continue
+            delay = self.restart_delay(started)
+            if delay is None:
+                print(f"工作进程连续 {self.start_failures} 次启动后立即退出, 停止服务")
+                code = 1
+                self.stop()
+                continue
+            print(f"工作进程 {pid} 意外退出(状态 {status}), {delay:.1f} 秒后重新启动")
+            self._sleep(delay)
+            if not self.stopping:
+                self.spawn()
+        return code
+
+
+def serve(args):
+    """生产模式: 预先加载应用, 然后 fork 出多个共享监听套接字的工作进程
+
+    每个工作进程收到 SIGTERM/SIGINT 后停止接受新连接, 等待进行中的请求完成
+    (最多 --graceful-timeout 秒), 执行关闭钩子把存储落盘, 再关闭存储. 主进程把信号
+    转发给所有工作进程并等待它们退出; 工作进程意外退出时由 PreforkSupervisor 重新启动.
+    """
+    import socket
+
+    config_kwargs = serve_config(args)
+    backend = os.environ.get("TODO_STORAGE_BACKEND", "memory")
+    print(f"启动待办事项API服务器(生产模式): http://{args.host}:{args.port} "
+          f"工作进程: {args.workers}, 事件循环: {config_kwargs['loop']}, "
+          f"HTTP解析: {config_kwargs['http']}, 存储后端: {backend}")
+
+    if args.workers <= 1:
+        run_worker(config_kwargs)
+        return
+    if backend == "memory":
+        # 每个进程各自持有一份内存数据, 会互相覆盖数据文件
+        raise SystemExit("多个工作进程需要使用 TODO_STORAGE_BACKEND=shared 或 sqlite")
+    if not hasattr(os, "fork"):
+        import uvicorn
+        print("当前平台不支持 fork, 改为由 uvicorn 启动工作进程(不预加载应用)")
+        uvicorn.run("main:app", workers=args.workers, **config_kwargs)
+        return
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+    # 应用代码已在主进程中加载; 数据库连接和线程池不能跨 fork 使用, 由各工作进程重新创建
+    storage.close()
+
+    def run_child() -> int:
+        global storage
+        # 工作进程使用单独的进程组: 终端的 Ctrl-C 只发给主进程, 由主进程转发一次 SIGTERM;
+        # uvicorn 收到第二个信号时会跳过排空直接退出
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            storage = create_app_storage()
+            run_worker(config_kwargs, sock)
+        except BaseException as e:
+            print(f"工作进程 {os.getpid()} 异常退出: {e}")
+            return 1
+        return 0
+
+    supervisor = PreforkSupervisor(args.workers, run_child)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    code = supervisor.run()
+    sock.close()
+    print("所有工作进程已退出")
+    if code:
+        raise SystemExit(code)
+
+
+def main(argv: Optional[List[str]] = None):
+    """启动API服务器: 默认为开发模式, serve 子命令为生产模式"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="待办事项API服务器")
+    subcommands = parser.add_subparsers(dest="command")
+    subcommands.add_parser("dev", help="开发模式(默认): 单进程, 自动重新加载")
+    serve_parser = subcommands.add_parser("serve", help="生产模式: 多个工作进程")
+    serve_parser.add_argument("--host", default=os.environ.get("TODO_HOST", "0.0.0.0"))
+    serve_parser.add_argument("--port", type=int, default=int(os.environ.get("TODO_PORT", "8000")))
+    serve_parser.add_argument("--workers", type=int, default=default_workers(),
+                              help="工作进程数, 默认共享后端为CPU核数, 内存后端为1")
+    serve_parser.add_argument("--loop", choices=["auto", "uvloop", "asyncio"], default="auto",
+                              help="事件循环, auto 在安装了 uvloop 时使用它")
+    serve_parser.add_argument("--http", choices=["auto", "httptools", "h11"], default="auto",
+                              help="HTTP解析器, auto 在安装了 httptools 时使用它")
+    serve_parser.add_argument("--keep-alive", type=int, default=15,
+                              help="空闲的keep-alive连接保持的秒数")
+    serve_parser.add_argument("--graceful-timeout", type=int, default=30,
+                              help="关闭时等待进行中请求完成的最长秒数")
+    serve_parser.add_argument("--backlog", type=int, default=2048, help="监听队列长度")
+    serve_parser.add_argument("--access-log", action="store_true", help="输出访问日志")
+    serve_parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args)
+    else:
+        run_dev_server()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -15,7 +15,8 @@ import tempfile
 from pathlib import Path
 
 # 导入主应用
-from main import app, TodoStorage, TodoCreate
+import main
+from main import app, TodoStorage, TodoCreate, AsyncTodoStorage
 
 # 创建测试客户端
 client = TestClient(app)
@@ -31,12 +32,13 @@ class TestTodoAPI:
         self.test_data_file = Path(self.temp_dir) / "test_todos.json"
         
         # 临时替换存储
-        global storage
-        storage = TodoStorage(str(self.test_data_file))
+        self.original_storage = main.storage
+        main.storage = AsyncTodoStorage(TodoStorage(str(self.test_data_file)))
     
     def teardown_method(self):
         """每个测试方法后的清理"""
         import shutil
+        main.storage = self.original_storage
         shutil.rmtree(self.temp_dir, ignore_errors=True)
     
     def test_root_endpoint(self):
@@ -134,6 +136,21 @@ class TestTodoAPI:
         assert updated_todo["title"] == "更新后的标题"
         assert updated_todo["completed"] is True
         assert updated_todo["priority"] == "medium"  # 未更新的字段保持原值
+
+    def test_update_todo_rejects_null_fields(self):
+        """测试显式的null会被拒绝, 且不会破坏索引"""
+        todo = client.post("/todos", json={"title": "任务", "description": "描述"}).json()
+        for field in ("title", "priority", "completed"):
+            response = client.put(f"/todos/{todo['id']}", json={field: None})
+            assert response.status_code == 422
+
+        assert [item["id"] for item in client.get("/todos").json()] == [todo["id"]]
+        assert client.get("/stats?verify=true").status_code == 200
+
+        # description 可以为空, 设为null表示清空
+        response = client.put(f"/todos/{todo['id']}", json={"description": None})
+        assert response.status_code == 200
+        assert response.json()["description"] is None
     
     def test_update_todo_not_found(self):
         """测试更新不存在的待办事项"""
@@ -249,6 +266,275 @@ class TestTodoAPI:
         assert stats["by_priority"]["high"] == 1
         assert stats["by_priority"]["medium"] == 1
         assert stats["by_priority"]["low"] == 1
+    
+    def test_get_stats_verify(self):
+        """测试统计计数的调试校验"""
+        todo = client.post("/todos", json={"title": "任务", "priority": "low"}).json()
+        client.put(f"/todos/{todo['id']}", json={"completed": True, "priority": "high"})
+        
+        response = client.get("/stats?verify=true")
+        assert response.status_code == 200
+        assert response.json()["by_priority"] == {"high": 1, "medium": 0, "low": 0}
+        
+        # 人为破坏计数后校验失败
+        main.storage._completed_index[True].clear()
+        response = client.get("/stats?verify=true")
+        assert response.status_code == 500
+    
+    def test_cursor_pagination(self):
+        """测试游标分页遍历全部结果"""
+        created_ids = [
+            client.post("/todos", json={"title": f"任务{i}", "priority": "high" if i % 2 else "low"}).json()["id"]
+            for i in range(7)
+        ]
+        
+        for query, expected in [("", created_ids), ("&priority=high", created_ids[1::2])]:
+            seen = []
+            response = client.get(f"/todos?limit=3{query}")
+            while True:
+                assert response.status_code == 200
+                page = response.json()
+                assert len(page) <= 3
+                seen.extend(todo["id"] for todo in page)
+                next_cursor = response.headers.get("X-Next-Cursor")
+                if next_cursor is None:
+                    break
+                response = client.get(f"/todos?limit=3&cursor={next_cursor}{query}")
+            assert seen == expected
+        
+        # 跨域请求可以读取游标响应头
+        response = client.get("/todos?limit=3", headers={"Origin": "https://example.com"})
+        exposed = response.headers["Access-Control-Expose-Headers"].lower()
+        assert "x-next-cursor" in exposed and "etag" in exposed
+    
+    def test_batch_endpoints(self):
+        """测试批量创建、更新、获取和删除"""
+        response = client.post("/todos/batch", json={"items": [
+            {"title": "批量1", "priority": "high"},
+            {"title": "批量2"},
+            {"title": "批量3", "completed": True},
+        ]})
+        assert response.status_code == 201
+        body = response.json()
+        assert body["succeeded"] == 3 and body["failed"] == 0
+        ids = [result["id"] for result in body["results"]]
+        
+        response = client.patch("/todos/batch", json={"items": [
+            {"id": ids[0], "completed": True},
+            {"id": "non-existent-id", "title": "不存在"},
+        ]})
+        body = response.json()
+        assert [result["status"] for result in body["results"]] == [200, 404]
+        assert body["results"][0]["data"]["completed"] is True
+        assert body["results"][0]["data"]["priority"] == "high"
+        
+        response = client.post("/todos/batch/delete", json={"ids": [ids[1], "non-existent-id"]})
+        assert [result["status"] for result in response.json()["results"]] == [200, 404]
+        
+        response = client.post("/todos/batch/get", json={"ids": ids})
+        results = response.json()["results"]
+        assert [result["status"] for result in results] == [200, 404, 200]
+        assert results[2]["data"]["title"] == "批量3"
+    
+    def test_batch_create_validates_whole_batch(self):
+        """测试批量创建中任意一项无效时整批拒绝"""
+        response = client.post("/todos/batch", json={"items": [
+            {"title": "有效"}, {"title": "无效", "priority": "invalid"}
+        ]})
+        assert response.status_code == 422
+        assert client.get("/todos").json() == []
+    
+    def test_export_import_roundtrip(self):
+        """测试NDJSON导出后导入到新的存储"""
+        for i in range(5):
+            client.post("/todos", json={"title": f"导出{i}", "priority": "high" if i % 2 else "low"})
+        original = client.get("/todos").json()
+        
+        response = client.get("/todos/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = response.text.splitlines()
+        assert [json.loads(line)["id"] for line in lines] == [todo["id"] for todo in original]
+        
+        main.storage = AsyncTodoStorage(TodoStorage(str(Path(self.temp_dir) / "imported.json")))
+        body = response.text + "not json\n" + json.dumps({"title": "缺少id"}) + "\n"
+        response = client.post("/todos/import", content=body.encode("utf-8"))
+        result = response.json()
+        assert result["imported"] == 5
+        assert result["failed"] == 2
+        assert [error["line"] for error in result["errors"]] == [6, 7]
+        assert client.get("/todos").json() == original
+        assert client.get("/stats").json()["by_priority"]["high"] == 2
+        
+        # 没有换行的超长行不会无限缓冲
+        def oversized():
+            for _ in range(100):
+                yield b"x" * 1024
+        
+        response = client.post("/todos/import", content=oversized())
+        assert response.status_code == 413
+    
+    def test_conditional_get(self):
+        """测试ETag和If-None-Match"""
+        todo = client.post("/todos", json={"title": "缓存"}).json()
+        other = client.post("/todos", json={"title": "其他"}).json()
+        
+        for url in ["/todos", "/stats", f"/todos/{todo['id']}"]:
+            response = client.get(url)
+            etag = response.headers["ETag"]
+            response = client.get(url, headers={"If-None-Match": etag})
+            assert response.status_code == 304, url
+            assert response.content == b""
+        
+        todo_etag = client.get(f"/todos/{todo['id']}").headers["ETag"]
+        list_etag = client.get("/todos").headers["ETag"]
+        
+        # 修改其他待办事项只影响列表的ETag
+        client.put(f"/todos/{other['id']}", json={"completed": True})
+        assert client.get(f"/todos/{todo['id']}", headers={"If-None-Match": todo_etag}).status_code == 304
+        response = client.get("/todos", headers={"If-None-Match": list_etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != list_etag
+        
+        client.put(f"/todos/{todo['id']}", json={"title": "已修改"})
+        response = client.get(f"/todos/{todo['id']}", headers={"If-None-Match": todo_etag})
+        assert response.status_code == 200
+        assert response.json()["title"] == "已修改"
+    
+    def test_sort_and_time_filter_params(self):
+        """测试 sort/order 和时间范围查询参数"""
+        first = client.post("/todos", json={"title": "先创建", "priority": "low"}).json()
+        second = client.post("/todos", json={"title": "后创建", "priority": "high"}).json()
+        client.put(f"/todos/{first['id']}", json={"description": "最近更新"})
+        
+        def titles(query):
+            response = client.get(f"/todos?{query}")
+            assert response.status_code == 200, response.text
+            return [todo["title"] for todo in response.json()]
+        
+        assert titles("sort=created_at&order=desc") == ["后创建", "先创建"]
+        assert titles("sort=updated_at&order=desc") == ["先创建", "后创建"]
+        assert titles("sort=priority&order=desc") == ["后创建", "先创建"]
+        assert titles(f"created_after={first['created_at']}") == ["后创建"]
+        updated_at = client.get(f"/todos/{first['id']}").json()["updated_at"]
+        assert titles(f"updated_since={updated_at}") == ["先创建"]
+        
+        response = client.get("/todos?sort=priority&order=desc&limit=1")
+        assert [todo["id"] for todo in response.json()] == [second["id"]]
+        next_page = client.get("/todos?sort=priority&order=desc&limit=1&cursor="
+                               + response.headers["X-Next-Cursor"])
+        assert [todo["title"] for todo in next_page.json()] == ["先创建"]
+        assert client.get("/todos?sort=title").status_code == 422
+    
+    def test_change_feed_endpoint(self):
+        """测试变更流的增量同步、长轮询和410"""
+        todo = client.post("/todos", json={"title": "同步"}).json()
+        feed = client.get("/todos/changes").json()
+        assert [change["todo"] for change in feed["changes"]] == [todo]
+        assert feed["has_more"] is False
+        since = feed["next_since"]
+        
+        client.put(f"/todos/{todo['id']}", json={"completed": True})
+        client.delete(f"/todos/{todo['id']}")
+        feed = client.get(f"/todos/changes?since={since}&store_id={feed['store_id']}").json()
+        assert [(change["op"], change["id"]) for change in feed["changes"]] == [("delete", todo["id"])]
+        
+        # 没有新修改时等待到超时, 返回空页
+        response = client.get(f"/todos/changes?since={feed['next_since']}&wait=0.1")
+        assert response.json()["changes"] == []
+        
+        assert client.get("/todos/changes?since=0&store_id=other").status_code == 410
+        assert client.get(f"/todos/changes?since={feed['next_since'] + 1}").status_code == 410
+    
+    def test_change_feed_long_poll_wakes_on_write(self, monkeypatch):
+        """测试长轮询在有新修改时立即返回, 以及SSE事件格式"""
+        import asyncio
+        import time
+        monkeypatch.setattr(main, "SSE_KEEPALIVE_SECONDS", 0.05)
+        
+        class StubRequest:
+            """第二次检查时断开连接"""
+            def __init__(self):
+                self.checks = 0
+            
+            async def is_disconnected(self):
+                self.checks += 1
+                return self.checks > 1
+        
+        async def scenario():
+            since = await main.storage.get_generation()
+            waiter = asyncio.ensure_future(main.storage.wait_for_change(since, 5))
+            await asyncio.sleep(0.01)
+            start = time.perf_counter()
+            todo = await main.storage.create_todo(TodoCreate(title="推送"))
+            assert await waiter is True
+            assert time.perf_counter() - start < 1
+            
+            events = [event async for event in main.change_events(StubRequest(), since)]
+            return since, todo, events
+        
+        since, todo, events = asyncio.run(scenario())
+        assert events[0].startswith(f"id: {since + 1}\n")
+        assert json.loads(events[0].split("data: ", 1)[1])["todo"]["id"] == todo.id
+        assert events[-1] == ": keep-alive\n\n"
+    
+    def test_invalid_cursor(self):
+        """测试无效游标"""
+        response = client.get("/todos?limit=3&cursor=not-a-cursor")
+        assert response.status_code == 400
+    
+    def test_preserialized_responses(self):
+        """测试预序列化的JSON与模型序列化结果一致, 并在修改后失效"""
+        todo = client.post("/todos", json={"title": "预编码", "description": "中文"}).json()
+        response = client.get(f"/todos/{todo['id']}")
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == todo
+        assert "中文".encode("utf-8") in response.content
+        assert client.get("/todos").json() == [todo]
+        
+        updated = client.put(f"/todos/{todo['id']}", json={"title": "已修改"}).json()
+        assert client.get(f"/todos/{todo['id']}").json() == updated
+        assert client.get("/todos").json() == [updated]
+
+
+def check_change_feed(storage):
+    """检查存储的变更记录: 按代数排序、每个id只出现最后一次修改、删除留下墓碑"""
+    from main import TodoUpdate
+    kept = storage.create_todo(TodoCreate(title="保留"))
+    removed = storage.create_todo(TodoCreate(title="删除"))
+    since = storage.generation
+    
+    storage.update_todo(kept.id, TodoUpdate(title="修改一次"))
+    storage.update_todo(kept.id, TodoUpdate(title="修改两次"))
+    storage.delete_todo(removed.id)
+    added = storage.create_todo(TodoCreate(title="新增"))
+    
+    generation, changes, has_more = storage.get_changes(since, 100)
+    assert generation == storage.generation
+    assert not has_more
+    assert [(todo_id, todo.title if todo else None) for _, todo_id, todo in changes] == [
+        (kept.id, "修改两次"), (removed.id, None), (added.id, "新增")]
+    assert [seq for seq, _, _ in changes] == sorted(seq for seq, _, _ in changes)
+    
+    # 分页: 从上一页最后一条的代数继续
+    _, first_page, has_more = storage.get_changes(since, 2)
+    assert has_more and len(first_page) == 2
+    _, second_page, has_more = storage.get_changes(first_page[-1][0], 2)
+    assert not has_more
+    assert first_page + second_page == changes
+    
+    assert storage.get_changes(generation, 100)[1] == []
+    _, everything, _ = storage.get_changes(None, 100)
+    assert {todo_id for _, todo_id, _ in everything} == {kept.id, added.id}
+    with pytest.raises(ValueError):
+        storage.get_changes(generation + 1, 100)
+    
+    # 墓碑超过保留期后被清理, 更早的序号无法再增量同步
+    storage.tombstone_retention = 0
+    storage.delete_todo(added.id)
+    with pytest.raises(ValueError):
+        storage.get_changes(since, 100)
+    assert storage.get_changes(storage.generation, 100)[1] == []
 
 
 class TestTodoStorage:
@@ -314,6 +600,1271 @@ class TestTodoStorage:
         # 验证已删除
         retrieved = self.storage.get_todo(todo.id)
         assert retrieved is None
+    
+    def test_batch_operations_persist_once(self):
+        """测试批量操作只写一次快照"""
+        from main import TodoUpdate
+        writes = []
+        original_write = self.storage._write_snapshot
+        self.storage._write_snapshot = lambda data: (writes.append(len(data)), original_write(data))
+        
+        todos = self.storage.create_todos([TodoCreate(title=f"任务{i}") for i in range(5)])
+        assert writes == [5]
+        self.storage.update_todos([(todo.id, TodoUpdate(completed=True)) for todo in todos[:2]])
+        self.storage.delete_todos([todos[4].id, "non-existent-id"])
+        assert writes == [5, 5, 4]
+        
+        reloaded = TodoStorage(str(self.data_file))
+        assert sum(todo.completed for todo in reloaded.get_all_todos()) == 2
+        assert reloaded.get_todos([todos[0].id, todos[4].id])[1] is None
+    
+    def test_compact_records(self):
+        """测试内存中保存紧凑记录, 在边界处还原为完整模型"""
+        from main import TodoRecord
+        todo = self.storage.create_todo(TodoCreate(title="紧凑", priority="high"))
+        record = self.storage.todos[todo.id]
+        assert isinstance(record, TodoRecord)
+        assert not hasattr(record, "__dict__")
+        assert isinstance(record.priority, int)
+        assert isinstance(record.created_at, int)
+        
+        restored = self.storage.get_todo(todo.id)
+        assert restored == todo
+        assert record.to_dict() == json.loads(todo.json())
+    
+    def test_encoded_json_cache(self):
+        """测试每条记录缓存JSON编码, 版本变化时失效"""
+        from main import TodoUpdate
+        todo = self.storage.create_todo(TodoCreate(title="编码"))
+        encoded = self.storage.get_todo_encoded(todo.id)
+        assert json.loads(encoded) == json.loads(todo.json())
+        assert self.storage.get_todo_encoded(todo.id) is encoded
+        
+        self.storage.update_todo(todo.id, TodoUpdate(title="新标题"))
+        assert json.loads(self.storage.get_todo_encoded(todo.id))["title"] == "新标题"
+        [(key, fragment)] = self.storage.filter_todos_encoded()
+        assert key == (todo.created_at, todo.id)
+        assert fragment is self.storage.get_todo_encoded(todo.id)
+    
+    def test_secondary_indexes_follow_writes(self):
+        """测试二级索引随增删改同步更新"""
+        from main import TodoUpdate
+        todo = self.storage.create_todo(TodoCreate(title="索引", priority="low"))
+        other = self.storage.create_todo(TodoCreate(title="其他", priority="low"))
+        assert self.storage._priority_index["low"] == {todo.id, other.id}
+        assert todo.id in self.storage._completed_index[False]
+        
+        self.storage.update_todo(todo.id, TodoUpdate(priority="high", completed=True))
+        assert self.storage._priority_index["low"] == {other.id}
+        assert self.storage._priority_index["high"] == {todo.id}
+        assert self.storage._completed_index[True] == {todo.id}
+        assert self.storage._completed_index[False] == {other.id}
+        
+        self.storage.delete_todo(todo.id)
+        assert self.storage._priority_index["high"] == set()
+        assert self.storage._completed_index[True] == set()
+    
+    def test_filter_todos_combinations(self):
+        """测试索引过滤的结果与逐条检查一致"""
+        import itertools
+        from main import TodoUpdate
+        for i, (priority, completed) in enumerate(
+                itertools.product(["low", "medium", "high"], [False, True])):
+            self.storage.create_todo(TodoCreate(title=f"任务{i}", priority=priority,
+                                                completed=completed))
+        first = self.storage.get_all_todos()[0]
+        self.storage.update_todo(first.id, TodoUpdate(priority="high", completed=True))
+        
+        reloaded = TodoStorage(str(self.data_file))
+        for storage in (self.storage, reloaded):
+            for status, priority in itertools.product(
+                    [None, "completed", "pending"], [None, "low", "medium", "high"]):
+                expected = [
+                    todo.id for todo in storage.get_all_todos()
+                    if (status is None or todo.completed == (status == "completed"))
+                    and (priority is None or todo.priority == priority)
+                ]
+                actual = [todo.id for todo in storage.filter_todos(status=status,
+                                                                   priority=priority)]
+                assert actual == expected, (status, priority)
+    
+    def test_paginated_filters(self):
+        """测试分页结果与一次性查询结果一致"""
+        import itertools
+        for i in range(40):
+            self.storage.create_todo(TodoCreate(
+                title=f"任务{i}" + (" python" if i % 3 == 0 else ""),
+                priority=["low", "medium", "high"][i % 3 if i < 30 else 0],
+                completed=i % 4 == 0))
+        
+        for status, priority, search in itertools.product(
+                [None, "pending"], [None, "high", "low"], [None, "python", "任务1"]):
+            filters = {"status": status, "priority": priority, "search": search}
+            expected = [todo.id for todo in self.storage.filter_todos(**filters)]
+            paged, after = [], None
+            while True:
+                page = self.storage.filter_todos(after=after, limit=4, **filters)
+                paged.extend(todo.id for todo in page)
+                if len(page) < 4:
+                    break
+                after = (page[-1].created_at, page[-1].id)
+            assert paged == expected, filters
+    
+    def test_change_feed(self):
+        """测试内存存储的变更记录"""
+        check_change_feed(self.storage)
+
+    def test_change_feed_pages_after_restart(self):
+        """测试重启后的全量同步仍按 limit 分页"""
+        self.storage.create_todos([TodoCreate(title=f"任务{i}") for i in range(5)])
+        reloaded = TodoStorage(str(self.data_file))
+        synced, since, has_more = [], None, True
+        while has_more:
+            _, page, has_more = reloaded.get_changes(since, 2)
+            assert len(page) <= 2
+            synced.extend(todo_id for _, todo_id, _ in page)
+            since = page[-1][0]
+        assert synced == list(self.storage.todos)
+    
+    def test_sort_and_time_filters(self):
+        """测试排序和时间范围过滤(内存存储与SQLite存储)与逐条排序的结果一致"""
+        import itertools
+        from datetime import timedelta
+        from main import (Todo, SQLiteTodoStorage, PRIORITY_CODES, encode_cursor,
+                          decode_cursor)
+        base = datetime(2024, 1, 1, 9, 0)
+        todos = [Todo(id=f"todo-{i:02d}", title=f"任务{i}" + (" python" if i % 4 == 0 else ""),
+                      priority=["low", "medium", "high"][i % 3], completed=i % 5 == 0,
+                      created_at=base + timedelta(minutes=i // 2),
+                      updated_at=base + timedelta(minutes=(i * 7) % 40))
+                 for i in range(40)]
+        sqlite_storage = SQLiteTodoStorage(str(Path(self.temp_dir) / "sorted.db"))
+        keys = {
+            "created_at": lambda todo: (todo.created_at, todo.id),
+            "updated_at": lambda todo: (todo.updated_at, todo.id),
+            "priority": lambda todo: (PRIORITY_CODES[todo.priority], todo.created_at, todo.id),
+        }
+        
+        for storage in (self.storage, sqlite_storage):
+            storage.import_todos(todos)
+            for sort, descending, status, search, created_after, updated_since in itertools.product(
+                    keys, [False, True], [None, "pending"], [None, "python"],
+                    [None, base + timedelta(minutes=15)], [None, base + timedelta(minutes=30)]):
+                filters = {"sort": sort, "descending": descending, "status": status,
+                           "search": search, "created_after": created_after,
+                           "updated_since": updated_since}
+                expected = sorted(
+                    (todo for todo in todos
+                     if (status is None or not todo.completed)
+                     and (search is None or search in todo.title)
+                     and (created_after is None or todo.created_at > created_after)
+                     and (updated_since is None or todo.updated_at >= updated_since)),
+                    key=keys[sort], reverse=descending)
+                expected = [todo.id for todo in expected]
+                assert [todo.id for todo in storage.filter_todos(**filters)] == expected, filters
+                
+                paged, after = [], None
+                while True:
+                    page = storage.filter_todos(after=after, limit=3, **filters)
+                    paged.extend(todo.id for todo in page)
+                    if len(page) < 3:
+                        break
+                    after = decode_cursor(encode_cursor(page[-1], sort), sort)
+                assert paged == expected, filters
+        sqlite_storage.close()
+        
+        # 修改后有序索引随之更新
+        from main import TodoUpdate
+        self.storage.update_todo("todo-00", TodoUpdate(priority="high"))
+        assert self.storage.filter_todos(sort="updated_at", descending=True, limit=1)[0].id == "todo-00"
+        assert self.storage.filter_todos(sort="priority", descending=True)[-1].id != "todo-00"
+        assert all(len(order) == 40 for order in self.storage._orders.values())
+    
+    def test_trigram_search(self):
+        """测试三元组索引搜索保持大小写不敏感的子串语义"""
+        from main import TodoUpdate
+        python = self.storage.create_todo(TodoCreate(title="学习Python编程"))
+        desc = self.storage.create_todo(TodoCreate(title="周末", description="PyThOn练习"))
+        self.storage.create_todo(TodoCreate(title="py", description="thon"))
+        
+        def search(keyword):
+            return [todo.id for todo in self.storage.filter_todos(search=keyword)]
+        
+        assert search("python") == [python.id, desc.id]
+        assert len(search("Py")) == 3  # 少于3个字符时退回逐条匹配
+        assert search("不存在的词") == []
+        
+        # 修改后旧标题的三元组不再命中
+        self.storage.update_todo(python.id, TodoUpdate(title="学习Go"))
+        assert search("python") == [desc.id]
+        assert search("学习g") == [python.id]
+        self.storage.delete_todo(desc.id)
+        assert search("python") == []
+        assert "pyt" not in self.storage._trigram_index
+    
+    def test_binary_snapshot(self):
+        """测试二进制快照: 从JSON快照迁移, 重新加载后内容不变"""
+        from main import TodoUpdate, decode_snapshot
+        first = self.storage.create_todo(TodoCreate(title="二进制", description="描述",
+                                                    priority="high"))
+        second = self.storage.create_todo(TodoCreate(title="无描述"))
+        
+        binary = TodoStorage(str(self.data_file), snapshot_format="binary")
+        assert list(binary.todos) == [first.id, second.id]
+        assert not binary.binary_file.exists()
+        binary.update_todo(second.id, TodoUpdate(completed=True))
+        
+        with open(binary.binary_file, "rb") as f:
+            assert f.read(8) == b"TODOSNP1"
+        reloaded = TodoStorage(str(self.data_file), snapshot_format="binary")
+        assert reloaded.load_seconds > 0
+        assert reloaded.get_todo(first.id) == first
+        assert reloaded.get_todo(second.id).completed is True
+        assert reloaded.get_todo(second.id).description is None
+        assert reloaded.get_stats() == binary.get_stats()
+        assert reloaded.filter_todos(search="二进制") == [first]
+        
+        # 切换回JSON格式时读取较新的二进制快照, 不会丢失切换后的修改
+        json_again = TodoStorage(str(self.data_file))
+        assert json_again.get_todo(second.id).completed is True
+        json_again.delete_todo(first.id)
+        assert list(TodoStorage(str(self.data_file), snapshot_format="binary").todos) == [second.id]
+        
+        with pytest.raises(ValueError):
+            list(decode_snapshot(self.data_file.read_bytes()))
+    
+    def test_query_cache(self):
+        """测试查询结果缓存: 相同条件命中缓存, 写入后失效, 超出容量时按LRU淘汰"""
+        from main import TodoUpdate
+        storage = TodoStorage(str(self.data_file), query_cache_size=2)
+        first = storage.create_todo(TodoCreate(title="缓存 ABC", priority="high"))
+        storage.create_todo(TodoCreate(title="其他", priority="low"))
+        
+        assert storage.filter_todos(search="abc") == [first]
+        result = storage.filter_todos(search="ABC")
+        assert result == [first]
+        assert storage.query_cache_stats == {"hits": 1, "misses": 1, "evictions": 0}
+        result.clear()
+        assert storage.filter_todos(search="abc") == [first]
+        
+        storage.update_todo(first.id, TodoUpdate(title="已修改"))
+        assert storage.filter_todos(search="abc") == []
+        assert storage.query_cache_stats["misses"] == 2
+        
+        storage.filter_todos_encoded(priority="high")
+        storage.filter_todos(status="pending")
+        assert storage.query_cache_stats["evictions"] == 1
+        assert len(storage._query_cache) == 2
+        
+        # 带游标的查询不经过缓存, 也不计入未命中
+        page = storage.filter_todos_encoded(limit=1)
+        storage.filter_todos_encoded(after=page[0][0], limit=1)
+        assert storage.query_cache_stats["misses"] == 5
+        assert TodoStorage(str(self.data_file), query_cache_size=0).filter_todos() == storage.filter_todos()
+    
+    def test_sharded_snapshot(self, monkeypatch):
+        """测试分片快照: 只重写被修改的分片, 并行加载, 从单文件和不同分片数迁移"""
+        from main import TodoUpdate
+        sharded = TodoStorage(str(self.data_file), shards=4)
+        todos = sharded.create_todos([TodoCreate(title=f"分片 {i}") for i in range(40)])
+        files = sorted(path.name for path in Path(self.temp_dir).glob("*.shard-*"))
+        assert files and set(files) <= {f"test_storage.shard-{i:03d}-of-004.json" for i in range(4)}
+        assert not self.data_file.exists()
+        
+        written = []
+        original_write = sharded._write_file_atomic
+        sharded._write_file_atomic = lambda path, records: written.append(path) or original_write(path, records)
+        target = todos[7]
+        sharded.update_todo(target.id, TodoUpdate(completed=True))
+        assert written == [sharded.shard_file(sharded.shard_of(target.id))]
+        written.clear()
+        sharded.delete_todo(todos[8].id)
+        assert written == [sharded.shard_file(sharded.shard_of(todos[8].id))]
+        
+        reloaded = TodoStorage(str(self.data_file), shards=4)
+        assert reloaded._dirty_shards == set()
+        assert len(reloaded.todos) == 39
+        assert reloaded.get_todo(target.id).completed is True
+        assert reloaded.get_stats() == sharded.get_stats()
+        
+        # 改变分片数: 第一次保存写出全部新分片并删除旧分片
+        resharded = TodoStorage(str(self.data_file), shards=2)
+        assert resharded._dirty_shards == {0, 1}
+        resharded.create_todo(TodoCreate(title="重新分片"))
+        files = sorted(path.name for path in Path(self.temp_dir).glob("*.shard-*"))
+        assert files == ["test_storage.shard-000-of-002.json", "test_storage.shard-001-of-002.json"]
+        assert len(TodoStorage(str(self.data_file), shards=2).todos) == 40
+        
+        # 单文件JSON快照迁移为二进制分片
+        single_file = str(Path(self.temp_dir) / "single.json")
+        TodoStorage(single_file).create_todos([TodoCreate(title=f"单文件 {i}") for i in range(5)])
+        binary = TodoStorage(single_file, shards=3, snapshot_format="binary")
+        assert len(binary.todos) == 5
+        binary.save_todos()
+        assert len(list(Path(self.temp_dir).glob("single.shard-*-of-003.bin"))) == 3
+        assert TodoStorage(single_file, shards=3, snapshot_format="binary").todos.keys() \
+            == binary.todos.keys()
+        assert not Path(single_file).exists()
+        
+        # 分片改回单文件: 读取较新的分片而不是迁移前留下的单文件
+        back_file = str(Path(self.temp_dir) / "back.json")
+        TodoStorage(back_file).create_todo(TodoCreate(title="分片前"))
+        TodoStorage(back_file, shards=4).create_todo(TodoCreate(title="分片后"))
+        unsharded = TodoStorage(back_file)
+        assert len(unsharded.todos) == 2
+        unsharded.create_todo(TodoCreate(title="改回单文件后"))
+        assert not list(Path(self.temp_dir).glob("back.shard-*"))
+        assert len(TodoStorage(back_file).todos) == 3
+        
+        # 二进制分片在线程池中解码, 而不只是在线程池中读取文件
+        import threading
+        decode_threads = set()
+        original_decode = main.decode_snapshot
+        
+        def recording_decode(data):
+            for todo in original_decode(data):
+                decode_threads.add(threading.current_thread().name)
+                yield todo
+        
+        monkeypatch.setattr(main, "decode_snapshot", recording_decode)
+        assert len(TodoStorage(single_file, shards=3, snapshot_format="binary").todos) == 5
+        assert decode_threads and all(name.startswith("todo-shard-load")
+                                      for name in decode_threads)
+
+
+class TestTodoJournal:
+    """追加日志持久化测试类"""
+    
+    def setup_method(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.data_file = Path(self.temp_dir) / "journal_todos.json"
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def make_storage(self, **kwargs):
+        """创建日志模式的存储"""
+        return TodoStorage(str(self.data_file), persistence="journal", **kwargs)
+    
+    def test_mutations_append_to_journal(self):
+        """测试每次修改只追加一条日志记录, 不重写快照"""
+        from main import TodoUpdate
+        storage = self.make_storage()
+        todo = storage.create_todo(TodoCreate(title="任务1"))
+        storage.update_todo(todo.id, TodoUpdate(completed=True))
+        storage.delete_todo(todo.id)
+        storage.close()
+        
+        assert not self.data_file.exists()
+        lines = storage.journal_file.read_text(encoding="utf-8").splitlines()
+        assert [json.loads(line)["op"] for line in lines] == ["put", "put", "delete"]
+    
+    def test_replay_journal_on_startup(self):
+        """测试启动时在快照之上重放日志"""
+        from main import TodoUpdate
+        storage = self.make_storage()
+        kept = storage.create_todo(TodoCreate(title="保留"))
+        removed = storage.create_todo(TodoCreate(title="删除"))
+        storage.save_todos()
+        storage.update_todo(kept.id, TodoUpdate(title="保留(已更新)"))
+        storage.delete_todo(removed.id)
+        storage.close()
+        
+        reloaded = self.make_storage()
+        assert list(reloaded.todos) == [kept.id]
+        assert reloaded.get_todo(kept.id).title == "保留(已更新)"
+        reloaded.close()
+    
+    def test_torn_tail_record_is_ignored(self):
+        """测试日志末尾写了一半的记录被忽略"""
+        storage = self.make_storage()
+        todo = storage.create_todo(TodoCreate(title="完整记录"))
+        storage.close()
+        with open(storage.journal_file, "a", encoding="utf-8") as f:
+            f.write('{"op": "put", "todo": {"id": ')
+        
+        reloaded = self.make_storage()
+        assert list(reloaded.todos) == [todo.id]
+        reloaded.close()
+    
+    def test_background_compaction(self):
+        """测试日志超过阈值后被合并进快照"""
+        storage = self.make_storage(compact_threshold=3)
+        ids = [storage.create_todo(TodoCreate(title=f"任务{i}")).id for i in range(4)]
+        storage.wait_for_compaction()
+        storage.close()
+        
+        assert not storage.sealed_journal_file.exists()
+        with open(self.data_file, "r", encoding="utf-8") as f:
+            assert len(json.load(f)) == 3
+        
+        reloaded = self.make_storage()
+        assert sorted(reloaded.todos) == sorted(ids)
+        reloaded.close()
+
+
+class TestGroupCommit:
+    """组提交测试类"""
+    
+    def setup_method(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.data_file = Path(self.temp_dir) / "group_todos.json"
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_storage_defers_writes_until_flush(self):
+        """测试组提交模式下修改在 flush() 时才一次性写入"""
+        for persistence in ("snapshot", "journal"):
+            storage = TodoStorage(str(self.data_file), persistence=persistence)
+            storage.group_commit = True
+            for i in range(3):
+                storage.create_todo(TodoCreate(title=f"任务{i}"))
+            assert not self.data_file.exists()
+            assert not storage.journal_file.exists()
+            assert storage.has_pending_changes
+            
+            storage.flush()
+            assert not storage.has_pending_changes
+            storage.close()
+            reloaded = TodoStorage(str(self.data_file), persistence=persistence)
+            assert len(reloaded.todos) == 3
+            reloaded.close()
+            
+            for path in Path(self.temp_dir).iterdir():
+                path.unlink()
+    
+    def test_flusher_batches_and_acks(self):
+        """测试多个修改合并为一次落盘, 持久化确认在落盘后返回"""
+        import asyncio
+        from main import GroupCommitFlusher
+        storage = TodoStorage(str(self.data_file), persistence="journal")
+        
+        async def scenario():
+            flusher = GroupCommitFlusher(AsyncTodoStorage(storage), interval_ms=20,
+                                         max_pending=1000)
+            flusher.start()
+            for i in range(10):
+                storage.create_todo(TodoCreate(title=f"任务{i}"))
+                flusher.mark_dirty()
+            storage.create_todo(TodoCreate(title="需要确认"))
+            await flusher.commit(durable=True)
+            # 持久化确认返回时日志中已有全部记录
+            assert len(storage.journal_file.read_text(encoding="utf-8").splitlines()) == 11
+            assert flusher.flush_count == 1
+            await flusher.stop()
+        
+        asyncio.run(scenario())
+        storage.close()
+    
+    def test_flusher_flushes_early_when_full(self):
+        """测试积累到 max_pending 个修改后立即落盘"""
+        import asyncio
+        from main import GroupCommitFlusher
+        storage = TodoStorage(str(self.data_file), persistence="journal")
+        
+        async def scenario():
+            flusher = GroupCommitFlusher(AsyncTodoStorage(storage), interval_ms=60000,
+                                         max_pending=3)
+            flusher.start()
+            waiters = []
+            for i in range(3):
+                storage.create_todo(TodoCreate(title=f"任务{i}"))
+                waiters.append(flusher.mark_dirty())
+            await asyncio.wait_for(asyncio.gather(*waiters), timeout=5)
+            await flusher.stop()
+        
+        asyncio.run(scenario())
+        assert len(storage.journal_file.read_text(encoding="utf-8").splitlines()) == 3
+        storage.close()
+
+    def test_stop_during_flush_acks_waiters(self):
+        """测试在落盘途中停止时, 这次落盘的等待者仍会得到通知"""
+        import asyncio
+        from main import GroupCommitFlusher
+        storage = TodoStorage(str(self.data_file), persistence="journal")
+        async_storage = AsyncTodoStorage(storage)
+        flush = async_storage.flush
+        
+        async def slow_flush():
+            await asyncio.sleep(0.2)
+            await flush()
+        
+        async_storage.flush = slow_flush
+        
+        async def scenario():
+            flusher = GroupCommitFlusher(async_storage, interval_ms=10, max_pending=1000)
+            flusher.start()
+            storage.create_todo(TodoCreate(title="任务"))
+            waiter = flusher.mark_dirty()
+            await asyncio.sleep(0.05)  # 后台任务已取出等待者, 正在落盘
+            await flusher.stop()
+            await asyncio.wait_for(waiter, timeout=5)
+        
+        asyncio.run(scenario())
+        assert len(storage.journal_file.read_text(encoding="utf-8").splitlines()) == 1
+        storage.close()
+
+
+class TestAsyncStorageLatency:
+    """异步存储门面延迟测试类"""
+    
+    def setup_method(self):
+        """测试前准备: 预先写入足够多的数据, 让一次完整落盘明显耗时"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage = TodoStorage(str(Path(self.temp_dir) / "latency_todos.json"))
+        self.todos = self.storage.create_todos(
+            [TodoCreate(title=f"任务{i}", description="描述" * 10) for i in range(5000)]
+        )
+        self.original_storage = main.storage
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        main.storage = self.original_storage
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    @pytest.mark.slow
+    def test_reads_stay_fast_while_writes_flush(self):
+        """测试写请求落盘期间 GET /todos/{id} 的p99延迟保持平稳"""
+        import asyncio
+        import time
+        import httpx
+        
+        start = time.perf_counter()
+        self.storage.save_todos()
+        save_seconds = time.perf_counter() - start
+        main.storage = AsyncTodoStorage(self.storage)
+        
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+                url = f"/todos/{self.todos[0].id}"
+                
+                async def measure(count):
+                    latencies = []
+                    for _ in range(count):
+                        started = time.perf_counter()
+                        response = await ac.get(url)
+                        latencies.append(time.perf_counter() - started)
+                        assert response.status_code == 200
+                        await asyncio.sleep(0.002)
+                    return latencies
+                
+                idle = await measure(30)
+                writes = 0
+                stop = asyncio.Event()
+                
+                async def writer():
+                    nonlocal writes
+                    while not stop.is_set():
+                        await ac.post("/todos", json={"title": "并发写入"})
+                        writes += 1
+                
+                writer_task = asyncio.create_task(writer())
+                busy = await measure(60)
+                stop.set()
+                await writer_task
+                return idle, busy, writes
+        
+        idle, busy, writes = asyncio.run(scenario())
+        
+        def p99(latencies):
+            return sorted(latencies)[int(len(latencies) * 0.99) - 1]
+        
+        assert writes >= 2
+        # 同步落盘时读请求至少要等一次完整落盘; 使用门面后应远小于它
+        assert p99(busy) < save_seconds / 4, (p99(idle), p99(busy), save_seconds)
+
+
+class TestAdmissionControl:
+    """准入控制测试类"""
+    
+    def test_token_bucket_per_client(self):
+        """测试每个客户端独立的令牌桶"""
+        from main import AdmissionController
+        controller = AdmissionController(rate=0.01, burst=2)
+        assert controller.take_token("a") == 0
+        assert controller.take_token("a") == 0
+        assert controller.take_token("a") > 1
+        assert controller.take_token("b") == 0
+        assert controller.metrics["rejected_rate_limited"] == 1
+    
+    def test_concurrency_cap_and_queue(self):
+        """测试并发上限: 排队超时被拒绝, 名额释放时直接转交给排队的请求"""
+        import asyncio
+        from main import AdmissionController
+        controller = AdmissionController(max_concurrency=1, max_queue_wait=0.05)
+        
+        async def scenario():
+            assert await controller.acquire() is True
+            assert await controller.acquire() is False
+            
+            async def release_later():
+                await asyncio.sleep(0.01)
+                controller.release()
+            
+            releaser = asyncio.ensure_future(release_later())
+            assert await controller.acquire() is True
+            await releaser
+            assert controller.in_flight == 1
+            controller.release()
+            assert controller.in_flight == 0
+        
+        asyncio.run(scenario())
+        snapshot = controller.snapshot()
+        assert snapshot["admitted"] == 2
+        assert snapshot["rejected_overloaded"] == 1
+        assert snapshot["queued"] == 2
+        assert 0 < snapshot["queue_wait_seconds_max"] < 0.05
+        assert sum(snapshot["queue_wait_buckets"].values()) == 2
+    
+    def test_cancelled_waiter_does_not_leak_slot(self):
+        """测试排队中被取消的请求不会占住名额"""
+        import asyncio
+        from main import AdmissionController
+        controller = AdmissionController(max_concurrency=1, max_queue_wait=5)
+        
+        async def scenario():
+            assert await controller.acquire() is True
+            queued = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0.01)
+            queued.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await queued
+            controller.release()
+            assert controller.in_flight == 0
+            assert await asyncio.wait_for(controller.acquire(), 1) is True
+            
+            # 名额已转交时才被取消: 要么仍然拿到名额, 要么把名额归还
+            queued = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0.01)
+            controller.release()
+            queued.cancel()
+            try:
+                assert await queued is True
+                controller.release()
+            except asyncio.CancelledError:
+                pass
+            assert controller.in_flight == 0
+        
+        asyncio.run(scenario())
+        assert controller.snapshot()["queue_length"] == 0
+    
+    def test_middleware_sheds_load(self):
+        """测试中间件在超过并发上限时返回503和 Retry-After"""
+        import asyncio
+        import httpx
+        from main import AdmissionController, AdmissionMiddleware
+        
+        async def slow_app(scope, receive, send):
+            await asyncio.sleep(0.2)
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+        
+        controller = AdmissionController(max_concurrency=1, max_queue_wait=0.01)
+        transport = httpx.ASGITransport(app=AdmissionMiddleware(slow_app, controller))
+        
+        async def scenario():
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                return await asyncio.gather(http.get("/todos"), http.get("/todos"))
+        
+        responses = sorted(asyncio.run(scenario()), key=lambda response: response.status_code)
+        assert [response.status_code for response in responses] == [200, 503]
+        assert responses[1].headers["Retry-After"] == "1"
+        assert controller.in_flight == 0
+    
+    def test_rate_limit_through_api(self):
+        """测试API上的限速以及 /admission 指标"""
+        original = (main.admission.rate, main.admission.burst)
+        main.admission.rate, main.admission.burst = 0.01, 2
+        try:
+            headers = {"X-Client-Id": "rate-limit-test"}
+            assert client.get("/", headers=headers).status_code == 200
+            assert client.get("/", headers=headers).status_code == 200
+            response = client.get("/", headers=headers)
+            assert response.status_code == 503
+            assert int(response.headers["Retry-After"]) >= 1
+            assert client.get("/", headers={"X-Client-Id": "other-client"}).status_code == 200
+            assert client.get("/admission").json()["rejected_rate_limited"] >= 1
+        finally:
+            main.admission.rate, main.admission.burst = original
+            main.admission._buckets.clear()
+
+
+def metric_value(text: str, sample: str) -> float:
+    """从Prometheus文本中取出一个样本的值, 不存在时返回0"""
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+class TestMetrics:
+    """监控指标测试类"""
+    
+    def setup_method(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.original_storage = main.storage
+        main.storage = AsyncTodoStorage(TodoStorage(str(Path(self.temp_dir) / "todos.json")))
+    
+    def teardown_method(self):
+        import shutil
+        main.storage = self.original_storage
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_registry_render(self):
+        """测试文本格式: 累计的直方图桶、_sum/_count 和标签转义"""
+        from main import MetricsRegistry
+        registry = MetricsRegistry()
+        counter = registry.counter("c_total", "计数", ("path",))
+        histogram = registry.histogram("h_seconds", "耗时", (0.1, 1.0))
+        counter.inc('a"b\\c')
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value)
+        
+        text = registry.render()
+        assert "# TYPE c_total counter" in text
+        assert 'c_total{path="a\\"b\\\\c"} 1' in text
+        assert metric_value(text, 'h_seconds_bucket{le="0.1"}') == 1
+        assert metric_value(text, 'h_seconds_bucket{le="1.0"}') == 2
+        assert metric_value(text, 'h_seconds_bucket{le="+Inf"}') == 3
+        assert metric_value(text, "h_seconds_count") == 3
+        assert metric_value(text, "h_seconds_sum") == pytest.approx(5.55)
+        
+        # 多个线程同时更新(多租户时各租户并行落盘)不会丢失计数
+        from concurrent.futures import ThreadPoolExecutor
+        
+        def observe_many(_):
+            for _ in range(2000):
+                counter.inc("x")
+                histogram.observe(0.5)
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(observe_many, range(4)))
+        text = registry.render()
+        assert metric_value(text, 'c_total{path="x"}') == 8000
+        assert metric_value(text, "h_seconds_count") == 8003
+    
+    def test_metrics_endpoint(self):
+        """测试 /metrics: 按路由模板统计请求, 记录落盘耗时和字节数, 导出存储大小"""
+        before = client.get("/metrics").text
+        todo_id = client.post("/todos", json={"title": "指标"}).json()["id"]
+        client.get(f"/todos/{todo_id}/toggle")
+        client.post("/todos", json={"title": "未完成"})
+        assert client.get("/todos/missing").status_code == 404
+        
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = response.text
+        
+        def delta(sample):
+            return metric_value(text, sample) - metric_value(before, sample)
+        
+        assert delta('todo_http_requests_total{method="POST",route="/todos",status="201"}') == 2
+        assert delta('todo_http_requests_total{method="GET",route="/todos/{todo_id}",status="404"}') == 1
+        assert delta('todo_http_request_duration_seconds_count{method="GET",route="/todos/{todo_id}/toggle"}') == 1
+        assert delta('todo_storage_save_seconds_count{kind="snapshot"}') == 3
+        assert delta('todo_storage_save_bytes_sum{kind="snapshot"}') > 0
+        assert metric_value(text, 'todo_store_todos{status="completed"}') == 1
+        assert metric_value(text, 'todo_store_todos{status="pending"}') == 1
+        assert metric_value(text, "todo_store_generation") == 3
+        assert "todo_admission_rejected_total" in text
+    
+    def test_event_loop_lag_probe(self):
+        """测试事件循环被同步代码阻塞时探针记录到延迟"""
+        import asyncio
+        import time
+        from main import EventLoopLagProbe, LOOP_LAG_SECONDS, LOOP_LAG_LAST
+        count_before = sum(LOOP_LAG_SECONDS.values.get((), [[0]])[0])
+        
+        async def scenario():
+            probe = EventLoopLagProbe(interval=0.01)
+            probe.start()
+            await asyncio.sleep(0.005)
+            time.sleep(0.1)
+            await asyncio.sleep(0.02)
+            await probe.stop()
+        
+        asyncio.run(scenario())
+        assert sum(LOOP_LAG_SECONDS.values[()][0]) > count_before
+        assert LOOP_LAG_SECONDS.values[()][1] >= 0.05
+
+
+class TestBenchmarkTools:
+    """负载测试和基准测试工具测试类"""
+    
+    def test_in_process_run(self):
+        """测试进程内压测: 请求数、各端点的百分位和请求比例解析"""
+        import asyncio
+        from loadtest import run_load_test, parse_mix
+        original_storage = main.storage
+        report = asyncio.run(run_load_test(clients=3, duration=30, requests_per_client=20,
+                                           mix="create=1,get=3,list=1,delete=1", todos=10))
+        assert main.storage is original_storage
+        assert report["requests"] == 60
+        assert report["errors"] == 0
+        assert set(report["endpoints"]) <= {"create", "get", "list", "delete"}
+        for endpoint in report["endpoints"].values():
+            assert 0 < endpoint["p50_ms"] <= endpoint["p95_ms"] <= endpoint["p99_ms"] <= endpoint["max_ms"]
+        assert report["throughput_rps"] > 0
+        with pytest.raises(ValueError):
+            parse_mix("get=1,unknown=2")
+    
+    def test_storage_benchmark(self, monkeypatch):
+        """测试存储基准测试: 各操作都有结果, 吞吐量下降超过阈值时报告退化"""
+        import copy
+        import bench_storage
+        from bench_storage import bench_size, compare, filter_combinations
+        storages = []
+        
+        class RecordingStorage(TodoStorage):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                storages.append(self)
+        
+        monkeypatch.setattr(bench_storage, "TodoStorage", RecordingStorage)
+        results = bench_size(200, ops=10, formats=["json", "binary"])
+        assert len(filter_combinations()) == 8
+        for name in ("create_todo", "get_todo", "update_todo", "delete_todo",
+                     "filter_todos[status+priority+search]", "load_todos[binary]", "save_todos[json]"):
+            assert results[name]["ops_per_sec"] > 0
+        # 过滤查询每次都实际执行, 不是查询缓存的命中
+        assert storages[-1].query_cache_stats["hits"] == 0
+        
+        current = {"results": {"200": results}}
+        assert compare(current, current, threshold=0.2) == []
+        baseline = copy.deepcopy(current)
+        baseline["results"]["200"]["get_todo"]["ops_per_sec"] = results["get_todo"]["ops_per_sec"] * 2
+        regressions = compare(current, baseline, threshold=0.2)
+        assert [item["operation"] for item in regressions] == ["get_todo"]
+
+
+class TestMultiTenant:
+    """多租户存储测试类"""
+    
+    def setup_method(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.original_storage = main.storage
+    
+    def teardown_method(self):
+        import shutil
+        main.storage = self.original_storage
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def make_tenants(self, **kwargs):
+        from main import TenantStorage
+        return TenantStorage(lambda tenant: TodoStorage(str(Path(self.temp_dir) / f"{tenant}.json")),
+                             **kwargs)
+    
+    def test_tenant_isolation_through_api(self):
+        """测试按请求头和路径前缀选择租户, 各租户的数据互不可见"""
+        main.storage = tenants = self.make_tenants()
+        todo = client.post("/todos", json={"title": "租户A"}, headers={"X-Tenant-Id": "alpha"}).json()
+        assert client.post("/tenants/beta/todos", json={"title": "租户B"}).status_code == 201
+        
+        assert [t["title"] for t in client.get("/tenants/alpha/todos").json()] == ["租户A"]
+        assert [t["title"] for t in client.get("/todos", headers={"X-Tenant-Id": "beta"}).json()] == ["租户B"]
+        assert client.get("/todos").json() == []
+        assert client.get(f"/tenants/alpha/todos/{todo['id']}").json()["title"] == "租户A"
+        assert client.get(f"/tenants/beta/todos/{todo['id']}").status_code == 404
+        assert client.get("/todos", headers={"X-Tenant-Id": "../etc"}).status_code == 400
+        assert sorted(tenants.resident_tenants()) == ["alpha", "beta", "default"]
+        assert (Path(self.temp_dir) / "alpha.json").exists()
+        assert "todo_tenants_resident 3" in client.get("/metrics").text
+    
+    def test_lru_eviction_flushes_first(self):
+        """测试超过租户数上限时淘汰最久未使用的租户, 淘汰前把推迟的修改落盘"""
+        import asyncio
+        tenants = self.make_tenants(max_tenants=2)
+        tenants.auto_flush = False
+        
+        async def use(tenant, title=None):
+            storage = await tenants.acquire(tenant)
+            try:
+                if title is not None:
+                    await storage.create_todo(TodoCreate(title=title))
+                return [todo.title for todo in await storage.filter_todos()]
+            finally:
+                await tenants.release(tenant)
+        
+        async def scenario():
+            await use("a", "a的待办")
+            assert not (Path(self.temp_dir) / "a.json").exists()
+            await use("b", "b的待办")
+            await use("a")
+            await use("c")
+            assert tenants.resident_tenants() == ["a", "c"]
+            assert (Path(self.temp_dir) / "b.json").exists()
+            assert await use("b") == ["b的待办"]
+        
+        asyncio.run(scenario())
+        assert tenants.metrics["evictions"] == 2
+        assert tenants.metrics["loads"] == 4
+    
+    def test_memory_budget_and_in_use_tenants(self):
+        """测试按估算内存淘汰空闲租户, 正在使用的租户不会被淘汰"""
+        import asyncio
+        from main import TenantStorage
+        tenants = self.make_tenants(memory_budget=2 * TenantStorage.STORE_BYTES + 3 * TenantStorage.TODO_BYTES)
+        
+        async def scenario():
+            storage = await tenants.acquire("big")
+            await storage.create_todos([TodoCreate(title=f"待办 {i}") for i in range(5)])
+            await tenants.acquire("small")
+            # big 仍在使用中, 超出预算也不能淘汰
+            assert tenants.resident_tenants() == ["big", "small"]
+            await tenants.release("big")
+            assert tenants.resident_tenants() == ["small"]
+            assert tenants.resident_bytes == TenantStorage.STORE_BYTES
+            await tenants.release("small")
+            reloaded = await tenants.acquire("big")
+            assert len(await reloaded.filter_todos()) == 5
+            await tenants.release("big")
+        
+        asyncio.run(scenario())
+
+
+class TestServe:
+    """生产模式启动测试类"""
+    
+    def test_serve_config(self):
+        """测试事件循环和HTTP解析器的自动选择以及keep-alive等参数"""
+        import argparse
+        from main import serve_config, module_available
+        args = argparse.Namespace(host="127.0.0.1", port=9000, loop="auto", http="h11",
+                                  keep_alive=20, graceful_timeout=5, backlog=128,
+                                  access_log=False, log_level="warning")
+        config = serve_config(args)
+        assert config["loop"] == ("uvloop" if module_available("uvloop") else "asyncio")
+        assert config["http"] == "h11"
+        assert config["timeout_keep_alive"] == 20
+        assert config["timeout_graceful_shutdown"] == 5
+    
+    def test_default_workers(self, monkeypatch):
+        """测试默认工作进程数: 内存后端为1, 共享后端为CPU核数"""
+        from main import default_workers
+        monkeypatch.delenv("TODO_WORKERS", raising=False)
+        monkeypatch.delenv("TODO_STORAGE_BACKEND", raising=False)
+        monkeypatch.setattr(os, "cpu_count", lambda: 8)
+        assert default_workers() == 1
+        monkeypatch.setenv("TODO_STORAGE_BACKEND", "shared")
+        assert default_workers() == 8
+        monkeypatch.setenv("TODO_WORKERS", "3")
+        assert default_workers() == 3
+    
+    def test_supervisor_backs_off_and_gives_up(self):
+        """测试工作进程启动后立即退出时按指数退避重启, 连续失败后放弃"""
+        import time
+        from main import PreforkSupervisor
+        
+        class CountingSupervisor(PreforkSupervisor):
+            BACKOFF_BASE = 0.05
+            MAX_START_FAILURES = 4
+            spawned = 0
+            
+            def spawn(self):
+                self.spawned += 1
+                super().spawn()
+        
+        supervisor = CountingSupervisor(2, lambda: 1)
+        start = time.monotonic()
+        assert supervisor.run() == 1
+        # 2个初始进程 + 3次重启(第4次失败时放弃), 退避 0.05 + 0.1 + 0.2 秒
+        assert supervisor.spawned == 5
+        assert time.monotonic() - start >= 0.35
+        assert supervisor.workers == {}
+        
+        assert supervisor.restart_delay(time.monotonic() - 10) == 0.0
+        assert supervisor.start_failures == 0
+    
+    def test_graceful_shutdown_flushes_storage(self):
+        """测试 SIGTERM 时服务排空请求, 并把组提交中尚未落盘的修改写入磁盘"""
+        import signal
+        import subprocess
+        import sys
+        from bench_serve import free_port
+        import httpx
+        
+        temp_dir = tempfile.mkdtemp()
+        port = free_port()
+        env = dict(os.environ, TODO_GROUP_COMMIT="1", TODO_FLUSH_INTERVAL_MS="60000",
+                   TODO_FLUSH_MAX_PENDING="1000000", TODO_LOOP_LAG_INTERVAL_MS="0")
+        main_file = Path(main.__file__).resolve()
+        process = subprocess.Popen(
+            [sys.executable, str(main_file), "serve", "--host", "127.0.0.1",
+             "--port", str(port), "--workers", "1"],
+            cwd=temp_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            for _ in range(100):
+                try:
+                    httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+                    break
+                except httpx.HTTPError:
+                    import time
+                    time.sleep(0.1)
+            response = httpx.post(f"http://127.0.0.1:{port}/todos", json={"title": "退出前落盘"})
+            assert response.status_code == 201
+            assert not (Path(temp_dir) / "todos.json").exists()
+            process.send_signal(signal.SIGTERM)
+            assert process.wait(30) == 0
+            with open(Path(temp_dir) / "todos.json", encoding="utf-8") as f:
+                assert [todo["title"] for todo in json.load(f)] == ["退出前落盘"]
+        finally:
+            if process.poll() is None:
+                process.kill()
+            import shutil
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+class TestSQLiteTodoStorage:
+    """SQLite存储测试类"""
+    
+    def setup_method(self):
+        """测试前准备"""
+        from main import SQLiteTodoStorage
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_file = Path(self.temp_dir) / "test_todos.db"
+        self.storage = SQLiteTodoStorage(str(self.db_file))
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        self.storage.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_crud(self):
+        """测试增删改查"""
+        from main import TodoUpdate
+        todo = self.storage.create_todo(TodoCreate(title="SQLite任务", priority="high"))
+        assert self.storage.get_todo(todo.id).title == "SQLite任务"
+        
+        updated = self.storage.update_todo(todo.id, TodoUpdate(completed=True))
+        assert updated.completed is True
+        assert updated.priority == "high"
+        assert updated.updated_at >= todo.updated_at
+        
+        assert self.storage.delete_todo(todo.id) is True
+        assert self.storage.get_todo(todo.id) is None
+        assert self.storage.update_todo(todo.id, TodoUpdate(title="x")) is None
+        assert self.storage.delete_todo(todo.id) is False
+    
+    def test_filter_todos(self):
+        """测试过滤结果与内存存储一致"""
+        memory_storage = TodoStorage(str(Path(self.temp_dir) / "memory.json"))
+        samples = [
+            TodoCreate(title="学习Python", description="深入学习", priority="high"),
+            TodoCreate(title="写周报", priority="high", completed=True),
+            TodoCreate(title="跑步", description="python之外的爱好", priority="low"),
+            TodoCreate(title="买菜", priority="medium"),
+        ]
+        for sample in samples:
+            self.storage.create_todo(sample)
+            memory_storage.create_todo(sample)
+        
+        for filters in [{}, {"status": "pending"}, {"status": "completed"},
+                        {"priority": "high"}, {"status": "pending", "priority": "high"},
+                        {"search": "PYTHON"}, {"search": "python", "priority": "low"}]:
+            expected = [todo.title for todo in memory_storage.filter_todos(**filters)]
+            actual = [todo.title for todo in self.storage.filter_todos(**filters)]
+            assert actual == expected, filters
+    
+    def test_cursor_pagination(self):
+        """测试SQLite后端的游标分页"""
+        from main import encode_cursor, decode_cursor
+        ids = [self.storage.create_todo(TodoCreate(title=f"任务{i}")).id for i in range(5)]
+        first_page = self.storage.filter_todos(limit=2)
+        assert [todo.id for todo in first_page] == ids[:2]
+        
+        after = decode_cursor(encode_cursor(first_page[-1]))
+        rest = self.storage.filter_todos(after=after)
+        assert [todo.id for todo in rest] == ids[2:]
+    
+    def test_batch_operations(self):
+        """测试SQLite后端的批量操作"""
+        from main import TodoUpdate
+        todos = self.storage.create_todos([TodoCreate(title=f"任务{i}") for i in range(3)])
+        updated = self.storage.update_todos([(todos[0].id, TodoUpdate(priority="high")),
+                                             ("non-existent-id", TodoUpdate(title="x"))])
+        assert updated[0].priority == "high" and updated[1] is None
+        assert self.storage.delete_todos([todos[1].id, todos[1].id]) == [True, False]
+        fetched = self.storage.get_todos([todos[2].id, todos[1].id, todos[0].id])
+        assert [todo and todo.id for todo in fetched] == [todos[2].id, None, todos[0].id]
+    
+    def test_import_upserts(self):
+        """测试导入覆盖已有id时计数保持正确"""
+        from main import verify_stats
+        todo = self.storage.create_todo(TodoCreate(title="原始", priority="low"))
+        replacement = todo.copy(update={"title": "导入", "priority": "high", "completed": True})
+        assert self.storage.import_todos([replacement]) == 1
+        assert self.storage.get_todo(todo.id).title == "导入"
+        assert self.storage.get_stats()["by_priority"]["high"] == 1
+        assert verify_stats(self.storage) == {}
+    
+    def test_generation_and_versions(self):
+        """测试写入代数和版本号"""
+        from main import TodoUpdate, SQLiteTodoStorage
+        start = self.storage.generation
+        todo = self.storage.create_todo(TodoCreate(title="版本"))
+        other = self.storage.create_todo(TodoCreate(title="其他"))
+        version = self.storage.get_todo_version(todo.id)
+        assert version == start + 1
+        
+        self.storage.update_todo(other.id, TodoUpdate(completed=True))
+        assert self.storage.get_todo_version(todo.id) == version
+        self.storage.update_todo(todo.id, TodoUpdate(title="新版本"))
+        assert self.storage.get_todo_version(todo.id) == start + 4
+        self.storage.delete_todo(other.id)
+        assert self.storage.generation == start + 5
+        assert self.storage.get_todo_version(other.id) is None
+        
+        # 代数和存储标识保存在数据库中
+        self.storage.close()
+        self.storage = SQLiteTodoStorage(str(self.db_file))
+        assert self.storage.generation == start + 5
+    
+    def test_stats_counters(self):
+        """测试触发器维护的计数与重新统计一致"""
+        from main import TodoUpdate, verify_stats
+        todos = [self.storage.create_todo(TodoCreate(title=f"任务{i}", priority=p))
+                 for i, p in enumerate(["low", "high", "high", "medium"])]
+        self.storage.update_todo(todos[0].id, TodoUpdate(completed=True, priority="high"))
+        self.storage.update_todo(todos[1].id, TodoUpdate(title="只改标题"))
+        self.storage.delete_todo(todos[3].id)
+        
+        stats = self.storage.get_stats()
+        assert stats["total"] == 3
+        assert stats["completed"] == 1
+        assert stats["by_priority"] == {"high": 3, "medium": 0, "low": 0}
+        assert verify_stats(self.storage) == {}
+    
+    def test_change_feed(self):
+        """测试SQLite存储的变更记录"""
+        check_change_feed(self.storage)
+    
+    def test_filters_use_indexes(self):
+        """测试状态和优先级过滤走索引"""
+        plan = self.storage.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM todos WHERE completed = 0 AND priority = ?",
+            ("high",)
+        ).fetchall()
+        assert "idx_todos_completed_priority" in str(plan)
+    
+    def test_wal_mode(self):
+        """测试数据库使用WAL模式"""
+        mode = self.storage.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode == "wal"
+    
+    def test_api_with_sqlite_backend(self):
+        """测试API使用SQLite后端"""
+        original_storage = main.storage
+        main.storage = AsyncTodoStorage(self.storage)
+        try:
+            client.post("/todos", json={"title": "高优先级", "priority": "high"})
+            client.post("/todos", json={"title": "已完成", "priority": "high", "completed": True})
+            response = client.get("/todos?status=pending&priority=high")
+            assert [todo["title"] for todo in response.json()] == ["高优先级"]
+        finally:
+            main.storage = original_storage
+
+
+def create_shared_todos(db_file: str, worker: int, count: int):
+    """在子进程中向共享数据库写入待办事项"""
+    from main import SharedTodoStorage, TodoUpdate
+    storage = SharedTodoStorage(db_file)
+    for i in range(count):
+        todo = storage.create_todo(TodoCreate(title=f"进程{worker}-{i}"))
+        storage.toggle_todo(todo.id)
+        storage.update_todo(todo.id, TodoUpdate(priority="high"))
+    storage.close()
+
+
+class TestSharedTodoStorage:
+    """多进程共享存储测试类"""
+    
+    def setup_method(self):
+        """测试前准备"""
+        from main import SharedTodoStorage
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_file = str(Path(self.temp_dir) / "shared.db")
+        # 两个实例使用各自的数据库连接, 相当于两个工作进程
+        self.first = SharedTodoStorage(self.db_file)
+        self.second = SharedTodoStorage(self.db_file)
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        self.first.close()
+        self.second.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_writes_invalidate_other_caches(self):
+        """测试一个实例的写入会同步到另一个实例的缓存"""
+        from main import TodoUpdate
+        todo = self.first.create_todo(TodoCreate(title="共享", priority="low"))
+        assert self.second.get_todo(todo.id) == todo
+        assert self.second.filter_todos(search="共享") == [todo]
+        
+        self.second.update_todo(todo.id, TodoUpdate(title="已修改"))
+        assert self.first.get_todo(todo.id).title == "已修改"
+        assert self.first.filter_todos(search="共享") == []
+        assert self.first.get_todo_version(todo.id) == self.second.get_todo_version(todo.id)
+        assert self.first.generation == self.second.generation
+        assert self.first.store_id == self.second.store_id
+        
+        self.second.delete_todo(todo.id)
+        assert self.first.get_todo(todo.id) is None
+        assert self.first.get_stats()["total"] == 0
+        
+        # 删除后以同一id重新导入
+        self.first.import_todos([todo])
+        assert self.second.get_todo(todo.id) == todo
+        
+        # 另一个实例的写入推进数据库中的写入代数, 缓存的查询结果随之失效
+        assert self.first.filter_todos(priority="low") == [todo]
+        assert self.first.filter_todos(priority="low") == [todo]
+        assert self.first.query_cache_stats["hits"] >= 1
+        self.second.update_todo(todo.id, TodoUpdate(priority="high"))
+        assert self.first.filter_todos(priority="low") == []
+    
+    def test_stale_cache_reloads_after_tombstones_pruned(self):
+        """测试落后于墓碑保留期的进程重新加载全部数据"""
+        todo = self.first.create_todo(TodoCreate(title="将被删除"))
+        assert self.second.get_todo(todo.id) is not None
+        self.first.database.tombstone_retention = 0
+        self.first.delete_todo(todo.id)
+        self.first.create_todo(TodoCreate(title="之后创建"))
+        assert self.first.database.tombstone_floor > 0
+        assert self.second.get_todo(todo.id) is None
+        assert [t.title for t in self.second.get_all_todos()] == ["之后创建"]
+    
+    def test_concurrent_worker_processes(self):
+        """测试多个进程并发写入同一个数据库"""
+        import multiprocessing
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=create_shared_todos, args=(self.db_file, worker, 20))
+                   for worker in range(4)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join(60)
+            assert process.exitcode == 0
+        
+        stats = self.first.get_stats()
+        assert stats["total"] == 80
+        assert stats["completed"] == 80
+        assert stats["by_priority"]["high"] == 80
+        assert stats == self.first.recompute_stats()
+        assert self.first.database.get_stats() == self.first.database.recompute_stats()
+        assert self.first.generation == 240
 
 
 def run_tests():